@@ -0,0 +1,390 @@
+# benchmark.py - Offline end-to-end benchmark for the generation pipeline
+# Starts local stand-ins for the OpenAI chat API (plain and SSE streaming) and
+# the ElevenLabs TTS API, points main at them (OPENAI_BASE_URL / ELEVEN_API_BASE),
+# replays canned scripts at every complexity level and writes stage timings
+# plus microbenchmarks to a JSON file that can be diffed across commits.
+#
+#   python benchmark.py --out bench.json --latency 0.3 --tts-latency 0.2
+#
+# --tail-latency/--tail-every make some script completions slow, to see
+# hedged requests (SCRIPT_HEDGE_AFTER_SEC etc.) at work.
+#
+# Rendering needs manim and ffmpeg like the real service; when they are
+# missing the pipeline runs are recorded as failed at that stage and the
+# render microbenchmark is skipped.
+
+import argparse, json, os, sys, time, shutil, tempfile, threading, subprocess, statistics, platform
+from datetime import datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# One silent MPEG-1 Layer III frame: 128 kbps, 44.1 kHz, 1152 samples (~26 ms)
+SILENT_MP3_FRAME = bytes.fromhex("FFFB9064") + bytes(413)
+MP3_FRAME_SECONDS = 1152 / 44100
+
+LEVELS = {
+    # complexity: (segments, seconds per segment)
+    "simple": (3, 6.0),
+    "moderate": (8, 7.0),
+    "complex": (15, 8.0),
+    "comprehensive": (30, 9.0),
+}
+LAYOUTS = ["title", "calculation", "step", "equation", "split", "example", "diagram", "text"]
+
+
+# ---------------------------
+# Canned scripts
+# ---------------------------
+def canned_segment(level: str, i: int, seconds: float) -> dict:
+    layout = "title" if i == 0 else LAYOUTS[1 + (i - 1) % (len(LAYOUTS) - 1)]
+    narration = " ".join(f"{level} benchmark narration sentence {i} word {w}."
+                         for w in range(int(seconds * 2.5 / 6)))
+    seg = {
+        "narration": narration,
+        "display_text": f"{level.title()} segment {i + 1}: a^2 + b^2 = c^2",
+        "layout": layout,
+        "duration": seconds,
+        "color_scheme": ["blue", "green", "purple", "orange"][i % 4],
+    }
+    if layout == "calculation":
+        seg["step_data"] = {
+            "calculation_steps": [f"x + {i} = {i + 5}", f"x = {i + 5} - {i}", "x = 5"],
+            "annotations": ["Start", f"Subtract {i}", "Answer"],
+        }
+    return seg
+
+
+def canned_script(level: str) -> dict:
+    count, seconds = LEVELS[level]
+    return {
+        "title": f"Benchmark {level}",
+        "complexity": level,
+        "estimated_duration": count * seconds,
+        "segments": [canned_segment(level, i, seconds) for i in range(count)],
+    }
+
+
+def canned_analysis(level: str) -> dict:
+    count, seconds = LEVELS[level]
+    return {
+        "complexity": level,
+        "reasoning": "benchmark",
+        "recommended_duration": int(count * seconds),
+        "recommended_segments": count,
+        "is_procedural": level == "simple",
+        "key_concepts": ["benchmark"],
+    }
+
+
+def level_from_messages(messages: list) -> str:
+    text = " ".join(m.get("content", "") for m in messages)
+    for level in LEVELS:
+        if f"bench-{level}" in text:
+            return level
+    return "moderate"
+
+
+# ---------------------------
+# Fake servers
+# ---------------------------
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    """/v1/chat/completions: analysis JSON, script JSON, or the script as SSE chunks"""
+    latency = 0.0
+    tail_latency = 0.0
+    tail_every = 0
+    chunk_chars = 80
+    calls = 0
+    script_calls = 0
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        type(self).calls += 1
+        time.sleep(self.latency)
+        messages = body.get("messages", [])
+        level = level_from_messages(messages)
+        if any("Analyze this topic" in m.get("content", "") for m in messages):
+            content = json.dumps(canned_analysis(level))
+        else:
+            content = json.dumps(canned_script(level))
+            type(self).script_calls += 1
+            if self.tail_every and self.script_calls % self.tail_every == 1 % self.tail_every:
+                time.sleep(self.tail_latency)
+        try:
+            self._respond(body, content)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # The client cancelled this call (e.g. a hedge won)
+
+    def _respond(self, body: dict, content: str):
+        if body.get("stream"):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.end_headers()
+            for start in range(0, len(content), self.chunk_chars):
+                self._sse(self._chunk({"content": content[start:start + self.chunk_chars]}, None))
+                time.sleep(0.002)
+            self._sse(self._chunk({}, "stop"))
+            self.wfile.write(b"data: [DONE]\n\n")
+            return
+
+        payload = {
+            "id": "chatcmpl-bench",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "gpt-4o"),
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        }
+        data = json.dumps(payload).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    @staticmethod
+    def _chunk(delta: dict, finish_reason):
+        return {
+            "id": "chatcmpl-bench",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": "gpt-4o",
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+
+    def _sse(self, obj: dict):
+        self.wfile.write(f"data: {json.dumps(obj)}\n\n".encode())
+        self.wfile.flush()
+
+
+class FakeElevenLabsHandler(BaseHTTPRequestHandler):
+    """/v1/text-to-speech/<voice>: silent MP3 lasting ~2.5 words per second"""
+    latency = 0.0
+    calls = 0
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        type(self).calls += 1
+        time.sleep(self.latency)
+        seconds = max(1.0, len(body.get("text", "").split()) / 2.5)
+        data = SILENT_MP3_FRAME * int(seconds / MP3_FRAME_SECONDS)
+        self.send_response(200)
+        self.send_header("Content-Type", "audio/mpeg")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def start_server(handler) -> tuple:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+# ---------------------------
+# Benchmarks
+# ---------------------------
+def timed(fn, repeat: int) -> dict:
+    runs = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        runs.append(time.perf_counter() - started)
+    return {"runs": repeat, "best": round(min(runs), 6), "mean": round(statistics.mean(runs), 6)}
+
+
+def bench_pipeline(main, level: str, quality: str, stream: bool) -> dict:
+    data = {"prompt": f"bench-{level} topic", "quality": quality,
+            "fresh_script": True, "stream_script": stream}
+    stages = {}
+    started = time.perf_counter()
+    try:
+        result = main.run_generation_pipeline(data, on_progress=lambda **f: stages.update(f))
+        status, error, timestamp = "succeeded", None, result["timestamp"]
+    except Exception as e:
+        detail = getattr(e, "detail", None) or f"{type(e).__name__}: {e}"
+        status, error, timestamp = "failed", str(detail)[:500], stages.get("timestamp")
+    total = time.perf_counter() - started
+    row = main.INDEX.get(timestamp) if timestamp else None
+    return {
+        "status": status,
+        "error": error,
+        "failed_stage": stages.get("stage") if status == "failed" else None,
+        "segments": LEVELS[level][0],
+        "total_seconds": round(total, 3),
+        "stage_seconds": (row or {}).get("stage_timings") or {},
+        "timestamp": timestamp,
+    }
+
+
+def bench_scene_generation(main, repeat: int) -> dict:
+    results = {}
+    for level in LEVELS:
+        segments = canned_script(level)["segments"]
+        for seg in segments:
+            seg["actual_duration"] = seg["duration"]
+        results[level] = timed(
+            lambda: main.generate_manim_scene_adaptive(segments, main.SEGMENTS_PER_SCENE), repeat)
+    return results
+
+
+def bench_stream_parser(main, repeat: int) -> dict:
+    text = json.dumps(canned_script("comprehensive"))
+    chunks = [text[i:i + 80] for i in range(0, len(text), 80)]
+
+    def run():
+        parser = main.SegmentStreamParser()
+        for chunk in chunks:
+            parser.feed(chunk)
+    return timed(run, repeat)
+
+
+def bench_render(main, quality: str, repeat: int) -> dict:
+    segments = canned_script("simple")["segments"][:2]
+    for seg in segments:
+        seg["actual_duration"] = 1.0
+    spec, scene_code, scenes = main.generate_manim_scene_adaptive(segments)
+    results = []
+    for _ in range(repeat):
+        tmpdir = tempfile.mkdtemp(prefix="vidgen_bench_")
+        try:
+            scene_path = os.path.join(tmpdir, "scene.py")
+            with open(scene_path, "w", encoding="utf-8") as f:
+                f.write(scene_code)
+            with open(os.path.join(tmpdir, "scene_spec.json"), "w", encoding="utf-8") as f:
+                json.dump({"segments": spec}, f)
+            started = time.perf_counter()
+            returncode, _, video = main._render_one_scene(scene_path, scenes[0], quality, tmpdir)
+            elapsed = time.perf_counter() - started
+            if returncode != 0 or not video:
+                return {"error": f"render failed (return code {returncode})"}
+            results.append(elapsed)
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+    return {"runs": repeat, "best": round(min(results), 3), "mean": round(statistics.mean(results), 3),
+            "warm_pool": bool(main.RENDER_POOL and main.RENDER_POOL.available)}
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return None
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Offline pipeline benchmark")
+    parser.add_argument("--out", default="benchmark.json", help="JSON results file")
+    parser.add_argument("--levels", default=",".join(LEVELS), help="complexity levels to run")
+    parser.add_argument("--quality", default="low", choices=["low", "medium", "high"])
+    parser.add_argument("--latency", type=float, default=0.2, help="fake OpenAI latency (s)")
+    parser.add_argument("--tts-latency", type=float, default=0.1, help="fake ElevenLabs latency (s)")
+    parser.add_argument("--tail-latency", type=float, default=0.0,
+                        help="extra latency (s) of slow script completions")
+    parser.add_argument("--tail-every", type=int, default=0,
+                        help="make every Nth script completion slow, starting with the first (0: none)")
+    parser.add_argument("--hedge-after", type=float, default=None,
+                        help="fixed hedging budget (s) instead of the running p95")
+    parser.add_argument("--no-stream", action="store_true", help="request the script without streaming")
+    parser.add_argument("--repeat", type=int, default=20, help="microbenchmark repetitions")
+    parser.add_argument("--render-repeat", type=int, default=2, help="render microbenchmark repetitions")
+    parser.add_argument("--warm", action="store_true", help="start the warm render pool first")
+    parser.add_argument("--keep-output", action="store_true", help="keep the temporary output folder")
+    args = parser.parse_args()
+
+    FakeOpenAIHandler.latency = args.latency
+    FakeOpenAIHandler.tail_latency = args.tail_latency
+    FakeOpenAIHandler.tail_every = args.tail_every
+    FakeElevenLabsHandler.latency = args.tts_latency
+    openai_server, openai_url = start_server(FakeOpenAIHandler)
+    eleven_server, eleven_url = start_server(FakeElevenLabsHandler)
+
+    # Fresh caches, script cache and index so every run measures real work and
+    # nothing leaks into the real ones; set before main reads its config
+    cache_dir = tempfile.mkdtemp(prefix="vidgen_bench_cache_")
+    output_dir = tempfile.mkdtemp(prefix="vidgen_bench_output_")
+    os.environ["CACHE_DIR"] = cache_dir
+    os.environ["OUTPUT_DIR"] = output_dir
+    os.environ["INDEX_DB"] = os.path.join(output_dir, "_index.sqlite3")
+    os.environ.setdefault("OPENAI_API_KEY", "bench")
+    os.environ["OPENAI_BASE_URL"] = f"{openai_url}/v1"
+    os.environ.setdefault("OPENAI_MAX_RETRIES", "0")
+    if args.hedge_after is not None:
+        os.environ["SCRIPT_HEDGE_AFTER_SEC"] = str(args.hedge_after)
+    os.environ["ELEVEN_API_BASE"] = eleven_url
+    os.environ["LOCAL_CLASSIFIER_MIN_CONFIDENCE"] = "2"  # always exercise the analysis call
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import main
+    from prometheus_client import REGISTRY
+
+    main.ELEVEN_CLIENT.base_url = eleven_url
+    if args.warm and main.RENDER_POOL:
+        main.RENDER_POOL.start()
+
+    have_render = bool(shutil.which("ffmpeg")) and main.MANIM_VERSION != "unknown"
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "time": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "manim": main.MANIM_VERSION,
+            "ffmpeg": bool(shutil.which("ffmpeg")),
+            "quality": args.quality,
+            "openai_latency": args.latency,
+            "tts_latency": args.tts_latency,
+            "tail_latency": args.tail_latency,
+            "tail_every": args.tail_every,
+            "stream_script": not args.no_stream,
+            "warm_pool": bool(main.RENDER_POOL and main.RENDER_POOL.available),
+        },
+        "pipeline": {},
+        "micro": {},
+    }
+
+    try:
+        for level in [l for l in args.levels.split(",") if l in LEVELS]:
+            print(f"[BENCH] Pipeline: {level} ({LEVELS[level][0]} segments)")
+            report["pipeline"][level] = bench_pipeline(main, level, args.quality, not args.no_stream)
+            print(f"[BENCH] {level}: {report['pipeline'][level]['status']} "
+                  f"in {report['pipeline'][level]['total_seconds']:.2f}s")
+
+        print("[BENCH] Microbenchmarks...")
+        report["micro"]["generate_manim_scene_adaptive"] = bench_scene_generation(main, args.repeat)
+        report["micro"]["segment_stream_parser"] = bench_stream_parser(main, args.repeat)
+        if have_render:
+            report["micro"]["render_scene"] = bench_render(main, args.quality, args.render_repeat)
+        else:
+            report["micro"]["render_scene"] = {"skipped": "manim or ffmpeg not available"}
+        report["meta"]["fake_calls"] = {"openai": FakeOpenAIHandler.calls,
+                                        "elevenlabs": FakeElevenLabsHandler.calls}
+        report["meta"]["script_hedges"] = {
+            result: int(REGISTRY.get_sample_value("vidgen_script_hedges_total", {"result": result}) or 0)
+            for result in ("sent", "won")
+        }
+        report["meta"]["script_latency"] = main.SCRIPT_LATENCY.stats()
+    finally:
+        if main.RENDER_POOL:
+            main.RENDER_POOL.close()
+        openai_server.shutdown()
+        eleven_server.shutdown()
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        if args.keep_output:
+            print(f"[BENCH] Output kept in {output_dir}")
+        else:
+            shutil.rmtree(output_dir, ignore_errors=True)
+
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"[BENCH] Results written to {args.out}")
+
+
+if __name__ == "__main__":
+    main_cli()
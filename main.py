@@ -1,16 +1,24 @@
 # main.py - Complete Adaptive Educational Video Generator
 # Enhanced with intelligent duration control and step-by-step visual animations
 
-from fastapi import FastAPI, Request, BackgroundTasks, HTTPException
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi import FastAPI, Request, HTTPException
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-import subprocess, tempfile, os, sys, re, shutil, json, time
+import subprocess, tempfile, os, sys, re, shutil, json, time, uuid, threading, asyncio, hashlib
+import unicodedata, math, sqlite3, zipfile
+from collections import deque
 from datetime import datetime
-import py_compile
+from importlib import metadata
 from pathlib import Path
 import openai
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 import traceback
+import random
+import numpy as np
+from email.utils import parsedate_to_datetime
+from requests.adapters import HTTPAdapter
+from render_worker import RenderWorkerPool, WorkerCrashed, QUALITY_PRESETS
+from prometheus_client import Counter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST
 
 # ---------------------------
 # Configuration
@@ -18,8 +26,8 @@ import traceback
 import os, requests, json, sys
 
 OPENAI_API_KEY =  os.getenv("OPENAI_API_KEY")
-
-client = openai.OpenAI(api_key=OPENAI_API_KEY)
+# Point at a compatible server (e.g. benchmark.py's fake) instead of api.openai.com
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
 ELEVEN_KEY = "sk_4fcbd8db995d809a60650ff2b2140e895815d5c28af93a19"
 
 app = FastAPI()
@@ -30,9 +38,110 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-OUTPUT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "generated_videos")
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+OUTPUT_DIR = os.getenv("OUTPUT_DIR", os.path.join(APP_DIR, "generated_videos"))
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
+# Machine budget per running generation, used to size PIPELINE_WORKERS when it isn't set
+CORES_PER_JOB = float(os.getenv("CORES_PER_JOB", "2"))
+MEMORY_GB_PER_JOB = float(os.getenv("MEMORY_GB_PER_JOB", "1.5"))
+
+def _total_memory_gb():
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / 1024 ** 3
+    except (ValueError, OSError, AttributeError):
+        return None
+
+def _default_pipeline_workers() -> int:
+    by_cpu = (os.cpu_count() or 2) / CORES_PER_JOB
+    memory = _total_memory_gb()
+    by_memory = memory / MEMORY_GB_PER_JOB if memory else by_cpu
+    return max(1, int(min(by_cpu, by_memory)))
+
+# Number of videos that may run through the pipeline at the same time
+PIPELINE_WORKERS = max(1, int(os.getenv("PIPELINE_WORKERS") or _default_pipeline_workers()))
+# Admitted generations allowed to wait for a pipeline slot; beyond that requests get 503
+MAX_QUEUED_JOBS = max(0, int(os.getenv("MAX_QUEUED_JOBS", str(PIPELINE_WORKERS * 2))))
+# Finished jobs kept in memory for GET /jobs/{id}
+JOB_HISTORY_LIMIT = int(os.getenv("JOB_HISTORY_LIMIT", "500"))
+# Largest POST /generate/batch accepted, and finished batches kept for /batches/{id}
+MAX_BATCH_ITEMS = max(1, int(os.getenv("MAX_BATCH_ITEMS", "500")))
+BATCH_HISTORY_LIMIT = int(os.getenv("BATCH_HISTORY_LIMIT", "50"))
+
+# SQLite index of finished generations, queried by /, /generations and /diagnose
+INDEX_DB = os.getenv("INDEX_DB", os.path.join(OUTPUT_DIR, "_index.sqlite3"))
+
+# Retention for OUTPUT_DIR: total budget, max age (0 keeps forever) and sweep interval
+OUTPUT_MAX_GB = float(os.getenv("OUTPUT_MAX_GB", "20"))
+OUTPUT_MAX_AGE_DAYS = float(os.getenv("OUTPUT_MAX_AGE_DAYS", "0"))
+RETENTION_INTERVAL_SEC = float(os.getenv("RETENTION_INTERVAL_SEC", "600"))
+# Artifacts removed from a folder once its final_output.mp4 exists
+RETENTION_DROP_AFTER_SUCCESS = [f for f in os.getenv("RETENTION_DROP_AFTER_SUCCESS", "video_only.mp4").split(",") if f]
+
+# Persistent caches (rendered clips, TTS audio, scripts) live under here
+CACHE_DIR = os.getenv("CACHE_DIR", os.path.join(APP_DIR, "cache"))
+RENDER_CACHE_MAX_MB = int(os.getenv("RENDER_CACHE_MAX_MB", "2048"))
+TTS_CACHE_MAX_MB = int(os.getenv("TTS_CACHE_MAX_MB", "512"))
+SCRIPT_CACHE_MAX_MB = int(os.getenv("SCRIPT_CACHE_MAX_MB", "64"))
+SCRIPT_CACHE_TTL_HOURS = float(os.getenv("SCRIPT_CACHE_TTL_HOURS", "168"))
+# Skip the gpt-4o analysis call when the local classifier is at least this sure (>1 disables)
+LOCAL_CLASSIFIER_MIN_CONFIDENCE = float(os.getenv("LOCAL_CLASSIFIER_MIN_CONFIDENCE", "0.75"))
+# Stream the script completion and start TTS per segment as it arrives
+STREAM_SCRIPT = os.getenv("STREAM_SCRIPT", "1") == "1"
+# Deadlines (s) for the analysis and script completions, including SDK retries
+ANALYSIS_TIMEOUT_SEC = float(os.getenv("ANALYSIS_TIMEOUT_SEC", "30"))
+SCRIPT_TIMEOUT_SEC = float(os.getenv("SCRIPT_TIMEOUT_SEC", "180"))
+OPENAI_MAX_RETRIES = max(0, int(os.getenv("OPENAI_MAX_RETRIES", "1")))
+# Send a duplicate script request once the first has run past the p95 of recent
+# completions (SCRIPT_HEDGE_DEFAULT_SEC until enough are seen, or a fixed SCRIPT_HEDGE_AFTER_SEC)
+SCRIPT_HEDGING = os.getenv("SCRIPT_HEDGING", "1") == "1"
+SCRIPT_HEDGE_AFTER_SEC = float(os.getenv("SCRIPT_HEDGE_AFTER_SEC", "0"))
+SCRIPT_HEDGE_DEFAULT_SEC = float(os.getenv("SCRIPT_HEDGE_DEFAULT_SEC", "45"))
+
+# ElevenLabs voice and model used for narration
+VOICE_ID = "pNInz6obpgDQGcFmaJgB"
+ELEVEN_MODEL_ID = "eleven_turbo_v2"
+# Narration is assembled as mono PCM at this rate
+AUDIO_SAMPLE_RATE = 44100
+ELEVEN_API_BASE = os.getenv("ELEVEN_API_BASE", "https://api.elevenlabs.io")
+# Process-wide cap on concurrent ElevenLabs calls, shared by all jobs
+ELEVEN_MAX_CONCURRENCY = max(1, int(os.getenv("ELEVEN_MAX_CONCURRENCY", "4")))
+ELEVEN_MAX_RETRIES = int(os.getenv("ELEVEN_MAX_RETRIES", "4"))
+# Process-wide TTS threads; a few beyond the ElevenLabs cap so cache hits
+# and duration probes don't queue behind API calls
+TTS_WORKERS = max(1, int(os.getenv("TTS_WORKERS", str(ELEVEN_MAX_CONCURRENCY * 2))))
+
+# Render each group of segments as its own scene, in parallel
+PARALLEL_RENDER = os.getenv("PARALLEL_RENDER", "1") == "1"
+# Process-wide cap on concurrent Manim processes
+MANIM_RENDER_WORKERS = max(1, int(os.getenv("MANIM_RENDER_WORKERS", str(os.cpu_count() or 2))))
+# Segments per scene when rendering in parallel
+SEGMENTS_PER_SCENE = max(1, int(os.getenv("SEGMENTS_PER_SCENE", "2")))
+# Split long scenes into animation ranges rendered in parallel; slices are at
+# least this many seconds of video (0 disables time slicing)
+TIME_SLICE_MIN_SECONDS = float(os.getenv("TIME_SLICE_MIN_SECONDS", "8"))
+# Render on pre-warmed worker processes instead of a fresh `python -m manim` per scene
+WARM_RENDER_WORKERS = os.getenv("WARM_RENDER_WORKERS", "1") == "1"
+# Cache-Control sent with finished videos (ETags let clients revalidate after it expires)
+VIDEO_CACHE_CONTROL = os.getenv("VIDEO_CACHE_CONTROL", "public, max-age=3600")
+# "preview": true renders this quality first, then upgrades to the requested one in the background
+PREVIEW_QUALITY = os.getenv("PREVIEW_QUALITY", "low")
+# Background upgrade renders allowed at the same time
+UPGRADE_WORKERS = max(1, int(os.getenv("UPGRADE_WORKERS", "1")))
+# Publish an HLS playlist that grows as scenes finish ("hls": true in the request overrides)
+HLS_OUTPUT = os.getenv("HLS_OUTPUT", "0") == "1"
+# "scenes" renders scenes in parallel, then concats and muxes; "pipe" renders
+# them in one process straight into final_output.mp4 with the narration
+# ("render_mode" in the request overrides)
+RENDER_MODE = os.getenv("RENDER_MODE", "scenes")
+# Jobs a warm worker serves before it is recycled
+MANIM_WORKER_MAX_JOBS = max(1, int(os.getenv("MANIM_WORKER_MAX_JOBS", "25")))
+# Parsed Text mobjects shared by every render process (scene_runtime reads these from the env)
+TEXT_CACHE_DIR = os.getenv("TEXT_CACHE_DIR", os.path.join(CACHE_DIR, "text"))
+TEXT_CACHE_MAX_MB = os.getenv("TEXT_CACHE_MAX_MB", "256")
+os.environ["TEXT_CACHE_DIR"] = TEXT_CACHE_DIR
+os.environ["TEXT_CACHE_MAX_MB"] = TEXT_CACHE_MAX_MB
+
 # ---------------------------
 # Utilities
 # ---------------------------
@@ -42,17 +151,246 @@ def cleanup_temp_dir(tmpdir: str):
     except Exception:
         pass
 
+def create_output_dir():
+    """Create a fresh OUTPUT_DIR/<timestamp> folder, suffixing on collisions"""
+    base = datetime.now().strftime("%Y%m%d_%H%M%S")
+    name = base
+    n = 1
+    while True:
+        path = os.path.join(OUTPUT_DIR, name)
+        try:
+            os.makedirs(path)
+            return name, path
+        except FileExistsError:
+            n += 1
+            name = f"{base}_{n}"
+
 def run_cmd(cmd, cwd=None, timeout=None):
     return subprocess.run(cmd, cwd=cwd, capture_output=True, text=True, timeout=timeout)
 
-def get_audio_duration(audio_path: str) -> float:
+# ---------------------------
+# Metrics
+# ---------------------------
+# Exported at /metrics. Pipeline stages use the job stage names
+# (script/audio/concat/scene/render/merge); "analysis" and
+# "script_generation" split the script stage into its two model calls.
+STAGE_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600, 1200)
+STAGE_SECONDS = Histogram("vidgen_stage_seconds", "Wall time per pipeline stage",
+                          ["stage"], buckets=STAGE_BUCKETS)
+TTS_SECONDS = Histogram("vidgen_tts_segment_seconds",
+                        "Per-segment narration time by the engine that produced it",
+                        ["engine"], buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60))
+SCENE_RENDER_SECONDS = Histogram("vidgen_scene_render_seconds", "Per-scene Manim render time",
+                                 ["path"], buckets=STAGE_BUCKETS)
+FALLBACKS = Counter("vidgen_fallbacks_total", "Degraded paths taken", ["kind"])
+FAILURES = Counter("vidgen_failures_total", "Failed generations by the stage they failed in", ["stage"])
+GENERATIONS = Counter("vidgen_generations_total", "Finished generations", ["status"])
+CACHE_LOOKUPS = Counter("vidgen_cache_lookups_total", "Disk cache lookups", ["cache", "result"])
+SCRIPT_HEDGES = Counter("vidgen_script_hedges_total", "Hedged script requests sent, and won by the hedge",
+                        ["result"])
+COALESCED = Counter("vidgen_coalesced_total", "Calls that joined an identical call already in flight", ["kind"])
+INFLIGHT_GENERATIONS = Gauge("vidgen_inflight_generations", "Generations currently running")
+ADMISSION_QUEUE_DEPTH = Gauge("vidgen_admission_queue_depth", "Admitted generations waiting for a slot")
+ADMISSION_WAIT_SECONDS = Histogram("vidgen_admission_wait_seconds", "Time from admission to start",
+                                   buckets=(0.01, 0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600, 1800))
+ADMISSION_REJECTED = Counter("vidgen_admission_rejected_total", "Requests shed with 503")
+# Sampled when /metrics is scraped
+PIPELINE_UTILIZATION = Gauge("vidgen_pipeline_utilization", "Running generations / PIPELINE_WORKERS")
+JOB_STATES = Gauge("vidgen_jobs", "Jobs in the /jobs table by status", ["status"])
+RENDER_WORKERS = Gauge("vidgen_render_workers", "Warm render workers by state", ["state"])
+RENDER_UTILIZATION = Gauge("vidgen_render_utilization", "Busy warm render workers / pool size")
+
+# ---------------------------
+# Media Probing
+# ---------------------------
+# Durations are read straight from container/frame headers; ffprobe is only
+# forked for formats these parsers don't recognize.
+_MP3_BITRATES = {
+    (1, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (1, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (1, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (2, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (2, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (2, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+_MP3_SAMPLE_RATES = {
+    3: [44100, 48000, 32000],   # MPEG-1
+    2: [22050, 24000, 16000],   # MPEG-2
+    0: [11025, 12000, 8000],    # MPEG-2.5
+}
+
+def _mp3_frame_header(data: bytes, pos: int):
+    """(frame_length, samples, sample_rate, version_bits, mono) for a frame header at pos, or None"""
+    if pos + 4 > len(data) or data[pos] != 0xFF or (data[pos + 1] & 0xE0) != 0xE0:
+        return None
+    b1, b2, b3 = data[pos + 1], data[pos + 2], data[pos + 3]
+    version_bits = (b1 >> 3) & 0x03
+    layer = 4 - ((b1 >> 1) & 0x03)
+    bitrate_idx = (b2 >> 4) & 0x0F
+    sr_idx = (b2 >> 2) & 0x03
+    padding = (b2 >> 1) & 0x01
+    if version_bits == 1 or layer == 4 or bitrate_idx in (0, 15) or sr_idx == 3:
+        return None
+    table_version = 1 if version_bits == 3 else 2
+    bitrate = _MP3_BITRATES[(table_version, layer)][bitrate_idx] * 1000
+    sample_rate = _MP3_SAMPLE_RATES[version_bits][sr_idx]
+    if layer == 1:
+        samples = 384
+        length = (12 * bitrate // sample_rate + padding) * 4
+    elif layer == 2 or version_bits == 3:
+        samples = 1152
+        length = 144 * bitrate // sample_rate + padding
+    else:
+        samples = 576
+        length = 72 * bitrate // sample_rate + padding
+    return length, samples, sample_rate, version_bits, (b3 >> 6) == 3
+
+def _mp3_duration(data: bytes):
+    pos = 0
+    if data[:3] == b"ID3" and len(data) >= 10:
+        size = ((data[6] & 0x7F) << 21) | ((data[7] & 0x7F) << 14) | ((data[8] & 0x7F) << 7) | (data[9] & 0x7F)
+        pos = 10 + size + (10 if data[5] & 0x10 else 0)
+    # Find the first frame (tolerating a little junk after the tag)
+    limit = min(len(data), pos + 4096)
+    while pos < limit and not _mp3_frame_header(data, pos):
+        pos += 1
+    first = _mp3_frame_header(data, pos)
+    if not first:
+        return None
+    length, samples, sample_rate, version_bits, mono = first
+    
+    # Xing/Info header (LAME, most VBR encoders) sits right after the side info
+    side_info = (17 if mono else 32) if version_bits == 3 else (9 if mono else 17)
+    xing = pos + 4 + side_info
+    if data[xing:xing + 4] in (b"Xing", b"Info"):
+        flags = int.from_bytes(data[xing + 4:xing + 8], "big")
+        if flags & 0x01:
+            frames = int.from_bytes(data[xing + 8:xing + 12], "big")
+            return frames * samples / sample_rate
+    # VBRI header (Fraunhofer) at a fixed offset
+    vbri = pos + 4 + 32
+    if data[vbri:vbri + 4] == b"VBRI":
+        frames = int.from_bytes(data[vbri + 14:vbri + 18], "big")
+        return frames * samples / sample_rate
+    
+    # No summary header: walk the frames
+    total = 0
+    while True:
+        header = _mp3_frame_header(data, pos)
+        if not header or header[0] <= 0:
+            break
+        total += header[1] / header[2]
+        pos += header[0]
+    return total if total > 0 else None
+
+def _wav_duration(f):
+    f.seek(12)
+    byte_rate = None
+    while True:
+        chunk = f.read(8)
+        if len(chunk) < 8:
+            return None
+        chunk_id, size = chunk[:4], int.from_bytes(chunk[4:], "little")
+        if chunk_id == b"fmt ":
+            fmt = f.read(size)
+            byte_rate = int.from_bytes(fmt[8:12], "little")
+            if size % 2:
+                f.read(1)
+        elif chunk_id == b"data":
+            if not byte_rate:
+                return None
+            # Streamed WAVs may carry a placeholder size; trust the file length instead
+            remaining = os.fstat(f.fileno()).st_size - f.tell()
+            return min(size, remaining) / byte_rate
+        else:
+            f.seek(size + (size % 2), os.SEEK_CUR)
+
+def _mp4_boxes(f, start: int, end: int):
+    """(type, payload_offset, box_end) for each box between start and end"""
+    pos = start
+    while pos + 8 <= end:
+        f.seek(pos)
+        header = f.read(8)
+        if len(header) < 8:
+            return
+        size, box_type = int.from_bytes(header[:4], "big"), header[4:]
+        payload = pos + 8
+        if size == 1:
+            size = int.from_bytes(f.read(8), "big")
+            payload += 8
+        elif size == 0:
+            size = end - pos
+        if size < 8:
+            return
+        yield box_type, payload, pos + size
+        pos += size
+
+def _mp4_duration(f):
+    end = os.fstat(f.fileno()).st_size
+    for box_type, payload, box_end in _mp4_boxes(f, 0, end):
+        if box_type != b"moov":
+            continue
+        for child, child_payload, _ in _mp4_boxes(f, payload, box_end):
+            if child != b"mvhd":
+                continue
+            f.seek(child_payload)
+            version = f.read(4)[0]
+            if version == 1:
+                f.seek(16, os.SEEK_CUR)
+                timescale = int.from_bytes(f.read(4), "big")
+                duration = int.from_bytes(f.read(8), "big")
+            else:
+                f.seek(8, os.SEEK_CUR)
+                timescale = int.from_bytes(f.read(4), "big")
+                duration = int.from_bytes(f.read(4), "big")
+            return duration / timescale if timescale else None
+    return None
+
+def probe_duration(path: str):
+    """Duration in seconds from MP3/WAV/MP4 headers, or None if the format isn't recognized"""
+    try:
+        with open(path, "rb") as f:
+            head = f.read(12)
+            if head[:4] == b"RIFF" and head[8:12] == b"WAVE":
+                return _wav_duration(f)
+            if head[4:8] in (b"ftyp", b"moov", b"mdat", b"free", b"wide", b"skip"):
+                return _mp4_duration(f)
+            if head[:3] == b"ID3" or (len(head) > 1 and head[0] == 0xFF and (head[1] & 0xE0) == 0xE0):
+                f.seek(0)
+                return _mp3_duration(f.read())
+    except (OSError, IndexError, ValueError):
+        return None
+    return None
+
+def _ffprobe_duration(path: str) -> float:
     try:
         res = run_cmd(["ffprobe", "-v", "error", "-show_entries", "format=duration",
-                       "-of", "default=noprint_wrappers=1:nokey=1", audio_path], timeout=15)
+                       "-of", "default=noprint_wrappers=1:nokey=1", path], timeout=15)
         return float(res.stdout.strip())
     except Exception:
         return 0.0
 
+def get_audio_duration(audio_path: str) -> float:
+    duration = probe_duration(audio_path)
+    if duration:
+        return duration
+    return _ffprobe_duration(audio_path)
+
+def probe_durations(paths: list, max_workers: int = 4) -> dict:
+    """Durations for many files: headers in-process, ffprobe (in parallel) only for the rest"""
+    durations = {}
+    unknown = []
+    for path in paths:
+        duration = probe_duration(path)
+        if duration:
+            durations[path] = duration
+        else:
+            unknown.append(path)
+    if unknown:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(unknown))) as ex:
+            durations.update(zip(unknown, ex.map(_ffprobe_duration, unknown)))
+    return durations
+
 def escape_text_safe(s: str) -> str:
     """Ultra-safe text escaping for Python strings"""
     if not s:
@@ -65,21 +403,380 @@ def escape_text_safe(s: str) -> str:
     s = re.sub(r'\s+', ' ', s)
     return s.strip()[:150]
 
+# ---------------------------
+# Disk Caches
+# ---------------------------
+CACHES = {}
+
+class DiskCache:
+    """Files on disk addressed by key, evicted least-recently-used past a byte budget.
+
+    Each entry is <key><suffix> plus a <key>.meta.json sidecar. Reads touch the
+    entry's mtime, which is the LRU clock, so recency survives restarts.
+    `ttl` (seconds) expires entries by creation time.
+    """
+    def __init__(self, name: str, root: str, max_bytes: int, ttl: float = None):
+        self.name = name
+        self.root = root
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._bytes = None
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        CACHES[name] = self
+
+    @staticmethod
+    def make_key(*parts) -> str:
+        blob = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str, suffix: str) -> str:
+        return os.path.join(self.root, key[:2], key + suffix)
+
+    def get_meta(self, key: str):
+        try:
+            with open(self._path(key, ".meta.json"), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def get(self, key: str, suffix: str):
+        """Path of the cached entry, or None on a miss"""
+        path = self._path(key, suffix)
+        if os.path.exists(path):
+            meta = self.get_meta(key) or {}
+            if self.ttl and time.time() - meta.get("created_at", 0) > self.ttl:
+                self._remove(key, suffix)
+            else:
+                try:
+                    os.utime(path)
+                except OSError:
+                    pass
+                with self._lock:
+                    self.hits += 1
+                CACHE_LOOKUPS.labels(self.name, "hit").inc()
+                return path
+        with self._lock:
+            self.misses += 1
+        CACHE_LOOKUPS.labels(self.name, "miss").inc()
+        return None
+
+    def put(self, key: str, src_path: str, suffix: str, meta: dict = None) -> str:
+        """Copy src_path into the cache (atomically) and return the cached path"""
+        path = self._path(key, suffix)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+        shutil.copyfile(src_path, tmp)
+        os.replace(tmp, path)
+        self._write_meta(key, meta)
+        self._account(os.path.getsize(path))
+        return path
+
+    def put_bytes(self, key: str, data: bytes, suffix: str, meta: dict = None) -> str:
+        path = self._path(key, suffix)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        self._write_meta(key, meta)
+        self._account(len(data))
+        return path
+
+    def link_into(self, cached_path: str, dest: str) -> str:
+        """Hardlink (or copy) a cached entry to dest so eviction can't pull it away mid-use"""
+        try:
+            if os.path.exists(dest):
+                os.remove(dest)
+            os.link(cached_path, dest)
+        except OSError:
+            shutil.copyfile(cached_path, dest)
+        return dest
+
+    def _write_meta(self, key: str, meta: dict = None):
+        record = dict(meta or {})
+        record.setdefault("created_at", time.time())
+        path = self._path(key, ".meta.json")
+        tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(record, f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+    def _remove(self, key: str, suffix: str):
+        for path in (self._path(key, suffix), self._path(key, ".meta.json")):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _scan(self) -> list:
+        """(mtime, size, path) of every data file, oldest first"""
+        entries = []
+        for root, _, files in os.walk(self.root):
+            for fname in files:
+                if fname.endswith(".meta.json") or fname.endswith(".tmp"):
+                    continue
+                path = os.path.join(root, fname)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        entries.sort()
+        return entries
+
+    def _account(self, added: int):
+        with self._lock:
+            if self._bytes is None:
+                self._bytes = sum(size for _, size, _ in self._scan())
+            else:
+                self._bytes += added
+            if self._bytes <= self.max_bytes:
+                return
+            # Evict down to 90% of the budget so we don't rescan on every put
+            entries = self._scan()
+            total = sum(size for _, size, _ in entries)
+            target = self.max_bytes * 0.9
+            for _, size, path in entries:
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                    os.remove(re.sub(r"\.[^./]+$", "", path) + ".meta.json")
+                except OSError:
+                    pass
+                total -= size
+                self.evictions += 1
+            self._bytes = total
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+                "evictions": self.evictions,
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+class SingleFlight:
+    """Collapse concurrent work on the same key into one execution.
+
+    The first caller to join() a key leads and must call done(); callers
+    joining while it is in flight get the same Future. Nothing is kept
+    once it resolves: the disk caches serve later repeats.
+    """
+    def __init__(self, name: str):
+        self.name = name
+        self.shared = 0
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def join(self, key: str):
+        """(future, leader) for key"""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                self.shared += 1
+                COALESCED.labels(self.name).inc()
+                return flight, False
+            flight = self._flights[key] = Future()
+            return flight, True
+
+    def done(self, key: str, result=None, error: BaseException = None):
+        with self._lock:
+            flight = self._flights.pop(key, None)
+        if flight is None:
+            return
+        if error is not None:
+            flight.set_exception(error)
+        else:
+            flight.set_result(result)
+
+    def do(self, key: str, fn, *args):
+        """fn(*args), or the result of the identical call already running"""
+        flight, leader = self.join(key)
+        if not leader:
+            return flight.result()
+        try:
+            result = fn(*args)
+        except BaseException as e:
+            self.done(key, error=e)
+            raise
+        self.done(key, result)
+        return result
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"in_flight": len(self._flights), "shared": self.shared}
+
+def _manim_version() -> str:
+    try:
+        return metadata.version("manim")
+    except metadata.PackageNotFoundError:
+        return "unknown"
+
+MANIM_VERSION = _manim_version()
+RENDER_CACHE = DiskCache("render", os.path.join(CACHE_DIR, "render"),
+                         RENDER_CACHE_MAX_MB * 1024 * 1024)
+
 # ---------------------------
 # TTS Generation
 # ---------------------------
+TTS_CACHE = DiskCache("tts", os.path.join(CACHE_DIR, "tts"), TTS_CACHE_MAX_MB * 1024 * 1024)
+
+def normalize_narration(text: str) -> str:
+    text = unicodedata.normalize("NFC", text or "")
+    return re.sub(r'\s+', ' ', text).strip()
+
+def tts_cache_key(text: str, engine: str) -> str:
+    return DiskCache.make_key("tts", normalize_narration(text), VOICE_ID, ELEVEN_MODEL_ID, engine)
+
+def _tts_from_cache(text: str, engine: str, out_path: str):
+    """Copy a cached narration to out_path; returns its duration, or None on a miss"""
+    key = tts_cache_key(text, engine)
+    cached = TTS_CACHE.get(key, ".mp3")
+    if not cached:
+        return None
+    duration = (TTS_CACHE.get_meta(key) or {}).get("duration", 0.0)
+    if duration <= 0:
+        return None
+    TTS_CACHE.link_into(cached, out_path)
+    print(f"[TTS] Cache hit ({engine}): {duration:.2f}s")
+    return duration
+
+def _tts_to_cache(text: str, engine: str, out_path: str, duration: float):
+    try:
+        TTS_CACHE.put(tts_cache_key(text, engine), out_path, ".mp3",
+                      {"duration": duration, "engine": engine})
+    except OSError as e:
+        print(f"[CACHE] Could not store TTS audio: {e}")
+
+TTS_FLIGHTS = SingleFlight("tts")
+
+def _synthesize_once(text: str, engine: str, out_path: str, synthesize):
+    """Speak text into out_path with `synthesize` and cache it; returns the duration or None.
+
+    The same narration requested concurrently (common in batches) is only
+    synthesized once; the other callers wait and copy it from TTS_CACHE.
+    """
+    key = tts_cache_key(text, engine)
+    flight, leader = TTS_FLIGHTS.join(key)
+    if not leader:
+        try:
+            flight.result()
+        except Exception:
+            pass
+        return _tts_from_cache(text, engine, out_path)
+    duration = None
+    try:
+        synthesize(text, out_path)
+        duration = get_audio_duration(out_path)
+        if duration > 0:
+            _tts_to_cache(text, engine, out_path, duration)
+        else:
+            duration = None
+    finally:
+        TTS_FLIGHTS.done(key, duration)
+    return duration
+
+class ElevenLabsClient:
+    """Process-wide ElevenLabs client.
+
+    One pooled requests.Session (keep-alive, no per-call TLS handshake), a
+    semaphore capping in-flight calls across all jobs, and retries with
+    full-jitter exponential backoff that honor Retry-After on 429/5xx.
+    `base_url` can point at a local stand-in server for testing.
+    """
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+    def __init__(self, api_key: str, base_url: str, max_concurrency: int = 4,
+                 max_retries: int = 4, timeout: float = 60, backoff_base: float = 0.5,
+                 backoff_max: float = 20.0, retry_after_max: float = 60.0):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/")
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retry_after_max = retry_after_max
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self.counters = {"requests": 0, "retries": 0, "throttled": 0, "failures": 0}
+
+    def _count(self, name: str):
+        with self._lock:
+            self.counters[name] += 1
+
+    @staticmethod
+    def _retry_after(response):
+        """Seconds requested by a Retry-After header (delta-seconds or HTTP date), if any"""
+        value = response.headers.get("Retry-After")
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            when = parsedate_to_datetime(value)
+            return max(0.0, when.timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def synthesize(self, text: str, voice_id: str, model_id: str) -> bytes:
+        """MP3 bytes for `text`; raises RuntimeError once retries are exhausted"""
+        url = f"{self.base_url}/v1/text-to-speech/{voice_id}"
+        headers = {"xi-api-key": self.api_key, "Content-Type": "application/json", "Accept": "audio/mpeg"}
+        data = {"text": text, "model_id": model_id}
+        error = None
+        for attempt in range(self.max_retries + 1):
+            delay = None
+            try:
+                with self._slots:
+                    self._count("requests")
+                    r = self.session.post(url, headers=headers, json=data, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = RuntimeError(f"TTS request error: {e}")
+            else:
+                if r.status_code == 200:
+                    return r.content
+                error = RuntimeError(f"TTS failed: {r.status_code}")
+                if r.status_code not in self.RETRY_STATUSES:
+                    break
+                if r.status_code == 429:
+                    self._count("throttled")
+                delay = self._retry_after(r)
+                if delay is not None:
+                    delay = min(delay, self.retry_after_max)
+            if attempt == self.max_retries:
+                break
+            self._count("retries")
+            # Sleep outside the semaphore so a backing-off call doesn't hold a slot
+            time.sleep(delay if delay is not None else self._backoff(attempt))
+        self._count("failures")
+        raise error
+
+ELEVEN_CLIENT = ElevenLabsClient(ELEVEN_KEY, ELEVEN_API_BASE,
+                                 max_concurrency=ELEVEN_MAX_CONCURRENCY,
+                                 max_retries=ELEVEN_MAX_RETRIES)
+
 def tts_elevenlabs(text: str, out_path: str):
-    import requests
-    VOICE_ID = "pNInz6obpgDQGcFmaJgB"
-    url = f"https://api.elevenlabs.io/v1/text-to-speech/{VOICE_ID}"
-    headers = {"xi-api-key": ELEVEN_KEY, "Content-Type": "application/json", "Accept": "audio/mpeg"}
-    data = {"text": text, "model_id": "eleven_turbo_v2"}
-    r = requests.post(url, headers=headers, json=data, timeout=60)
-    if r.status_code == 200:
-        with open(out_path, "wb") as f:
-            f.write(r.content)
-    else:
-        raise RuntimeError(f"TTS failed: {r.status_code}")
+    audio = ELEVEN_CLIENT.synthesize(text, VOICE_ID, ELEVEN_MODEL_ID)
+    with open(out_path, "wb") as f:
+        f.write(audio)
 
 def tts_pyttsx3(text: str, out_path: str):
     try:
@@ -108,27 +805,41 @@ def generate_voice_audio_with_fallback(text: str, out_path: str, target_duration
         text: Text to speak
         out_path: Output audio file path
         target_duration: Expected duration (used for fallback)
+    
+    Returns the duration of the written audio in seconds. Spoken results are
+    cached in TTS_CACHE, so repeat narrations skip the API call and ffprobe.
+    When every engine fails nothing is written and the silent duration is
+    returned.
     """
+    started = time.time()
     # Try ElevenLabs first
     if ELEVEN_KEY:
+        cached_dur = _tts_from_cache(text, "elevenlabs", out_path)
+        if cached_dur is not None:
+            return cached_dur
         try:
-            tts_elevenlabs(text, out_path)
-            actual_dur = get_audio_duration(out_path)
-            if actual_dur > 0:
+            actual_dur = _synthesize_once(text, "elevenlabs", out_path, tts_elevenlabs)
+            if actual_dur:
                 print(f"[TTS] ElevenLabs: {actual_dur:.2f}s")
-                return
+                TTS_SECONDS.labels("elevenlabs").observe(time.time() - started)
+                return actual_dur
             else:
                 print(f"[TTS] ElevenLabs returned 0-length audio, trying fallback...")
         except Exception as e:
             print(f"[WARN] ElevenLabs failed: {e}")
     
     # Try pyttsx3
+    cached_dur = _tts_from_cache(text, "pyttsx3", out_path)
+    if cached_dur is not None:
+        return cached_dur
     try:
-        tts_pyttsx3(text, out_path)
-        actual_dur = get_audio_duration(out_path)
-        if actual_dur > 0:
+        actual_dur = _synthesize_once(text, "pyttsx3", out_path, tts_pyttsx3)
+        if actual_dur:
             print(f"[TTS] pyttsx3: {actual_dur:.2f}s")
-            return
+            TTS_SECONDS.labels("pyttsx3").observe(time.time() - started)
+            if ELEVEN_KEY:
+                FALLBACKS.labels("tts_pyttsx3").inc()
+            return actual_dur
         else:
             print(f"[TTS] pyttsx3 returned 0-length audio, using silent fallback...")
     except Exception as e:
@@ -144,8 +855,10 @@ def generate_voice_audio_with_fallback(text: str, out_path: str, target_duration
     
     print(f"[TTS] Silent fallback: {fallback_dur:.2f}s (text: {len(text)} chars, {len(text.split())} words)")
     
-    run_cmd(["ffmpeg", "-y", "-f", "lavfi", "-i", "anullsrc=r=22050:cl=mono",
-            "-t", f"{fallback_dur:.2f}", out_path], timeout=15)
+    # No file is written: the audio assembly stage lays down silence in memory
+    TTS_SECONDS.labels("silent").observe(time.time() - started)
+    FALLBACKS.labels("tts_silent").inc()
+    return fallback_dur
 
 
 # Also update the _tts_worker to pass target duration:
@@ -174,71 +887,232 @@ def _tts_worker(args):
             target_duration = None
     except Exception as e:
         # Return an error tuple so caller can handle it
-        return (None, RuntimeError(f"Bad args passed to _tts_worker: {args} ({e})"))
+        return (None, RuntimeError(f"Bad args passed to _tts_worker: {args} ({e})"), None)
 
     try:
         # Generate TTS (function does not currently accept target_duration)
-        generate_voice_audio_with_fallback(narration, outpath)
-        return (outpath, None)
+        duration = generate_voice_audio_with_fallback(narration, outpath)
+        return (outpath, None, duration)
     except Exception as e:
         # Return path + exception for the caller to inspect/handle
-        return (outpath, e)
-
-
-def generate_all_tts_parallel(segments, tmpdir, max_workers=6):
-    """Generate TTS for all segments in parallel (robust to task tuple shapes)."""
-    tasks = []
-    for i, seg in enumerate(segments):
-        narration = seg.get("narration", "").strip() or f"Segment {i+1}"
-        outp = os.path.join(tmpdir, f"segment_{i:03d}.mp3")
-
-        # Optionally include target duration for future padding logic:
-        target_dur = None
-        try:
-            # Prefer the normalized duration if present
-            target_dur = float(seg.get("duration", seg.get("estimated_duration", 0))) if seg else None
-        except Exception:
-            target_dur = None
-
-        # Use 2-tuple for compatibility; if you later want padding inside the worker, change to 3-tuple.
-        tasks.append((narration, outp))
-        # If you prefer to pass target duration now, uncomment the next line and comment the 2-tuple above:
-        # tasks.append((narration, outp, target_dur))
-
-    audio_paths = [None] * len(tasks)
-    workers = min(max_workers, max(1, len(tasks)))
+        return (outpath, e, None)
 
-    with ThreadPoolExecutor(max_workers=workers) as ex:
-        future_to_index = {ex.submit(_tts_worker, t): idx for idx, t in enumerate(tasks)}
 
-        for fut in as_completed(future_to_index):
-            idx = future_to_index[fut]
-            outp, err = fut.result()
+# One pool for every video's TTS jobs, like JOB_EXECUTOR / RENDER_EXECUTOR
+TTS_EXECUTOR = ThreadPoolExecutor(max_workers=TTS_WORKERS, thread_name_prefix="tts")
 
-            if outp is None:
-                # Worker returned an unexpected value; create a silent fallback for stability
-                print(f"[WARN] TTS worker returned no output for segment {idx+1}. Using silent fallback.")
-                outp = os.path.join(tmpdir, f"segment_{idx:03d}.mp3")
-                run_cmd(["ffmpeg", "-y", "-f", "lavfi", "-i", "anullsrc=r=22050:cl=mono",
-                         "-t", "3.0", outp], timeout=15)
-                err = None
+class TTSBatch:
+    """TTS jobs for one video, submitted as soon as each segment is known.
 
-            if err:
-                print(f"[WARN] TTS failed for segment {idx+1}: {err}")
-                # Create a short silent fallback equal to segment.duration (or 3s min)
-                fallback_dur = max(3.0, float(segments[idx].get("duration", 3.0)))
-                run_cmd(["ffmpeg", "-y", "-f", "lavfi", "-i", "anullsrc=r=22050:cl=mono",
-                         "-t", f"{fallback_dur:.2f}", outp], timeout=15)
-
-            actual = get_audio_duration(outp)
-            if actual <= 0:
-                actual = float(segments[idx].get("duration", 4.0))
+    submit() can be called while the script is still streaming in;
+    collect() then reconciles with the final segment list, (re)submitting any
+    segment that is missing or whose narration changed, and waits for all.
+    Jobs run on the shared TTS_EXECUTOR.
+    """
+    def __init__(self, tmpdir):
+        self.tmpdir = tmpdir
+        self.jobs = {}  # idx -> (future, narration, outpath)
+        self._futures = []  # every job submitted, including superseded ones
+        self._attempts = {}
+
+    @staticmethod
+    def _narration(idx, seg):
+        return (seg.get("narration", "") or "").strip() or f"Segment {idx+1}"
+
+    def submit(self, idx, seg):
+        narration = self._narration(idx, seg)
+        attempt = self._attempts.get(idx, 0)
+        self._attempts[idx] = attempt + 1
+        # A re-submitted segment gets its own file so a stale job can't overwrite it
+        suffix = f"_r{attempt}" if attempt else ""
+        outp = os.path.join(self.tmpdir, f"segment_{idx:03d}{suffix}.mp3")
+        fut = TTS_EXECUTOR.submit(_tts_worker, (narration, outp))
+        self.jobs[idx] = (fut, narration, outp)
+        self._futures.append(fut)
+
+    def collect(self, segments):
+        """Wait for audio of every segment; sets actual_duration/audio_path and returns the paths
+
+        Segments that fell back to silence get audio_path None and silent True.
+        """
+        for idx, seg in enumerate(segments):
+            job = self.jobs.get(idx)
+            if job is None or job[1] != self._narration(idx, seg):
+                self.submit(idx, seg)
+        for idx in [i for i in self.jobs if i >= len(segments)]:
+            self.jobs.pop(idx)[0].cancel()
+
+        audio_paths = [None] * len(segments)
+        future_to_index = {self.jobs[idx][0]: idx for idx in range(len(segments))}
+        try:
+            for fut in as_completed(future_to_index):
+                idx = future_to_index[fut]
+                outp, err, duration = fut.result()
+
+                if outp is None:
+                    # Worker returned an unexpected value; use a silent fallback for stability
+                    print(f"[WARN] TTS worker returned no output for segment {idx+1}. Using silent fallback.")
+                    duration = 3.0
+                    err = None
+
+                if err:
+                    print(f"[WARN] TTS failed for segment {idx+1}: {err}")
+                    # Short silent fallback equal to segment.duration (or 3s min)
+                    duration = max(3.0, float(segments[idx].get("duration", 3.0)))
+
+                # Silent segments have no file; assembly fills them with zeros
+                outp = outp if outp and os.path.exists(outp) else None
+                actual = duration or 0.0
+                if actual <= 0:
+                    actual = float(segments[idx].get("duration", 4.0))
+
+                segments[idx]["actual_duration"] = actual
+                segments[idx]["audio_path"] = outp
+                segments[idx]["silent"] = outp is None
+                audio_paths[idx] = outp
+        finally:
+            # Drop this video's jobs that haven't started (superseded, or after an error)
+            for fut in self._futures:
+                fut.cancel()
+
+        return audio_paths
+
+
+def generate_all_tts_parallel(segments, tmpdir):
+    """Generate TTS for all segments in parallel."""
+    batch = TTSBatch(tmpdir)
+    for i, seg in enumerate(segments):
+        batch.submit(i, seg)
+    return batch.collect(segments)
 
-            segments[idx]["actual_duration"] = actual
-            segments[idx]["audio_path"] = outp
-            audio_paths[idx] = outp
+# ---------------------------
+# Audio Assembly
+# ---------------------------
+# Narration is decoded to PCM once, silence and padding are NumPy buffers,
+# and the joined track is encoded exactly once, straight to the AAC that
+# ends up in the final mp4.
+def decode_to_pcm(path: str, sample_rate: int = AUDIO_SAMPLE_RATE) -> np.ndarray:
+    """Decode any audio file to mono float32 PCM at sample_rate"""
+    res = subprocess.run(
+        ["ffmpeg", "-v", "error", "-i", path, "-f", "f32le", "-ac", "1",
+         "-ar", str(sample_rate), "-"],
+        capture_output=True, timeout=60
+    )
+    if res.returncode != 0:
+        raise RuntimeError(f"Decoding {os.path.basename(path)} failed: "
+                           f"{res.stderr.decode(errors='replace')[-300:]}")
+    return np.frombuffer(res.stdout, dtype=np.float32)
+
+def fit_pcm(pcm: np.ndarray, duration: float, sample_rate: int = AUDIO_SAMPLE_RATE) -> np.ndarray:
+    """Trim or zero-pad pcm to exactly `duration` seconds"""
+    target = max(0, int(round(duration * sample_rate)))
+    if len(pcm) >= target:
+        return pcm[:target]
+    return np.concatenate([pcm, np.zeros(target - len(pcm), dtype=np.float32)])
+
+def segment_pcm(segments: list, sample_rate: int = AUDIO_SAMPLE_RATE, max_workers: int = 4) -> list:
+    """PCM buffer per segment, each exactly actual_duration long (silence for silent segments)"""
+    def load(seg):
+        duration = float(seg.get("actual_duration", seg.get("duration", 0)))
+        path = seg.get("audio_path")
+        if not path:
+            return np.zeros(int(round(duration * sample_rate)), dtype=np.float32)
+        try:
+            return fit_pcm(decode_to_pcm(path, sample_rate), duration, sample_rate)
+        except Exception as e:
+            print(f"[WARN] {e}; using silence")
+            return np.zeros(int(round(duration * sample_rate)), dtype=np.float32)
+    
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(segments)))) as ex:
+        return list(ex.map(load, segments))
+
+def encode_pcm(pcm: np.ndarray, out_path: str, sample_rate: int = AUDIO_SAMPLE_RATE,
+               codec_args: list = None):
+    """Encode mono float32 PCM with one ffmpeg run (AAC by default)"""
+    codec_args = codec_args or ["-c:a", "aac", "-b:a", "192k"]
+    res = subprocess.run(
+        ["ffmpeg", "-y", "-v", "error", "-f", "f32le", "-ar", str(sample_rate), "-ac", "1",
+         "-i", "-", *codec_args, out_path],
+        input=np.ascontiguousarray(pcm, dtype=np.float32).tobytes(),
+        capture_output=True, timeout=120
+    )
+    if res.returncode != 0:
+        raise RuntimeError(f"Audio encode failed: {res.stderr.decode(errors='replace')[-300:]}")
+    return out_path
+
+def assemble_narration(segments: list, out_path: str, sample_rate: int = AUDIO_SAMPLE_RATE) -> np.ndarray:
+    """Join all segment audio in memory and encode it once; returns the PCM track"""
+    pcm = segment_pcm(segments, sample_rate)
+    track = np.concatenate(pcm) if pcm else np.zeros(0, dtype=np.float32)
+    encode_pcm(track, out_path, sample_rate)
+    return track
 
-    return audio_paths
+# ---------------------------
+# OpenAI Client
+# ---------------------------
+# Completions run on an AsyncOpenAI client owned by one event loop on a
+# daemon thread; pipeline threads block on run(). Running them as tasks
+# gives every call a real deadline and lets a hedged duplicate be raced
+# against the original and the loser cancelled (its HTTP stream closed).
+class LatencyTracker:
+    """Recent completion latencies and the hedging budget derived from them"""
+    def __init__(self, window: int = 100, min_samples: int = 10,
+                 default: float = 45.0, fixed: float = 0.0):
+        self.samples = deque(maxlen=window)
+        self.min_samples = min_samples
+        self.default = default
+        self.fixed = fixed
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self.samples.append(seconds)
+
+    def p95(self):
+        with self._lock:
+            samples = sorted(self.samples)
+        if len(samples) < self.min_samples:
+            return None
+        return samples[math.ceil(0.95 * len(samples)) - 1]
+
+    def budget(self) -> float:
+        """Seconds a call may run before it gets hedged"""
+        if self.fixed > 0:
+            return self.fixed
+        p95 = self.p95()
+        return p95 if p95 is not None else self.default
+
+    def stats(self) -> dict:
+        p95 = self.p95()
+        return {"samples": len(self.samples), "p95": round(p95, 3) if p95 is not None else None,
+                "hedge_budget": round(self.budget(), 3)}
+
+class AsyncOpenAIRunner:
+    """An AsyncOpenAI client and the event-loop thread that drives it"""
+    def __init__(self, api_key: str, base_url: str = None, max_retries: int = 1):
+        self.client = openai.AsyncOpenAI(api_key=api_key, base_url=base_url, max_retries=max_retries)
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name="openai-loop", daemon=True)
+        self._thread.start()
+
+    def run(self, coro):
+        """Run a coroutine on the client's loop and wait for its result (not from that loop)"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+OPENAI = AsyncOpenAIRunner(OPENAI_API_KEY, OPENAI_BASE_URL, max_retries=OPENAI_MAX_RETRIES)
+SCRIPT_LATENCY = LatencyTracker(default=SCRIPT_HEDGE_DEFAULT_SEC, fixed=SCRIPT_HEDGE_AFTER_SEC)
+
+async def chat_json(messages: list, max_tokens: int, timeout: float) -> dict:
+    """One JSON-mode gpt-4o completion, parsed; raises asyncio.TimeoutError past `timeout`"""
+    response = await asyncio.wait_for(OPENAI.client.chat.completions.create(
+        model="gpt-4o",
+        messages=messages,
+        temperature=0.7,
+        max_completion_tokens=max_tokens,
+        response_format={"type": "json_object"},
+        timeout=timeout
+    ), timeout)
+    return json.loads(response.choices[0].message.content)
 
 # ---------------------------
 # ADAPTIVE Script Generation
@@ -384,10 +1258,231 @@ For calculation-heavy topics:
 - Example: "Solve 2x+5=9" should be ONE segment with all steps, not 5 segments
 """
 
-def generate_script_with_gpt4_adaptive(topic: str) -> dict:
-    """Generate adaptive script based on topic complexity"""
+class SegmentStreamParser:
+    """Pull complete objects out of the "segments" array of a JSON document as it streams in.
+
+    feed() takes the next chunk of completion text and returns (index, segment)
+    for each segment that became complete with it, in order. The index is the
+    object's position in the array, so one that fails to parse is skipped
+    without shifting the ones after it.
+    """
+    _ARRAY_START = re.compile(r'"segments"\s*:\s*\[')
+
+    def __init__(self):
+        self.buf = ""
+        self.pos = None      # scan position inside the segments array
+        self.done = False
+        self.count = 0       # objects closed so far, parsed or not
+        self._obj_start = None
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+
+    def feed(self, chunk: str) -> list:
+        self.buf += chunk
+        found = []
+        if self.done:
+            return found
+        if self.pos is None:
+            m = self._ARRAY_START.search(self.buf)
+            if not m:
+                return found
+            self.pos = m.end()
+        buf = self.buf
+        i = self.pos
+        while i < len(buf):
+            ch = buf[i]
+            if self._obj_start is None:
+                if ch == "{":
+                    self._obj_start = i
+                    self._depth = 1
+                elif ch == "]":
+                    self.done = True
+                    i += 1
+                    break
+            elif self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch == "{":
+                self._depth += 1
+            elif ch == "}":
+                self._depth -= 1
+                if self._depth == 0:
+                    try:
+                        found.append((self.count, json.loads(buf[self._obj_start:i + 1])))
+                    except ValueError:
+                        pass
+                    self.count += 1
+                    self._obj_start = None
+            i += 1
+        self.pos = i
+        return found
+
+async def _stream_script_completion(messages: list, on_segment, timeout: float) -> dict:
+    """Stream the script completion, calling on_segment(index, segment) as each one closes"""
+    stream = await OPENAI.client.chat.completions.create(
+        model="gpt-4o",
+        messages=messages,
+        temperature=0.7,
+        max_completion_tokens=4000,
+        response_format={"type": "json_object"},
+        stream=True,
+        timeout=timeout
+    )
+    parser = SegmentStreamParser()
+    parts = []
+    try:
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if not delta:
+                continue
+            parts.append(delta)
+            for idx, seg in parser.feed(delta):
+                try:
+                    on_segment(idx, seg)
+                except Exception as e:
+                    print(f"[WARN] Streamed segment handler failed: {e}")
+    finally:
+        # Also runs when a hedge won and this call is cancelled
+        await stream.close()
+    print(f"[SCRIPT] Streamed {parser.count} segments to TTS while generating")
+    return json.loads("".join(parts))
+
+def validate_script(script_data: dict):
+    """Raise ValueError unless the completion is a usable script"""
+    if "segments" not in script_data:
+        raise ValueError("No segments in script")
+    if len(script_data["segments"]) < 2:
+        raise ValueError("Too few segments")
+
+async def hedged_script_completion(messages: list, on_segment=None,
+                                   deadline: float = SCRIPT_TIMEOUT_SEC) -> dict:
+    """The first valid script from the call or its hedge, within `deadline` seconds.
+
+    If no valid script has arrived by SCRIPT_LATENCY.budget() (or the first
+    call has already failed), one duplicate request is sent; whichever
+    passes validate_script() first wins and the other is cancelled. Only
+    the first call streams segments to `on_segment`; TTSBatch.collect()
+    re-synthesizes any narration the winning script changed.
+    """
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    end = started + deadline
+    budget = SCRIPT_LATENCY.budget()
+    hedge_at = started + budget if SCRIPT_HEDGING else None
     
-    # Phase 1: Analyze complexity
+    async def attempt(stream_to):
+        if stream_to:
+            script_data = await _stream_script_completion(messages, stream_to, deadline)
+        else:
+            script_data = await chat_json(messages, 4000, deadline)
+        validate_script(script_data)
+        return script_data
+    
+    tasks = {asyncio.create_task(attempt(on_segment), name="primary")}
+    error = None
+    try:
+        while True:
+            now = loop.time()
+            if hedge_at is not None and (now >= hedge_at or not tasks):
+                hedge_at = None
+                print(f"[SCRIPT] No valid script after {now - started:.1f}s "
+                      f"(budget {budget:.1f}s), sending a hedged request")
+                SCRIPT_HEDGES.labels("sent").inc()
+                tasks.add(asyncio.create_task(attempt(None), name="hedge"))
+            if not tasks:
+                raise error
+            if now >= end:
+                raise TimeoutError(f"Script completion took longer than {deadline:.0f}s")
+            wake = min(end, hedge_at) if hedge_at is not None else end
+            done, tasks = await asyncio.wait(tasks, timeout=wake - now,
+                                             return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    # Latency as the caller saw it, hedge included
+                    SCRIPT_LATENCY.record(loop.time() - started)
+                    if task.get_name() == "hedge":
+                        SCRIPT_HEDGES.labels("won").inc()
+                        print(f"[SCRIPT] Hedged request won after {loop.time() - started:.1f}s")
+                    return task.result()
+                error = task.exception()
+                print(f"[SCRIPT] {task.get_name().title()} request failed: {type(error).__name__}: {error}")
+    finally:
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+# Local complexity pre-classifier: settles the obvious topics without the
+# gpt-4o analysis round trip. Durations/segment counts follow the tiers in
+# the analysis prompt below.
+COMPLEXITY_TARGETS = {
+    "simple": (30, 4),
+    "moderate": (90, 9),
+    "complex": (180, 15),
+    "comprehensive": (300, 24),
+}
+_EQUATION_RE = re.compile(r"[\w)\]²³]\s*(=|<|>|≤|≥)\s*[-\w(√]|\d\s*[+\-*/^×÷]\s*[\d(x-z]")
+_OPERATOR_RE = re.compile(r"[=+\-*/^×÷²³√<>]")
+_PROCEDURAL_RE = re.compile(
+    r"\b(solve|simplify|expand|factori[sz]e|factor|calculate|compute|evaluate|convert|"
+    r"differentiate|integrate|find the (value|roots?|area|derivative|integral))\b")
+_DERIVATION_RE = re.compile(r"\b(derive|derivation|prove|proof|show that)\b")
+_COMPREHENSIVE_RE = re.compile(
+    r"\b(chapter|complete guide|full course|everything about|all about|unit on|"
+    r"comprehensive|in depth|crash course)\b")
+_CONCEPTUAL_RE = re.compile(
+    r"\b(what is|what are|why does|why do|how does|how do|theorem|concept|intuition|"
+    r"meaning of|definition of|law of|principle)\b")
+
+def classify_topic_locally(topic: str) -> dict:
+    """Deterministic complexity guess from keywords and equation shape.
+
+    Returns an analysis dict shaped like the gpt-4o one (plus "source" and
+    "confidence"), or None when the topic doesn't match a rule we trust.
+    """
+    text = normalize_topic(topic)
+    words = len(text.split())
+    has_equation = bool(_EQUATION_RE.search(text))
+    operators = len(_OPERATOR_RE.findall(text))
+    
+    if _COMPREHENSIVE_RE.search(text):
+        complexity, procedural, confidence, reason = "comprehensive", False, 0.85, "broad-coverage wording"
+    elif _DERIVATION_RE.search(text):
+        complexity, procedural, confidence, reason = "complex", True, 0.8, "derivation/proof"
+    elif _PROCEDURAL_RE.search(text) and has_equation:
+        quadratic = "^2" in text or "²" in text or "quadratic" in text
+        complexity = "moderate" if (quadratic or operators > 6) else "simple"
+        procedural, confidence, reason = True, 0.9, f"solve-style verb with equation ({operators} operators)"
+    elif has_equation and words <= 6:
+        complexity, procedural, confidence, reason = "simple", True, 0.8, "bare expression"
+    elif _CONCEPTUAL_RE.search(text) and not has_equation and words <= 10:
+        complexity, procedural, confidence, reason = "moderate", False, 0.75, "single concept question"
+    else:
+        return None
+    
+    duration, segments = COMPLEXITY_TARGETS[complexity]
+    return {
+        "complexity": complexity,
+        "reasoning": f"local classifier: {reason}",
+        "recommended_duration": duration,
+        "recommended_segments": segments,
+        "is_procedural": procedural,
+        "key_concepts": [],
+        "source": "local",
+        "confidence": confidence,
+    }
+
+def analyze_topic_remote(topic: str) -> dict:
+    """Ask gpt-4o for the complexity analysis (one extra round trip)"""
     analysis_prompt = f"""Analyze this topic and determine complexity:
 Topic: {topic}
 
@@ -409,20 +1504,32 @@ Complexity Guidelines:
 
 Is Procedural: Does this involve step-by-step solving/calculation?
 """
-    
+    analysis = OPENAI.run(chat_json([{"role": "user", "content": analysis_prompt}], 500,
+                                    ANALYSIS_TIMEOUT_SEC))
+    analysis["source"] = "gpt-4o"
+    return analysis
+
+def analyze_topic(topic: str) -> dict:
+    """Complexity analysis: local classifier when confident, gpt-4o otherwise"""
+    with STAGE_SECONDS.labels("analysis").time():
+        local = classify_topic_locally(topic)
+        if local and local["confidence"] >= LOCAL_CLASSIFIER_MIN_CONFIDENCE:
+            print(f"[ANALYZE] Local classifier ({local['confidence']:.2f}): {local['reasoning']}")
+            return local
+        return analyze_topic_remote(topic)
+
+def generate_script_with_gpt4_adaptive(topic: str, on_segment=None) -> dict:
+    """Generate adaptive script based on topic complexity
+
+    With `on_segment`, the script completion is streamed and each segment is
+    handed over as soon as it is complete, so TTS can start before the
+    script is finished.
+    """
     print(f"[ANALYZE] Topic: {topic}")
     
     try:
-        # Get complexity analysis
-        analysis_response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[{"role": "user", "content": analysis_prompt}],
-            temperature=0.7,
-            max_completion_tokens=500,
-            response_format={"type": "json_object"}
-        )
-        
-        analysis = json.loads(analysis_response.choices[0].message.content)
+        # Phase 1: Analyze complexity
+        analysis = analyze_topic(topic)
         complexity = analysis.get("complexity", "moderate")
         recommended_duration = analysis.get("recommended_duration", 60)
         recommended_segments = analysis.get("recommended_segments", 8)
@@ -456,22 +1563,12 @@ CRITICAL INSTRUCTIONS:
 Generate complete, detailed script now."""}
         ]
         
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=script_messages,
-            temperature=0.7,
-            max_completion_tokens=4000,
-            response_format={"type": "json_object"}
-        )
-        
-        script_data = json.loads(response.choices[0].message.content)
+        generation_started = time.time()
+        script_data = OPENAI.run(hedged_script_completion(script_messages, on_segment))
+        STAGE_SECONDS.labels("script_generation").observe(time.time() - generation_started)
         
         # Validate
-        if "segments" not in script_data:
-            raise ValueError("No segments in script")
-        
-        if len(script_data["segments"]) < 2:
-            raise ValueError("Too few segments")
+        validate_script(script_data)
         
         # Add analysis metadata
         script_data["complexity"] = complexity
@@ -487,11 +1584,13 @@ Generate complete, detailed script now."""}
     except Exception as e:
         print(f"[ERROR] Script generation failed: {e}")
         traceback.print_exc()
+        FALLBACKS.labels("script").inc()
         
         # Minimal fallback
         return {
             "title": topic,
             "complexity": "simple",
+            "fallback": True,
             "segments": [
                 {
                     "segment_id": 1,
@@ -515,340 +1614,218 @@ Generate complete, detailed script now."""}
         }
 
 # ---------------------------
-# ADAPTIVE MANIM Scene Generator
+# Script Cache
 # ---------------------------
-# Key fixes for the Manim scene generation
-# Replace the generate_manim_scene_adaptive function with this improved version
-
-# COMPLETE FIXED VERSION - Replace generate_manim_scene_adaptive function in your main.py
+# Kept next to the per-video script.json artifacts; underscore folders in
+# OUTPUT_DIR are not generations and are skipped by the listings.
+SCRIPT_CACHE = DiskCache("script", os.path.join(OUTPUT_DIR, "_script_cache"),
+                         SCRIPT_CACHE_MAX_MB * 1024 * 1024,
+                         ttl=SCRIPT_CACHE_TTL_HOURS * 3600)
+
+_TOPIC_FILLER = re.compile(
+    r"^(please |can you |could you |make (me )?(a )?video (about|on) |create (a )?video (about|on) |"
+    r"explain |teach me |show me |tell me about )+"
+)
 
-def sanitize_for_text(text: str) -> str:
-    """Ultra-safe text cleaning for Manim Text objects"""
-    if not text:
-        return "Empty"
-    
-    # Remove all problematic characters
-    text = str(text)
-    text = text.replace("\\", " ")
-    text = text.replace('"', "'")
-    text = text.replace("\r", " ")
-    text = text.replace("\n", " ")
-    text = text.replace("\t", " ")
-    text = re.sub(r'\s+', ' ', text)
-    
-    # Keep only safe characters
-    safe_chars = []
-    for char in text:
-        if char.isprintable() and ord(char) < 128:
-            safe_chars.append(char)
-        else:
-            safe_chars.append(' ')
+def normalize_topic(topic: str) -> str:
+    """Fold case, spacing, trailing punctuation and request filler so near-duplicates share a key"""
+    text = unicodedata.normalize("NFKC", topic or "").lower()
+    text = re.sub(r'\s+', ' ', text).strip()
+    text = _TOPIC_FILLER.sub("", text)
+    text = text.strip(" .!?;:,'\"")
+    # Spacing around operators doesn't change the math: "2x + 5 = 9" == "2x+5=9"
+    text = re.sub(r'\s*([=+\-*/^()])\s*', r'\1', text)
+    return text
+
+SCRIPT_FLIGHTS = SingleFlight("script")
+
+def _generate_script(key: str, topic: str, on_segment=None) -> str:
+    """Generate and cache a script; returned as JSON so every caller sharing a flight gets its own copy"""
+    script_data = generate_script_with_gpt4_adaptive(topic, on_segment=on_segment)
+    blob = json.dumps(script_data, ensure_ascii=False)
+    if not script_data.get("fallback"):
+        try:
+            SCRIPT_CACHE.put_bytes(key, blob.encode("utf-8"), ".json", {"topic": topic})
+        except OSError as e:
+            print(f"[CACHE] Could not store script: {e}")
+    return blob
+
+def get_script(topic: str, use_cache: bool = True, on_segment=None) -> dict:
+    """Script for a topic, served from SCRIPT_CACHE when a fresh copy exists.
+
+    With use_cache=False the cache is not read (but still refreshed).
+    Fallback scripts are never cached. `on_segment` enables streaming on a
+    miss (see generate_script_with_gpt4_adaptive). Concurrent misses on the
+    same topic share one completion; only the first caller streams.
+    """
+    key = DiskCache.make_key("script", normalize_topic(topic))
+    if use_cache:
+        cached = SCRIPT_CACHE.get(key, ".json")
+        if cached:
+            try:
+                with open(cached, "r", encoding="utf-8") as f:
+                    script_data = json.load(f)
+                script_data["cached"] = True
+                print(f"[SCRIPT] Cache hit for '{normalize_topic(topic)}'")
+                return script_data
+            except (OSError, ValueError) as e:
+                print(f"[CACHE] Unreadable cached script, regenerating: {e}")
     
-    result = ''.join(safe_chars).strip()
-    return result[:120] if result else "Content"
+    if not use_cache:
+        return json.loads(_generate_script(key, topic, on_segment))
+    return json.loads(SCRIPT_FLIGHTS.do(key, _generate_script, key, topic, on_segment))
 
+# ---------------------------
+# ADAPTIVE MANIM Scene Generator
+# ---------------------------
+# Scenes are rendered by scene_runtime.SegmentsScene straight from a JSON
+# spec; the only generated Python is a stub naming each scene's slice.
+SCENE_COLORS = {
+    "blue": "#3b82f6", "purple": "#a855f7", "green": "#10b981",
+    "orange": "#f97316", "red": "#ef4444", "yellow": "#eab308"
+}
+SCENE_LAYOUTS = {"title", "calculation", "step", "equation", "diagram", "split", "example"}
 
-def generate_manim_scene_adaptive(segments: list) -> str:
-    """Generate Manim scenes that MATCH audio durations exactly"""
-    
-    scene_code = ["""from manim import *
-import numpy as np
-
-class GeneratedScene(Scene):
-    def construct(self):
-        self.camera.background_color = "#0a0a0a"
-        self.current_y = 3.0
-        self.line_height = 0.7
-        
-"""]
-    
+def _scene_runtime_version() -> str:
+    """Hash of scene_runtime.py, so render cache keys change whenever the interpreter does"""
+    try:
+        with open(os.path.join(APP_DIR, "scene_runtime.py"), "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()[:16]
+    except OSError:
+        return "unknown"
+
+SCENE_RUNTIME_VERSION = _scene_runtime_version()
+
+def clean_display_text(text, limit: int = 120, default: str = "Content") -> str:
+    """Single-line, printable text for Manim Text objects (no code escaping needed)"""
+    text = "".join(ch if ch.isprintable() else " " for ch in str(text or ""))
+    text = re.sub(r'\s+', ' ', text).strip()
+    return text[:limit] if text else default
+
+def build_scene_spec(segments: list) -> list:
+    """Normalize script segments into the spec SegmentsScene renders"""
+    spec = []
     for i, seg in enumerate(segments):
-        segment_id = i + 1
-        # CRITICAL: Use actual audio duration
-        duration = float(seg.get("actual_duration", seg.get("duration", 5.0)))
         layout = seg.get("layout", "split")
-        step_data = seg.get("step_data", {})
-        
-        display_text = sanitize_for_text(seg.get("display_text", ""))
-        color_scheme = seg.get("color_scheme", "blue")
-        
-        color_map = {
-            "blue": "#3b82f6", "purple": "#a855f7", "green": "#10b981",
-            "orange": "#f97316", "red": "#ef4444", "yellow": "#eab308"
-        }
-        color = color_map.get(color_scheme, "#3b82f6")
-        
-        scene_code.append(f"""
-        # === SEGMENT {segment_id}: {layout.upper()} (Duration: {duration:.2f}s) ===
-""")
-        
-        # Clear screen for new title sections
-        if layout == "title" and i > 0:
-            scene_code.append("""
-        self.play(*[FadeOut(m) for m in self.mobjects], run_time=0.5)
-        self.current_y = 3.0
-        self.wait(0.2)
-""")
-        
-        # === CALCULATION: Match audio duration ===
-        if layout == "calculation" and step_data.get("calculation_steps"):
-            steps = step_data["calculation_steps"]
-            notes = step_data.get("annotations", [])
-            
-            # Distribute duration across steps
-            num_steps = len(steps)
-            time_per_step = duration / max(num_steps, 1)
-            animation_time = time_per_step * 0.7
-            wait_time = time_per_step * 0.3
-            
-            scene_code.append(f"""
-        # Calculation with {num_steps} steps over {duration:.1f}s
-        
-""")
-            
-            for j, step_text in enumerate(steps):
-                safe_step = sanitize_for_text(step_text)
-                safe_note = sanitize_for_text(notes[j]) if j < len(notes) else ""
-                
-                scene_code.append(f"""
-        step_{j} = Text("{safe_step}", font_size=32, color=WHITE)
-        step_{j}.move_to([0, self.current_y, 0], aligned_edge=LEFT).shift(LEFT*5)
-""")
-                
-                if safe_note:
-                    scene_code.append(f"""
-        note_{j} = Text("{safe_note}", font_size=22, color="{color}", slant=ITALIC)
-        note_{j}.next_to(step_{j}, RIGHT, buff=0.7)
-        self.play(Write(step_{j}), FadeIn(note_{j}, shift=RIGHT*0.2), run_time={animation_time:.2f})
-""")
-                else:
-                    scene_code.append(f"""
-        self.play(Write(step_{j}), run_time={animation_time:.2f})
-""")
-                
-                scene_code.append(f"""
-        self.wait({wait_time:.2f})
-        self.current_y -= self.line_height
-""")
-            
-            # Highlight answer
-            scene_code.append(f"""
-        answer_box = SurroundingRectangle(step_{len(steps)-1}, color="{color}", 
-                                         buff=0.15, stroke_width=3, corner_radius=0.1)
-        self.play(Create(answer_box), run_time=0.5)
-        self.wait(0.5)
-""")
-        
-        # === STEP ===
-        elif layout == "step":
-            anim_time = duration * 0.6
-            wait_time = duration * 0.4
-            
-            scene_code.append(f"""
-        label = Text("Step {segment_id}", font_size=24, color="{color}", weight=BOLD)
-        label.move_to([0, self.current_y, 0], aligned_edge=LEFT).shift(LEFT*5.5)
-        
-        content = Text("{display_text}", font_size=30, color=WHITE)
-        content.next_to(label, DOWN, buff=0.25, aligned_edge=LEFT)
-        
-        self.play(FadeIn(label, shift=DOWN*0.15), run_time=0.3)
-        self.play(Write(content), run_time={anim_time:.2f})
-        self.wait({wait_time:.2f})
-        
-        self.current_y -= self.line_height * 1.8
-""")
-        
-        # === TITLE ===
-        elif layout == "title":
-            if i == 0:
-                anim_time = duration * 0.5
-                wait_time = duration * 0.3
-                
-                scene_code.append(f"""
-        title = Text("{display_text}", font_size=52, weight=BOLD, color=WHITE)
-        title.move_to(ORIGIN)
-        
-        line = Line(LEFT*4.5, RIGHT*4.5, color="{color}", stroke_width=4)
-        line.next_to(title, DOWN, buff=0.35)
-        
-        self.play(Write(title), run_time={anim_time:.2f})
-        self.play(Create(line), run_time=0.5)
-        self.wait({wait_time:.2f})
-        
-        self.play(FadeOut(title, shift=UP*0.5), FadeOut(line, shift=UP*0.5), run_time=0.6)
-        self.current_y = 3.0
-""")
-            else:
-                anim_time = duration * 0.4
-                wait_time = duration * 0.6
-                
-                scene_code.append(f"""
-        header = Text("{display_text}", font_size=34, weight=BOLD, color="{color}")
-        header.to_edge(UP, buff=0.6)
-        
-        line = Line(LEFT*6, RIGHT*6, color="{color}", stroke_width=2)
-        line.next_to(header, DOWN, buff=0.2)
-        
-        self.play(Write(header), Create(line), run_time={anim_time:.2f})
-        self.current_y = 2.2
-        self.wait({wait_time:.2f})
-""")
-        
-        # === EQUATION ===
-        elif layout == "equation":
-            anim_time = duration * 0.7
-            wait_time = duration * 0.3
-            
-            scene_code.append(f"""
-        label = Text("Formula:", font_size=22, color="{color}")
-        label.move_to([0, self.current_y, 0], aligned_edge=LEFT).shift(LEFT*5.5)
-        
-        eq = Text("{display_text}", font_size=36, color=WHITE)
-        eq.next_to(label, RIGHT, buff=0.6)
-        
-        box = SurroundingRectangle(eq, color="{color}", buff=0.25, 
-                                   stroke_width=2, corner_radius=0.12)
-        box.set_fill("{color}", opacity=0.08)
-        
-        self.play(Write(label), run_time=0.3)
-        self.play(Create(box), Write(eq), run_time={anim_time:.2f})
-        self.wait({wait_time:.2f})
-        
-        self.current_y -= 1.0
-""")
-        
-        # === DIAGRAM ===
-        elif layout == "diagram":
-            anim_time = duration * 0.6
-            wait_time = duration * 0.4
-            
-            scene_code.append(f"""
-        label = Text("{display_text[:50]}", font_size=26, color=WHITE)
-        label.move_to([3.5, self.current_y, 0])
-        
-        shape = Circle(radius=0.8, color="{color}", stroke_width=2, fill_opacity=0.1)
-        shape.move_to([3.5, self.current_y-1.2, 0])
-        
-        self.play(Write(label), run_time={anim_time*0.4:.2f})
-        self.play(Create(shape), run_time={anim_time*0.6:.2f})
-        self.wait({wait_time:.2f})
-""")
-        
-        # === SPLIT ===
-        elif layout == "split":
-            anim_time = duration * 0.7
-            wait_time = duration * 0.3
-            
-            scene_code.append(f"""
-        text = Text("{display_text[:60]}", font_size=26, color=WHITE)
-        text.move_to([0, self.current_y, 0], aligned_edge=LEFT).shift(LEFT*5)
-        text.scale_to_fit_width(5)
-        
-        circles = VGroup(*[
-            Circle(radius=0.2+i*0.08, color="{color}", stroke_width=2, fill_opacity=0.05)
-            for i in range(3)
-        ])
-        circles.move_to([4, self.current_y, 0])
-        
-        self.play(FadeIn(text, shift=RIGHT*0.2), Create(circles), run_time={anim_time:.2f})
-        self.wait({wait_time:.2f})
-        self.current_y -= 1.2
-""")
-        
-        # === EXAMPLE ===
-        elif layout == "example":
-            anim_time = duration * 0.6
-            wait_time = duration * 0.4
-            
-            scene_code.append(f"""
-        ex_label = Text("Example:", font_size=26, color="{color}", weight=BOLD)
-        ex_label.move_to([0, self.current_y, 0], aligned_edge=LEFT).shift(LEFT*5.5)
-        
-        ex_text = Text("{display_text[:70]}", font_size=24, color=WHITE)
-        ex_text.next_to(ex_label, DOWN, buff=0.3, aligned_edge=LEFT)
-        ex_text.scale_to_fit_width(10)
-        
-        self.play(Write(ex_label), run_time={anim_time*0.3:.2f})
-        self.play(FadeIn(ex_text, shift=DOWN*0.2), run_time={anim_time*0.7:.2f})
-        self.wait({wait_time:.2f})
-        
-        self.current_y -= 1.4
-""")
-        
-        # === GENERIC FALLBACK ===
-        else:
-            anim_time = duration * 0.7
-            wait_time = duration * 0.3
-            
-            scene_code.append(f"""
-        text = Text("{display_text}", font_size=30, color=WHITE)
-        text.move_to([0, self.current_y, 0], aligned_edge=LEFT).shift(LEFT*5)
-        text.scale_to_fit_width(11)
-        
-        self.play(Write(text), run_time={anim_time:.2f})
-        self.wait({wait_time:.2f})
-        self.current_y -= 0.9
-""")
-        
-        # Auto-fade old content periodically
-        if segment_id > 0 and segment_id % 7 == 0:
-            scene_code.append("""
-        if self.current_y < -2.5:
-            old_mobs = self.mobjects[:-2] if len(self.mobjects) > 2 else []
-            if old_mobs:
-                self.play(*[mob.animate.set_opacity(0.2) for mob in old_mobs], run_time=0.4)
-            self.current_y = 2.5
-""")
-    
-    # Ending - hold for 2 seconds
-    scene_code.append("""
-        # Final hold
-        self.wait(2.0)
-        self.play(*[FadeOut(m) for m in self.mobjects], run_time=1.2)
-""")
-    
-    return "\n".join(scene_code)
-  
+        step_data = seg.get("step_data") or {}
+        steps = [clean_display_text(s) for s in step_data.get("calculation_steps") or []]
+        if layout == "calculation" and not steps:
+            layout = "text"
+        elif layout not in SCENE_LAYOUTS:
+            layout = "text"
+        spec.append({
+            "index": i,
+            "layout": layout,
+            # CRITICAL: Use actual audio duration
+            "duration": round(float(seg.get("actual_duration", seg.get("duration", 5.0))), 3),
+            "text": clean_display_text(seg.get("display_text", ""), default="Empty"),
+            "color": SCENE_COLORS.get(seg.get("color_scheme", "blue"), "#3b82f6"),
+            "steps": steps,
+            "notes": [clean_display_text(n, default="") for n in step_data.get("annotations") or []],
+        })
+    return spec
+
+
+def chunk_segments(segments: list, segments_per_scene: int) -> list:
+    """Split segment indexes into scene groups.
+
+    A group starts at every title segment after the first (those clear the
+    screen anyway) and holds at most `segments_per_scene` segments.
+    """
+    groups = []
+    for i, seg in enumerate(segments):
+        if (not groups or len(groups[-1]) >= segments_per_scene
+                or (seg.get("layout") == "title" and i > 0)):
+            groups.append([])
+        groups[-1].append(i)
+    return groups
 
-def validate_and_fix_scene(scene_path: str, outdir: str) -> bool:
-    """Validate Manim scene syntax"""
-    try:
-        py_compile.compile(scene_path, doraise=True)
-        print("[VALIDATE] ✓ Scene syntax valid")
-        return True
-    except py_compile.PyCompileError as e:
-        error_msg = str(e)
-        print(f"[VALIDATE] ✗ Syntax error: {error_msg[:200]}")
-        
-        with open(os.path.join(outdir, "validation_error.txt"), "w") as f:
-            f.write(f"Validation Error:\n{error_msg}\n\n")
-            f.write(f"Scene file: {scene_path}\n")
-        
-        return False
+
+def generate_manim_scene_adaptive(segments: list, segments_per_scene: int = None):
+    """Build the scene spec and the scene.py stub for a video.
+
+    With `segments_per_scene`, segments are grouped into separately
+    renderable scenes (see chunk_segments); otherwise the whole video is one
+    GeneratedScene. Returns (spec, scene_code, scenes) where scenes is
+    [{"name", "first", "last", "segments", "final"}] in playback order.
+    """
+    spec = build_scene_spec(segments)
+    if segments_per_scene:
+        groups = chunk_segments(spec, max(1, segments_per_scene))
+        names = [f"Scene{n + 1:03d}" for n in range(len(groups))]
+    else:
+        groups = [list(range(len(spec)))]
+        names = ["GeneratedScene"]
+    
+    scene_code = [
+        "# Generated scene stubs: content lives in scene_spec.json, drawing in scene_runtime.py",
+        "import os",
+        "from scene_runtime import SegmentsScene",
+        "",
+        'SPEC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "scene_spec.json")',
+    ]
+    scenes = []
+    for n, (name, group) in enumerate(zip(names, groups)):
+        final = n == len(groups) - 1
+        scene_code += [
+            "",
+            f"class {name}(SegmentsScene):",
+            "    spec_path = SPEC",
+            f"    first, last, final = {group[0]}, {group[-1] + 1}, {final}",
+        ]
+        scenes.append({"name": name, "first": group[0], "last": group[-1] + 1,
+                       "segments": [spec[i] for i in group], "final": final})
+    return spec, "\n".join(scene_code) + "\n", scenes
+
+def write_scene_spec(path: str, spec: list, scenes: list):
+    """scene_spec.json: the segment spec plus the scene split, enough to re-render later"""
+    layout = [{k: scene[k] for k in ("name", "first", "last", "final")} for scene in scenes]
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"segments": spec, "scenes": layout}, f, indent=2, ensure_ascii=False)
+
+def load_scene_spec(path: str) -> list:
+    """The scenes list generate_manim_scene_adaptive() returned for a saved scene_spec.json"""
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    spec = data["segments"]
+    layout = data.get("scenes") or [{"name": "GeneratedScene", "first": 0, "last": len(spec), "final": True}]
+    return [dict(scene, segments=spec[scene["first"]:scene["last"]]) for scene in layout]
 
 # ---------------------------
 # Manim Execution
 # ---------------------------
-def run_manim_with_logging(scene_path: str, quality: str, tmpdir: str, logfile: str):
-    """Run Manim with logging"""
-    quality_map = {
-        "low": "-ql",
-        "medium": "-qm",
-        "high": "-qh"
-    }
-    quality_flag = quality_map.get(quality, "-ql")
+QUALITY_FLAGS = {
+    "low": "-ql",
+    "medium": "-qm",
+    "high": "-qh"
+}
+
+def _manim_env() -> dict:
+    # scene.py stubs import scene_runtime from the app directory
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(p for p in [APP_DIR, env.get("PYTHONPATH")] if p)
+    return env
+
+def run_manim_with_logging(scene_path: str, quality: str, tmpdir: str, logfile: str,
+                           scene_name: str = "GeneratedScene", media_dir: str = None,
+                           output_file: str = "output", animations: tuple = None):
+    """Run Manim with logging (`animations`=(first, last) renders only that range)"""
+    quality_flag = QUALITY_FLAGS.get(quality, "-ql")
     
     cmd = [
         sys.executable, "-m", "manim",
         quality_flag,
         "--format", "mp4",
         "--disable_caching",
-        "--output_file", "output",
-        scene_path,
-        "GeneratedScene"
+        "--output_file", output_file,
     ]
+    if media_dir:
+        cmd += ["--media_dir", media_dir]
+    if animations:
+        cmd += ["-n", f"{animations[0]},{animations[1]}"]
+    cmd += [scene_path, scene_name]
     
-    print(f"[MANIM] Running: {' '.join(cmd[:5])}...")
+    print(f"[MANIM] Running: {' '.join(cmd[:5])} ... {scene_name}")
     
     with open(logfile, "w", encoding="utf-8") as log:
         log.write(f"Command: {' '.join(cmd)}\n")
@@ -859,6 +1836,7 @@ def run_manim_with_logging(scene_path: str, quality: str, tmpdir: str, logfile:
         process = subprocess.Popen(
             cmd,
             cwd=tmpdir,
+            env=_manim_env(),
             stdout=subprocess.PIPE,
             stderr=subprocess.STDOUT,
             text=True,
@@ -876,17 +1854,1084 @@ def run_manim_with_logging(scene_path: str, quality: str, tmpdir: str, logfile:
         
         return process.returncode
 
+# Shared across jobs, so concurrent videos queue for the same render slots
+# instead of each spawning cpu_count() Manim processes.
+RENDER_EXECUTOR = ThreadPoolExecutor(max_workers=MANIM_RENDER_WORKERS, thread_name_prefix="manim")
+
+def find_rendered_video(media_dir: str):
+    """Locate the combined mp4 Manim wrote under media_dir (ignores partial movie files)"""
+    for root, dirs, files in os.walk(media_dir):
+        dirs[:] = [d for d in dirs if d != "partial_movie_files"]
+        for fname in sorted(files):
+            if fname.endswith(".mp4"):
+                return os.path.join(root, fname)
+    return None
+
+def manim_error_summary(logfile: str) -> str:
+    with open(logfile, "r", encoding="utf-8") as f:
+        log_content = f.read()
+    
+    error_lines = [line for line in log_content.split("\n")
+                  if "ERROR" in line or "Traceback" in line or "TypeError" in line]
+    return "\n".join(error_lines[-10:]) if error_lines else "Unknown error"
+
+def concat_videos(paths: list, out_path: str, tmpdir: str):
+    """Join clips with the ffmpeg concat demuxer (stream copy, no re-encode)"""
+    list_path = os.path.join(tmpdir, os.path.basename(out_path) + ".concat.txt")
+    with open(list_path, "w", encoding="utf-8") as f:
+        for p in paths:
+            f.write(f"file '{p.replace(chr(92), '/')}'\n")
+    res = run_cmd(["ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", list_path,
+                   "-c", "copy", out_path], timeout=300)
+    if res.returncode != 0:
+        raise RuntimeError(f"Video concat failed: {res.stderr[-500:]}")
+    return out_path
+
+# Warm workers keep manim, Pango and fontconfig loaded between scenes; the
+# `python -m manim` subprocess stays as the fallback path.
+RENDER_POOL = (RenderWorkerPool(MANIM_RENDER_WORKERS, max_jobs_per_worker=MANIM_WORKER_MAX_JOBS)
+               if WARM_RENDER_WORKERS else None)
+
+@app.on_event("startup")
+def _start_render_pool():
+    if RENDER_POOL:
+        threading.Thread(target=RENDER_POOL.start, daemon=True, name="render-pool-start").start()
+
+@app.on_event("shutdown")
+def _stop_render_pool():
+    if RENDER_POOL:
+        RENDER_POOL.close()
+
+def _render_on_warm_worker(scene_path: str, scene: dict, quality: str,
+                           media_dir: str, logfile: str, output_file: str = None,
+                           animations: tuple = None):
+    """(returncode, video) from the warm pool, or None if the pool couldn't take the job"""
+    scene_name = scene["name"]
+    # The worker builds SegmentsScene from the spec directly, no scene.py import
+    job = {
+        "scene_path": scene_path,
+        "scene_name": scene_name,
+        "segments": scene["segments"],
+        "final": scene["final"],
+        "quality_flag": QUALITY_FLAGS.get(quality, "-ql"),
+        "media_dir": media_dir,
+        "output_file": output_file or scene_name,
+        "logfile": logfile,
+        "animations": animations,
+    }
+    try:
+        return 0, RENDER_POOL.render(job)
+    except WorkerCrashed as e:
+        print(f"[MANIM] Warm worker unavailable for {scene_name} ({e}); using subprocess")
+        return None
+    except RuntimeError as e:
+        with open(logfile, "a", encoding="utf-8") as log:
+            log.write(f"\n{e}\n")
+        for line in str(e).splitlines():
+            if "Error" in line or "Traceback" in line:
+                print(f"[MANIM ERROR] {line.strip()}")
+        return 1, None
+
+def _render_one_scene(scene_path: str, scene: dict, quality: str, tmpdir: str,
+                      animations: tuple = None, part: int = None):
+    """Render a scene, or with `animations`=(first, last) one time slice of it"""
+    scene_name = scene["name"]
+    output_file = scene_name if part is None else f"{scene_name}_part{part:02d}"
+    media_dir = os.path.join(tmpdir, "media", output_file)
+    logfile = os.path.join(tmpdir, f"manim_{output_file}.log")
+    started = time.time()
+    if RENDER_POOL and RENDER_POOL.available:
+        result = _render_on_warm_worker(scene_path, scene, quality, media_dir, logfile,
+                                        output_file=output_file, animations=animations)
+        if result is not None:
+            returncode, video = result
+            SCENE_RENDER_SECONDS.labels("warm").observe(time.time() - started)
+            return returncode, logfile, video
+        FALLBACKS.labels("warm_render").inc()
+    returncode = run_manim_with_logging(scene_path, quality, tmpdir, logfile,
+                                        scene_name=scene_name, media_dir=media_dir,
+                                        output_file=output_file, animations=animations)
+    video = find_rendered_video(media_dir) if returncode == 0 else None
+    SCENE_RENDER_SECONDS.labels("subprocess").observe(time.time() - started)
+    return returncode, logfile, video
+
 # ---------------------------
-# Main Generation Endpoint
+# Time-sliced Rendering
 # ---------------------------
-@app.post("/generate")
-async def generate(background_tasks: BackgroundTasks, req: Request):
-    data = await req.json()
+# A long scene is cut into ranges of animations (play/wait calls). Each
+# range renders in its own process with Manim's from/upto_animation_number:
+# earlier animations are fast-forwarded without writing frames, so every
+# slice starts from the exact scene state. Slices are joined by stream copy.
+def plan_scene_timeline(scene_path: str, scene: dict, tmpdir: str):
+    """Run time of each animation in the scene, or None if planning failed"""
+    logfile = os.path.join(tmpdir, f"plan_{scene['name']}.log")
+    if RENDER_POOL and RENDER_POOL.available:
+        try:
+            return RENDER_POOL.render({"plan": True, "segments": scene["segments"],
+                                       "final": scene["final"], "logfile": logfile})
+        except Exception as e:
+            print(f"[SLICE] Warm planning failed for {scene['name']}: {str(e).strip().splitlines()[-1:]}")
+    res = subprocess.run(
+        [sys.executable, "-m", "scene_runtime", "plan",
+         os.path.join(os.path.dirname(scene_path), "scene_spec.json"), scene["name"]],
+        cwd=tmpdir, env=_manim_env(), capture_output=True, text=True, timeout=300
+    )
+    for line in reversed(res.stdout.splitlines()):
+        if line.startswith("TIMELINE "):
+            return json.loads(line[len("TIMELINE "):])
+    print(f"[SLICE] Planning failed for {scene['name']}: {res.stderr[-300:]}")
+    return None
+
+def split_timeline(durations: list, parts: int) -> list:
+    """Cut animations 0..n-1 into up to `parts` contiguous (first, last) ranges of similar run time.
+
+    Cuts only fall between animations, so one long animation bounds the
+    longest slice. The ranges minimise the longest slice, then the spread
+    between slices (a small DP over prefix sums).
+    """
+    n = len(durations)
+    if not n:
+        return []
+    parts = max(1, min(parts, n))
+    prefix = [0.0]
+    for d in durations:
+        prefix.append(prefix[-1] + d)
+    
+    # best[k][j]: (longest slice, sum of squared slice lengths) putting the
+    # first j animations in k ranges; start[k][j]: where the k-th range begins
+    best = [[None] * (n + 1) for _ in range(parts + 1)]
+    start = [[0] * (n + 1) for _ in range(parts + 1)]
+    best[0][0] = (0.0, 0.0)
+    for k in range(1, parts + 1):
+        for j in range(k, n - (parts - k) + 1):
+            for i in range(k - 1, j):
+                if best[k - 1][i] is None:
+                    continue
+                longest, squares = best[k - 1][i]
+                length = prefix[j] - prefix[i]
+                candidate = (max(longest, length), squares + length * length)
+                if best[k][j] is None or candidate < best[k][j]:
+                    best[k][j] = candidate
+                    start[k][j] = i
+    
+    ranges = []
+    j = n
+    for k in range(parts, 0, -1):
+        i = start[k][j]
+        ranges.append((i, j - 1))
+        j = i
+    return ranges[::-1]
+
+def slice_counts(scenes: list) -> dict:
+    """How many slices each scene should render as.
+
+    Render workers are shared out in proportion to each scene's planned
+    length, so a single long scene gets all of them, and no slice is
+    shorter than TIME_SLICE_MIN_SECONDS.
+    """
+    if TIME_SLICE_MIN_SECONDS <= 0 or not scenes:
+        return {}
+    lengths = {s["name"]: sum(seg["duration"] for seg in s["segments"]) for s in scenes}
+    total = sum(lengths.values()) or 1.0
+    counts = {}
+    for name, length in lengths.items():
+        parts = min(int(round(MANIM_RENDER_WORKERS * length / total)), int(length // TIME_SLICE_MIN_SECONDS))
+        if parts >= 2:
+            counts[name] = parts
+    return counts
+
+def _join_slices(scene: dict, results: list, tmpdir: str):
+    """(returncode, logfile, video) for a scene rendered as slices"""
+    logfile = os.path.join(tmpdir, f"manim_{scene['name']}.log")
+    with open(logfile, "w", encoding="utf-8") as log:
+        for k, (returncode, part_log, _) in enumerate(results):
+            log.write(f"--- slice {k} (return code {returncode}) ---\n")
+            with open(part_log, "r", encoding="utf-8", errors="replace") as f:
+                log.write(f.read())
+            log.write("\n")
+    for returncode, _, video in results:
+        if returncode != 0 or not video:
+            return returncode or 1, logfile, None
+    joined = concat_videos([video for _, _, video in results],
+                           os.path.join(tmpdir, f"{scene['name']}_sliced.mp4"), tmpdir)
+    return 0, logfile, joined
+
+def scene_cache_key(scene: dict, quality: str) -> str:
+    """Content address of a rendered scene: its spec, quality flag, Manim and interpreter versions"""
+    return DiskCache.make_key("scene", scene["segments"], scene["final"],
+                              QUALITY_FLAGS.get(quality, "-ql"), MANIM_VERSION, SCENE_RUNTIME_VERSION)
+
+def _cached_scene(key: str, scene_name: str, tmpdir: str):
+    cached = RENDER_CACHE.get(key, ".mp4")
+    if not cached:
+        return None
+    return RENDER_CACHE.link_into(cached, os.path.join(tmpdir, f"cached_{scene_name}.mp4"))
+
+def _store_scene(key: str, scene_name: str, quality: str, result: tuple):
+    returncode, _, video = result
+    if returncode != 0 or not video:
+        return
+    try:
+        RENDER_CACHE.put(key, video, ".mp4", {"scene": scene_name, "quality": quality})
+    except OSError as e:
+        print(f"[CACHE] Could not store {scene_name}: {e}")
+
+# Identical scenes rendering at the same time (e.g. across a batch) are
+# rendered once; the other videos wait for the clip to land in RENDER_CACHE.
+RENDER_FLIGHTS = SingleFlight("render")
+
+def _resolve_when_rendered(key: str, scene: dict, parts: list, quality: str, tmpdir: str):
+    """Once every part future is done, join the parts, cache the clip and resolve the flight.
+
+    Runs on the render thread that finishes last, so no pipeline thread has
+    to reach this scene in its own order before others can use it.
+    """
+    remaining = [len(parts)]
+    lock = threading.Lock()
+    
+    def finish():
+        try:
+            results = [f.result() for f in parts]
+            result = results[0] if len(results) == 1 else _join_slices(scene, results, tmpdir)
+            _store_scene(key, scene["name"], quality, result)
+        except BaseException as e:
+            RENDER_FLIGHTS.done(key, error=e)
+        else:
+            RENDER_FLIGHTS.done(key, result)
+    
+    def part_done(_):
+        with lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if last:
+            finish()
+    
+    for f in parts:
+        f.add_done_callback(part_done)
+
+def render_scenes(scene_path: str, scenes: list, quality: str, tmpdir: str,
+                  logfile: str, on_scene_ready=None) -> str:
+    """Render every scene on the shared render pool and stitch them in order.
+
+    `scenes` comes from generate_manim_scene_adaptive(). Scenes whose clip is already in RENDER_CACHE
+    are spliced in without rendering, and scenes another video is rendering
+    right now are waited for rather than rendered twice. Per-scene logs are combined into
+    `logfile`. `on_scene_ready(scene, clip)` is called in scene order as soon
+    as each clip and all clips before it are done. Returns the path of the
+    joined video; raises HTTPException if any scene fails.
+    """
+    started = time.time()
+    results = {}
+    flights = {}
+    shared = set()
+    keys = {}
+    names = [scene["name"] for scene in scenes]
+    to_render = []
+    for scene in scenes:
+        name = scene["name"]
+        keys[name] = scene_cache_key(scene, quality)
+        cached = _cached_scene(keys[name], name, tmpdir)
+        if cached:
+            results[name] = (0, None, cached)
+            continue
+        flights[name], leader = RENDER_FLIGHTS.join(keys[name])
+        if leader:
+            to_render.append(scene)
+        else:
+            shared.add(name)
+    
+    # Long scenes are planned first (in parallel), then rendered as time slices
+    pending = [scene["name"] for scene in to_render]
+    try:
+        slices = slice_counts(to_render)
+        plans = {scene["name"]: RENDER_EXECUTOR.submit(plan_scene_timeline, scene_path, scene, tmpdir)
+                 for scene in to_render if scene["name"] in slices}
+        for scene in to_render:
+            name = scene["name"]
+            ranges = None
+            if name in plans:
+                timeline = plans[name].result()
+                ranges = split_timeline(timeline, slices[name]) if timeline else None
+            if ranges and len(ranges) > 1:
+                print(f"[SLICE] {name}: {len(timeline)} animations in {len(ranges)} slices")
+                parts = [RENDER_EXECUTOR.submit(_render_one_scene, scene_path, scene, quality,
+                                                tmpdir, animations=r, part=k)
+                         for k, r in enumerate(ranges)]
+            else:
+                parts = [RENDER_EXECUTOR.submit(_render_one_scene, scene_path, scene, quality, tmpdir)]
+            _resolve_when_rendered(keys[name], scene, parts, quality, tmpdir)
+            pending.remove(name)
+    except BaseException as e:
+        # Don't leave other videos waiting on flights that will never land
+        for name in pending:
+            RENDER_FLIGHTS.done(keys[name], error=e)
+        raise
+    
+    ready = on_scene_ready
+    for scene in scenes:
+        name = scene["name"]
+        if name in shared:
+            try:
+                outcome = flights[name].result()
+            except Exception:
+                outcome = None
+            cached = _cached_scene(keys[name], name, tmpdir) if outcome and outcome[0] == 0 else None
+            if cached:
+                results[name] = (0, None, cached)
+            else:
+                # The other render failed or its clip didn't reach the cache: render our own
+                shared.discard(name)
+                results[name] = RENDER_EXECUTOR.submit(_render_one_scene, scene_path, scene,
+                                                       quality, tmpdir).result()
+                _store_scene(keys[name], name, quality, results[name])
+        elif name in flights:
+            results[name] = flights[name].result()
+        returncode, _, video = results[name]
+        if returncode != 0 or not video:
+            ready = None  # Later clips can't be published past a gap
+        elif ready:
+            try:
+                ready(scene, video)
+            except Exception as e:
+                print(f"[HLS] Publishing {name} failed, stopping the stream: {e}")
+                ready = None
+    
+    with open(logfile, "w", encoding="utf-8") as log:
+        for name in names:
+            returncode, scene_log, _ = results[name]
+            if scene_log is None:
+                source = "shared with a concurrent render" if name in shared else "render cache hit"
+                log.write(f"{'='*30} {name} ({source}) {'='*30}\n\n")
+                continue
+            log.write(f"{'='*30} {name} (return code {returncode}) {'='*30}\n")
+            with open(scene_log, "r", encoding="utf-8") as f:
+                log.write(f.read())
+            log.write("\n")
+    
+    failed = [(name, results[name]) for name in names
+              if results[name][0] != 0 or not results[name][2]]
+    if failed:
+        name, (returncode, scene_log, video) = failed[0]
+        summary = manim_error_summary(scene_log) if returncode != 0 else "Rendered video not found"
+        raise HTTPException(
+            status_code=500,
+            detail=f"Manim render failed ({name}):\n{summary}\n\nFull log: {logfile}"
+        )
+    
+    videos = [results[name][2] for name in names]
+    rendered = len(flights) - len(shared)
+    print(f"[MANIM] {rendered} scene(s) rendered, {len(shared)} shared, "
+          f"{len(scenes) - len(flights)} from cache in {time.time() - started:.1f}s")
+    if len(videos) == 1:
+        return videos[0]
+    return concat_videos(videos, os.path.join(tmpdir, "video_joined.mp4"), tmpdir)
+
+def render_piped(scene_path: str, scenes: list, quality: str, audio_path: str,
+                 tmpdir: str, logfile: str) -> str:
+    """Render all scenes in one pass into a muxed mp4 (RENDER_MODE "pipe").
+
+    Frames go from the renderer straight into one ffmpeg that also takes
+    the narration, so there are no partial movies, per-scene clips, concat
+    or merge step. Scenes run back to back on one worker and skip the
+    render cache; use the "scenes" mode where parallelism matters more.
+    """
+    out_path = os.path.join(tmpdir, "final_output.mp4")
+    started = time.time()
+    if RENDER_POOL and RENDER_POOL.available:
+        job = {
+            "pipe": True,
+            "scenes": [{"segments": s["segments"], "final": s["final"]} for s in scenes],
+            "audio": audio_path,
+            "output": out_path,
+            "quality_flag": QUALITY_FLAGS.get(quality, "-ql"),
+            "logfile": logfile,
+        }
+        try:
+            RENDER_POOL.render(job)
+            SCENE_RENDER_SECONDS.labels("pipe_warm").observe(time.time() - started)
+            return out_path
+        except WorkerCrashed as e:
+            print(f"[MANIM] Warm worker unavailable ({e}), piping in a subprocess")
+            FALLBACKS.labels("warm_render").inc()
+        except RuntimeError as e:
+            with open(logfile, "a", encoding="utf-8") as log:
+                log.write(f"\n{e}\n")
+            raise HTTPException(
+                status_code=500,
+                detail=f"Manim render failed (pipe):\n{manim_error_summary(logfile)}\n\nFull log: {logfile}"
+            )
+    cmd = [sys.executable, "-m", "scene_runtime", "pipe",
+           os.path.join(os.path.dirname(scene_path), "scene_spec.json"), out_path,
+           "--audio", audio_path,
+           "--quality", QUALITY_PRESETS.get(QUALITY_FLAGS.get(quality, "-ql"), "low_quality")]
+    with open(logfile, "a", encoding="utf-8") as log:
+        log.write(f"Command: {' '.join(cmd)}\n\n")
+        log.flush()
+        res = subprocess.run(cmd, cwd=tmpdir, env=_manim_env(), stdout=log,
+                             stderr=subprocess.STDOUT, timeout=3600)
+    SCENE_RENDER_SECONDS.labels("pipe_subprocess").observe(time.time() - started)
+    if res.returncode != 0 or not os.path.exists(out_path):
+        raise HTTPException(
+            status_code=500,
+            detail=f"Manim render failed (pipe):\n{manim_error_summary(logfile)}\n\nFull log: {logfile}"
+        )
+    return out_path
+
+def merge_audio_video(video_path: str, audio_path: str, out_path: str):
+    """Mux the rendered video with the stage-3 AAC narration, both stream-copied"""
+    merge_cmd = [
+        "ffmpeg", "-y",
+        "-i", video_path,
+        "-i", audio_path,
+        "-c:v", "copy",
+        "-c:a", "copy",  # Narration is already AAC from stage 3
+        "-map", "0:v:0",  # Use video from first input
+        "-map", "1:a:0",
+        "-movflags", "+faststart",  # moov first so players can start before the download ends
+        "-f", "mp4",
+        out_path
+    ]
+    merge_res = run_cmd(merge_cmd, timeout=120)
+    if merge_res.returncode != 0:
+        raise HTTPException(status_code=500, detail="Audio/Video merge failed")
+    return out_path
+
+def publish_rendition(outdir: str, quality: str, merged: str) -> str:
+    """Move a merged file to final_output_<quality>.mp4 and make it final_output.mp4.
+
+    Both steps are os.replace() renames, so readers of final_output.mp4
+    see either the old or the new file, never a partial one.
+    """
+    rendition = os.path.join(outdir, f"final_output_{quality}.mp4")
+    os.replace(merged, rendition)
+    # Publish time, which published_quality() goes by
+    os.utime(rendition)
+    tmp = os.path.join(outdir, f".final_output.{uuid.uuid4().hex}.tmp")
+    try:
+        os.link(rendition, tmp)
+    except OSError:
+        shutil.copyfile(rendition, tmp)
+    final_out = os.path.join(outdir, "final_output.mp4")
+    os.replace(tmp, final_out)
+    return final_out
+
+def published_quality(outdir: str):
+    """Quality of the rendition final_output.mp4 currently is (None if there is none).
+
+    Renditions are published in the order they finish rendering, so the
+    newest final_output_<quality>.mp4 is the one being served.
+    """
+    newest = None
+    for quality in QUALITY_FLAGS:
+        try:
+            mtime = os.path.getmtime(os.path.join(outdir, f"final_output_{quality}.mp4"))
+        except OSError:
+            continue
+        if newest is None or mtime > newest[0]:
+            newest = (mtime, quality)
+    return newest[1] if newest else None
+
+# ---------------------------
+# Preview Upgrades
+# ---------------------------
+# A preview job returns a PREVIEW_QUALITY render first; the requested
+# quality is rendered here afterwards from the saved scene.py /
+# scene_spec.json and audio.m4a, then swapped in as final_output.mp4.
+UPGRADE_EXECUTOR = ThreadPoolExecutor(max_workers=UPGRADE_WORKERS, thread_name_prefix="upgrade")
+
+def upgrade_rendition(timestamp: str, quality: str, on_progress=None, render_mode: str = "scenes"):
+    outdir = os.path.join(OUTPUT_DIR, timestamp)
+    report = on_progress or (lambda **fields: None)
+    tmpdir = tempfile.mkdtemp(prefix="vidgen_upgrade_")
+    RETENTION.hold(timestamp)
+    started = time.time()
+    try:
+        report(upgrade="running")
+        print(f"[UPGRADE] {timestamp}: rendering {quality}")
+        for fname in ("scene.py", "scene_spec.json"):
+            shutil.copy2(os.path.join(outdir, fname), os.path.join(tmpdir, fname))
+        scene_path = os.path.join(tmpdir, "scene.py")
+        scenes = load_scene_spec(os.path.join(tmpdir, "scene_spec.json"))
+        logfile = os.path.join(outdir, f"manim_render_{quality}.log")
+        if render_mode == "pipe":
+            merged = render_piped(scene_path, scenes, quality, os.path.join(outdir, "audio.m4a"),
+                                  tmpdir, logfile)
+        else:
+            video_path = render_scenes(scene_path, scenes, quality, tmpdir, logfile)
+            merged = merge_audio_video(video_path, os.path.join(outdir, "audio.m4a"),
+                                       os.path.join(tmpdir, "final_output.mp4"))
+        publish_rendition(outdir, quality, merged)
+        STAGE_SECONDS.labels("upgrade").observe(time.time() - started)
+        row = INDEX.get(timestamp)
+        if row:
+            fresh = describe_generation(outdir)
+            row.update(media=fresh["media"], final_size=fresh["final_size"], quality=quality,
+                       upgrade=None)
+            INDEX.record(row)
+        report(upgrade="done", rendition=quality)
+        print(f"[UPGRADE] {timestamp}: {quality} is now final_output.mp4 ({time.time() - started:.1f}s)")
+        cleanup_temp_dir(tmpdir)
+    except Exception as e:
+        detail = e.detail if isinstance(e, HTTPException) else f"{type(e).__name__}: {e}"
+        print(f"[UPGRADE] {timestamp} failed, keeping the preview: {detail}")
+        print(f"[DEBUG] Temp dir preserved: {tmpdir}")
+        FAILURES.labels("upgrade").inc()
+        row = INDEX.get(timestamp)
+        if row:
+            row.update(upgrade="failed")
+            INDEX.record(row)
+        report(upgrade="failed", upgrade_error=str(detail))
+    finally:
+        RETENTION.release(timestamp)
+
+# ---------------------------
+# Progressive HLS Output
+# ---------------------------
+HLS_NAME_RE = re.compile(r"^(index\.m3u8|chunk_\d{3}\.ts)$")
+
+class HLSPlaylist:
+    """An EVENT playlist that grows by one MPEG-TS chunk per rendered scene.
+
+    Each chunk is the scene clip (stream copy) plus the narration under it,
+    sliced from the PCM track by video time exactly like the final merge
+    lines them up, so the stream and final_output.mp4 play the same.
+    EXT-X-TARGETDURATION may not change in an EVENT playlist, so it is fixed
+    up front from the planned scene lengths (see target_duration()).
+    """
+    def __init__(self, out_dir: str, narration_pcm: np.ndarray, target_duration: int,
+                 sample_rate: int = AUDIO_SAMPLE_RATE):
+        self.out_dir = out_dir
+        self.pcm = narration_pcm
+        self.target = target_duration
+        self.sample_rate = sample_rate
+        self.entries = []
+        self.elapsed = 0.0
+        self.finished = False
+        os.makedirs(out_dir, exist_ok=True)
+        self._write()
+
+    @staticmethod
+    def target_duration(scenes: list) -> int:
+        """Upper bound (s) on any scene clip: narration plus the scene's own transitions.
+
+        Layouts add at most ~2s per segment beyond the narration (titles,
+        answer boxes, fades) and a scene up to ~4s more (final hold, clear).
+        """
+        return max(int(math.ceil(sum(seg["duration"] for seg in scene["segments"])
+                                 + 2.0 * len(scene["segments"]) + 4.0))
+                   for scene in scenes)
+
+    def add_clip(self, scene: dict, clip: str):
+        duration = probe_duration(clip) or _ffprobe_duration(clip)
+        if round(duration) > self.target:
+            print(f"[HLS] {scene['name']} runs {duration:.1f}s, over the {self.target}s target duration")
+        start = int(round(self.elapsed * self.sample_rate))
+        audio = fit_pcm(self.pcm[start:], duration, self.sample_rate)
+        name = f"chunk_{len(self.entries):03d}.ts"
+        tmp = os.path.join(self.out_dir, f".{name}.tmp")
+        res = subprocess.run(
+            ["ffmpeg", "-y", "-v", "error",
+             "-i", clip,
+             "-f", "f32le", "-ar", str(self.sample_rate), "-ac", "1", "-i", "-",
+             "-map", "0:v:0", "-map", "1:a:0",
+             "-c:v", "copy", "-c:a", "aac", "-b:a", "192k",
+             "-muxdelay", "0", "-output_ts_offset", f"{self.elapsed:.6f}",
+             "-f", "mpegts", tmp],
+            input=np.ascontiguousarray(audio, dtype=np.float32).tobytes(),
+            capture_output=True, timeout=120
+        )
+        if res.returncode != 0:
+            raise RuntimeError(res.stderr.decode(errors="replace")[-300:])
+        os.replace(tmp, os.path.join(self.out_dir, name))
+        self.entries.append((name, duration))
+        self.elapsed += duration
+        self._write()
+        print(f"[HLS] {name} published ({scene['name']}, {duration:.1f}s, {self.elapsed:.1f}s total)")
+
+    def finish(self):
+        self.finished = True
+        self._write()
+
+    def _write(self):
+        lines = ["#EXTM3U", "#EXT-X-VERSION:3", f"#EXT-X-TARGETDURATION:{self.target}",
+                 "#EXT-X-MEDIA-SEQUENCE:0", "#EXT-X-PLAYLIST-TYPE:EVENT"]
+        for name, duration in self.entries:
+            lines += [f"#EXTINF:{duration:.3f},", name]
+        if self.finished:
+            lines.append("#EXT-X-ENDLIST")
+        path = os.path.join(self.out_dir, "index.m3u8")
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp, path)
+
+# ---------------------------
+# Generation Index
+# ---------------------------
+INDEX_MEDIA_FILES = ["audio.m4a", "audio.mp3", "video_only.mp4", "final_output.mp4"]
+
+class GenerationIndex:
+    """One row per output folder, so listings and diagnostics don't touch the disk.
+
+    Rows are written when a generation finishes (or fails) and backfilled
+    from the folders for generations made before the index existed.
+    JSON-valued fields (media, segment_breakdown, stage_timings) are stored
+    as text and decoded on the way out. `quality` is the rendition served as
+    final_output.mp4; `upgrade` is "pending" or "failed" while a preview
+    waits for (or lost) its requested quality, and NULL otherwise.
+    """
+    JSON_FIELDS = ("media", "segment_breakdown", "stage_timings")
+    COLUMNS = ("timestamp", "prompt", "quality", "status", "complexity", "segments",
+               "planned_duration", "duration", "final_size", "scene_file_lines",
+               "created_at", "finished_at", "error", "upgrade") + JSON_FIELDS
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS generations (
+                    timestamp TEXT PRIMARY KEY,
+                    prompt TEXT, quality TEXT, status TEXT, complexity TEXT,
+                    segments INTEGER, planned_duration REAL, duration REAL,
+                    final_size INTEGER, scene_file_lines INTEGER,
+                    created_at REAL, finished_at REAL, error TEXT,
+                    media TEXT, segment_breakdown TEXT, stage_timings TEXT,
+                    upgrade TEXT
+                )""")
+            # Indexes created before preview upgrades lack the upgrade column
+            columns = {r[1] for r in self._conn.execute("PRAGMA table_info(generations)")}
+            if "upgrade" not in columns:
+                self._conn.execute("ALTER TABLE generations ADD COLUMN upgrade TEXT")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS generations_created ON generations (created_at)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS generations_status ON generations (status, complexity)")
+
+    def record(self, row: dict):
+        values = [json.dumps(row.get(c)) if c in self.JSON_FIELDS else row.get(c)
+                  for c in self.COLUMNS]
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO generations ({', '.join(self.COLUMNS)}) "
+                f"VALUES ({', '.join('?' * len(self.COLUMNS))})", values)
+
+    def _decode(self, row) -> dict:
+        record = dict(row)
+        for c in self.JSON_FIELDS:
+            record[c] = json.loads(record[c]) if record[c] else None
+        return record
+
+    def get(self, timestamp: str):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM generations WHERE timestamp = ?",
+                                     (timestamp,)).fetchone()
+        return self._decode(row) if row else None
+
+    def query(self, limit: int = 20, offset: int = 0, status: str = None,
+              complexity: str = None, q: str = None) -> tuple:
+        """(total matching rows, page of rows) newest first"""
+        where, args = [], []
+        if status:
+            where.append("status = ?")
+            args.append(status)
+        if complexity:
+            where.append("complexity = ?")
+            args.append(complexity)
+        if q:
+            where.append("prompt LIKE ?")
+            args.append(f"%{q}%")
+        clause = f"WHERE {' AND '.join(where)}" if where else ""
+        with self._lock:
+            total = self._conn.execute(f"SELECT COUNT(*) FROM generations {clause}", args).fetchone()[0]
+            rows = self._conn.execute(
+                f"SELECT * FROM generations {clause} ORDER BY created_at DESC, timestamp DESC "
+                f"LIMIT ? OFFSET ?", args + [limit, offset]).fetchall()
+        return total, [self._decode(r) for r in rows]
+
+    def remove(self, timestamp: str):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM generations WHERE timestamp = ?", (timestamp,))
+
+    def known(self) -> set:
+        with self._lock:
+            return {r[0] for r in self._conn.execute("SELECT timestamp FROM generations")}
+
+    def backfill(self, output_dir: str, skip: set = ()):
+        """Index output folders that have no row yet (generations from before the index)"""
+        known = self.known()
+        added = 0
+        for folder in os.listdir(output_dir):
+            folder_path = os.path.join(output_dir, folder)
+            if folder.startswith("_") or folder in known or folder in skip or not os.path.isdir(folder_path):
+                continue
+            try:
+                self.record(describe_generation(folder_path))
+                added += 1
+            except Exception as e:
+                print(f"[INDEX] Could not index {folder}: {e}")
+        if added:
+            print(f"[INDEX] Backfilled {added} generation(s)")
+        return added
+
+
+def describe_generation(folder_path: str) -> dict:
+    """Index row for an output folder, read from the files it contains"""
+    timestamp = os.path.basename(folder_path)
+    row = {"timestamp": timestamp, "media": {}, "stage_timings": {}}
+    
+    request_path = os.path.join(folder_path, "request.json")
+    try:
+        with open(request_path, "r", encoding="utf-8") as f:
+            request = json.load(f)
+        row["prompt"] = (request.get("prompt") or "").strip()
+        row["quality"] = request.get("quality", "low")
+        row["created_at"] = os.path.getmtime(request_path)
+    except (OSError, ValueError):
+        row["created_at"] = os.path.getmtime(folder_path)
+    
+    script_path = os.path.join(folder_path, "script.json")
+    if os.path.exists(script_path):
+        with open(script_path, "r", encoding="utf-8") as f:
+            script_data = json.load(f)
+        segments = script_data.get("segments", [])
+        row["segments"] = len(segments)
+        row["planned_duration"] = sum(s.get("duration", 0) for s in segments)
+        row["duration"] = round(sum(s.get("actual_duration", s.get("duration", 0)) for s in segments), 2)
+        row["complexity"] = script_data.get("complexity", "unknown")
+        row["segment_breakdown"] = [
+            {
+                "id": i+1,
+                "layout": s.get("layout"),
+                "planned_duration": s.get("duration"),
+                "actual_duration": s.get("actual_duration"),
+                "narration_length": len(s.get("narration", ""))
+            }
+            for i, s in enumerate(segments)
+        ]
+    
+    media_files = [os.path.join(folder_path, f) for f in INDEX_MEDIA_FILES]
+    present = [p for p in media_files if os.path.exists(p)]
+    durations = probe_durations(present)
+    for path in present:
+        row["media"][os.path.basename(path)] = {"duration": durations[path],
+                                                "size": os.path.getsize(path)}
+    final = row["media"].get("final_output.mp4")
+    row["final_size"] = final["size"] if final else None
+    if final:
+        row["quality"] = published_quality(folder_path) or row.get("quality")
+    
+    scene_path = os.path.join(folder_path, "scene.py")
+    if os.path.exists(scene_path):
+        with open(scene_path, "r", encoding="utf-8") as f:
+            row["scene_file_lines"] = len(f.readlines())
+    
+    error_path = os.path.join(folder_path, "error.txt")
+    if final:
+        row["status"] = "succeeded"
+        row["finished_at"] = os.path.getmtime(os.path.join(folder_path, "final_output.mp4"))
+    elif os.path.exists(error_path):
+        row["status"] = "failed"
+        row["finished_at"] = os.path.getmtime(error_path)
+        with open(error_path, "r", encoding="utf-8", errors="replace") as f:
+            row["error"] = f.read(2000)
+    else:
+        row["status"] = "incomplete"
+    return row
+
+
+INDEX = GenerationIndex(INDEX_DB)
+
+@app.on_event("startup")
+def _start_index_backfill():
+    threading.Thread(target=INDEX.backfill, args=(OUTPUT_DIR,), daemon=True,
+                     name="index-backfill").start()
+
+# ---------------------------
+# Output Retention
+# ---------------------------
+def _dir_size(path: str) -> int:
+    total = 0
+    seen = set()
+    for root, _, files in os.walk(path):
+        for fname in files:
+            try:
+                st = os.lstat(os.path.join(root, fname))
+            except OSError:
+                continue
+            # final_output.mp4 is a hardlink of final_output_<quality>.mp4
+            if (st.st_dev, st.st_ino) not in seen:
+                seen.add((st.st_dev, st.st_ino))
+                total += st.st_size
+    return total
+
+class RetentionManager:
+    """Background sweeper that keeps OUTPUT_DIR within an age limit and a byte budget.
+
+    Each sweep first drops per-artifact intermediates from finished folders,
+    then removes folders past max_age, then the oldest folders until usage
+    is back under 90% of the budget. Folders of running generations (held
+    via hold/release), "_" folders and anything younger than min_age are
+    never touched. Full sweeps run every `interval` seconds, never on the
+    request path. Folder sizes are cached and only re-measured for folders
+    that were released since, so between sweeps a finished generation
+    costs one walk of its own folder, plus a sweep only if usage crossed
+    the budget.
+    """
+    def __init__(self, root: str, max_bytes: int, max_age: float = 0,
+                 drop_after_success: list = (), interval: float = 600, min_age: float = 3600):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.drop_after_success = list(drop_after_success)
+        self.interval = interval
+        self.min_age = min_age
+        self.active = {}  # timestamp -> holders
+        self.folders = {}  # timestamp -> (age mtime, bytes); only the sweeper thread touches it
+        self.other_bytes = 0  # "_" folders and loose files, measured on full sweeps
+        self._changed = set()
+        self.counters = {"sweeps": 0, "folders_deleted": 0, "artifacts_deleted": 0,
+                         "bytes_reclaimed": 0, "usage_bytes": None, "last_sweep": None,
+                         "last_sweep_seconds": None}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def hold(self, timestamp: str):
+        with self._lock:
+            self.active[timestamp] = self.active.get(timestamp, 0) + 1
+
+    def release(self, timestamp: str):
+        with self._lock:
+            if self.active.get(timestamp, 0) > 1:
+                self.active[timestamp] -= 1
+            else:
+                self.active.pop(timestamp, None)
+            self._changed.add(timestamp)
+        self._wake.set()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, daemon=True, name="retention")
+            self._thread.start()
+
+    def _loop(self):
+        next_sweep = 0.0
+        while True:
+            try:
+                if time.time() >= next_sweep:
+                    next_sweep = time.time() + self.interval
+                    self.sweep()
+                else:
+                    self._refresh_changed()
+            except Exception as e:
+                print(f"[RETENTION] Sweep failed: {e}")
+            self._wake.wait(max(0.0, next_sweep - time.time()))
+            self._wake.clear()
+
+    def _measure(self, name: str, path: str):
+        """Drop intermediates from a folder and cache its (age mtime, size); None if it is gone"""
+        if not os.path.isdir(path):
+            self.folders.pop(name, None)
+            return None
+        self._drop_artifacts(name, path)
+        try:
+            # request.json is written once at the start; the folder mtime moves with every change
+            mtime = os.path.getmtime(os.path.join(path, "request.json"))
+        except OSError:
+            try:
+                mtime = os.path.getmtime(path)
+            except OSError:
+                return None
+        self.folders[name] = (mtime, _dir_size(path))
+        return self.folders[name]
+
+    def _usage(self, active: set) -> int:
+        usage = self.other_bytes + sum(size for name, (_, size) in self.folders.items()
+                                       if name not in active)
+        # Running generations are still growing, so they are never cached
+        for name in active:
+            usage += _dir_size(os.path.join(self.root, name))
+        return usage
+
+    def _refresh_changed(self):
+        """Re-measure the folders released since the last pass; sweep if usage is over budget"""
+        with self._lock:
+            active = set(self.active)
+            changed = self._changed - active
+            self._changed -= changed
+        for name in changed:
+            if not name.startswith("_"):
+                self._measure(name, os.path.join(self.root, name))
+        usage = self._usage(active)
+        if usage > self.max_bytes:
+            self.sweep()
+        else:
+            with self._lock:
+                self.counters["usage_bytes"] = usage
+
+    def _reclaimed(self, nbytes: int, folders: int = 0, artifacts: int = 0):
+        with self._lock:
+            self.counters["bytes_reclaimed"] += nbytes
+            self.counters["folders_deleted"] += folders
+            self.counters["artifacts_deleted"] += artifacts
+
+    def _drop_artifacts(self, timestamp: str, folder_path: str) -> int:
+        if not os.path.exists(os.path.join(folder_path, "final_output.mp4")):
+            return 0
+        freed = 0
+        dropped = []
+        for fname in self.drop_after_success:
+            path = os.path.join(folder_path, fname)
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+            except OSError:
+                continue
+            freed += size
+            dropped.append(fname)
+        if dropped:
+            self._reclaimed(freed, artifacts=len(dropped))
+            row = INDEX.get(timestamp)
+            if row and row["media"]:
+                for fname in dropped:
+                    row["media"].pop(fname, None)
+                INDEX.record(row)
+        return freed
+
+    def _delete_folder(self, timestamp: str, folder_path: str, size: int, reason: str):
+        shutil.rmtree(folder_path, ignore_errors=True)
+        self.folders.pop(timestamp, None)
+        INDEX.remove(timestamp)
+        self._reclaimed(size, folders=1)
+        print(f"[RETENTION] Removed {timestamp} ({size / (1024 * 1024):.1f} MB, {reason})")
+
+    def sweep(self):
+        started = time.time()
+        with self._lock:
+            active = set(self.active)
+            changed = self._changed - active
+            self._changed -= changed
+        folders = []
+        seen = set()
+        other_bytes = 0
+        for entry in os.scandir(self.root):
+            try:
+                if entry.name.startswith("_") or not entry.is_dir():
+                    other_bytes += _dir_size(entry.path) if entry.is_dir() else entry.stat().st_size
+                    continue
+            except OSError:
+                continue
+            seen.add(entry.name)
+            if entry.name in active:
+                continue
+            cached = self.folders.get(entry.name)
+            if cached is None or entry.name in changed:
+                cached = self._measure(entry.name, entry.path)
+                if cached is None:
+                    continue
+            mtime, size = cached
+            if started - mtime < self.min_age:
+                continue
+            folders.append((mtime, entry.name, entry.path, size))
+        for name in set(self.folders) - seen:
+            self.folders.pop(name, None)
+        self.other_bytes = other_bytes
+        folders.sort()
+        
+        kept = []
+        for mtime, name, path, size in folders:
+            if self.max_age and started - mtime > self.max_age:
+                self._delete_folder(name, path, size, "expired")
+            else:
+                kept.append((mtime, name, path, size))
+        
+        usage = self._usage(active)
+        if usage > self.max_bytes:
+            for mtime, name, path, size in kept:
+                if usage <= self.max_bytes * 0.9:
+                    break
+                self._delete_folder(name, path, size, "over budget")
+                usage -= size
+        
+        with self._lock:
+            self.counters["sweeps"] += 1
+            self.counters["usage_bytes"] = usage
+            self.counters["last_sweep"] = datetime.now().isoformat()
+            self.counters["last_sweep_seconds"] = round(time.time() - started, 3)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self.counters)
+            stats["active"] = len(self.active)
+        stats["budget_bytes"] = self.max_bytes
+        stats["max_age_days"] = self.max_age / 86400 if self.max_age else None
+        stats["drop_after_success"] = self.drop_after_success
+        stats["reclaimed_mb"] = round(stats["bytes_reclaimed"] / (1024 * 1024), 2)
+        return stats
+
+
+RETENTION = RetentionManager(OUTPUT_DIR, int(OUTPUT_MAX_GB * 1024 ** 3),
+                             max_age=OUTPUT_MAX_AGE_DAYS * 86400,
+                             drop_after_success=RETENTION_DROP_AFTER_SUCCESS,
+                             interval=RETENTION_INTERVAL_SEC)
+
+@app.on_event("startup")
+def _start_retention():
+    RETENTION.start()
+
+# ---------------------------
+# Generation Pipeline
+# ---------------------------
+def run_generation_pipeline(data: dict, on_progress=None) -> dict:
+    """Run the six pipeline stages for one request body (blocking).
+
+    Call this from a worker thread, never from the event loop. `on_progress`
+    is called with keyword fields (stage=..., timestamp=...) as the job advances.
+    Raises HTTPException on failure, like the endpoints that wrap it.
+    """
     prompt = (data.get("prompt") or "").strip()
     quality = data.get("quality", "low")
+    # Preview: render quickly now, upgrade to `quality` in the background
+    preview = bool(data.get("preview")) and quality != PREVIEW_QUALITY and quality in QUALITY_FLAGS
+    render_quality = PREVIEW_QUALITY if preview else quality
+    render_mode = data.get("render_mode", RENDER_MODE)
+    if render_mode not in ("scenes", "pipe"):
+        raise HTTPException(status_code=400, detail="render_mode must be 'scenes' or 'pipe'")
     
-    if not prompt:
-        raise HTTPException(status_code=400, detail="prompt is required")
+    started_at = time.time()
+    stage_timings = {}
+    current = {"stage": None, "since": started_at}
+    
+    def enter_stage(stage):
+        now = time.time()
+        if current["stage"]:
+            stage_timings[current["stage"]] = round(now - current["since"], 3)
+            STAGE_SECONDS.labels(current["stage"]).observe(now - current["since"])
+        current.update(stage=stage, since=now)
+    
+    def progress(**fields):
+        if "stage" in fields:
+            enter_stage(fields["stage"])
+        if on_progress:
+            on_progress(**fields)
+    
+    def index(status: str, error: str = None):
+        GENERATIONS.labels(status).inc()
+        if status == "failed":
+            FAILURES.labels(current["stage"] or "setup").inc()
+        enter_stage(None)
+        try:
+            row = describe_generation(outdir)
+            # A preview serves render_quality until upgrade_rendition() swaps in `quality`
+            row.update(prompt=prompt, quality=render_quality, status=status, error=error,
+                       created_at=started_at, finished_at=time.time(),
+                       stage_timings=stage_timings,
+                       upgrade="pending" if preview and status == "succeeded" else None)
+            INDEX.record(row)
+        except Exception as e:
+            print(f"[INDEX] Could not record {timestamp}: {e}")
     
     print("\n" + "="*70)
     print(f"[START] Topic: {prompt}")
@@ -894,17 +2939,24 @@ async def generate(background_tasks: BackgroundTasks, req: Request):
     print(f"[START] Time: {datetime.now().strftime('%H:%M:%S')}")
     
     tmpdir = tempfile.mkdtemp(prefix="vidgen_")
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    outdir = os.path.join(OUTPUT_DIR, timestamp)
-    os.makedirs(outdir, exist_ok=True)
+    timestamp, outdir = create_output_dir()
+    RETENTION.hold(timestamp)
+    INFLIGHT_GENERATIONS.inc()
+    progress(timestamp=timestamp)
     
     with open(os.path.join(outdir, "request.json"), "w") as f:
         json.dump(data, f, indent=2)
     
     try:
         # STEP 1: Generate adaptive script
+        progress(stage="script")
         print("\n[1/6] Generating adaptive script...")
-        script_data = generate_script_with_gpt4_adaptive(prompt)
+        # Segments streamed out of the script completion start TTS right away
+        tts_batch = TTSBatch(tmpdir)
+        stream = data.get("stream_script", STREAM_SCRIPT)
+        # "fresh_script": true in the request body bypasses the script cache
+        script_data = get_script(prompt, use_cache=not data.get("fresh_script", False),
+                                 on_segment=tts_batch.submit if stream else None)
         segments = script_data.get("segments", [])
         
         with open(os.path.join(outdir, "script.json"), "w", encoding="utf-8") as f:
@@ -913,9 +2965,10 @@ async def generate(background_tasks: BackgroundTasks, req: Request):
         complexity = script_data.get("complexity", "moderate")
         print(f"[1/6] ✓ Generated {len(segments)} segments (complexity: {complexity})")
         
-         # STEP 2: Generate audio in parallel
+        # STEP 2: Generate audio in parallel
+        progress(stage="audio")
         print("\n[2/6] Generating audio...")
-        audio_paths = generate_all_tts_parallel(segments, tmpdir, max_workers=4)
+        tts_batch.collect(segments)
         
         # === CRITICAL DEBUG: Check actual durations ===
         print("\n" + "="*70)
@@ -947,78 +3000,60 @@ async def generate(background_tasks: BackgroundTasks, req: Request):
         print(f"[2/6] ✓ Audio ready: {total_duration:.1f}s total")
         
         # STEP 3: Concatenate audio
-        print("\n[3/6] Concatenating audio...")
-        concat_list = os.path.join(tmpdir, "concat.txt")
-        with open(concat_list, "w", encoding="utf-8") as f:
-            for p in audio_paths:
-                f.write(f"file '{p.replace(chr(92), '/')}'\n")
-        
-        final_audio = os.path.join(tmpdir, "voice.mp3")
-        res = run_cmd([
-            "ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", concat_list,
-            "-c:a", "libmp3lame", "-q:a", "2", final_audio
-        ], timeout=120)
-        
-        if res.returncode != 0:
+        progress(stage="concat")
+        print("\n[3/6] Assembling audio...")
+        final_audio = os.path.join(tmpdir, "voice.m4a")
+        try:
+            narration_pcm = assemble_narration(segments, final_audio)
+        except Exception as e:
+            print(f"[ERROR] {e}")
             raise HTTPException(status_code=500, detail="Audio concatenation failed")
         
-        shutil.copy2(final_audio, os.path.join(outdir, "audio.mp3"))
-        print(f"[3/6] ✓ Audio concatenated")
+        shutil.copy2(final_audio, os.path.join(outdir, "audio.m4a"))
+        print("[3/6] ✓ Audio assembled")
         
         # STEP 4: Generate adaptive Manim code
+        progress(stage="scene")
         print("\n[4/6] Generating adaptive Manim scene...")
-        scene_code = generate_manim_scene_adaptive(segments)
+        spec, scene_code, scenes = generate_manim_scene_adaptive(
+            segments, SEGMENTS_PER_SCENE if PARALLEL_RENDER else None)
         
         scene_path = os.path.join(tmpdir, "scene.py")
         with open(scene_path, "w", encoding="utf-8") as f:
             f.write(scene_code)
+        write_scene_spec(os.path.join(tmpdir, "scene_spec.json"), spec, scenes)
         
-        # Save copy for debugging
+        # Save copies for debugging
         shutil.copy2(scene_path, os.path.join(outdir, "scene.py"))
+        shutil.copy2(os.path.join(tmpdir, "scene_spec.json"), os.path.join(outdir, "scene_spec.json"))
         
-        # Validate
-        if not validate_and_fix_scene(scene_path, outdir):
-            raise HTTPException(status_code=500,
-                              detail="Scene validation failed. Check validation_error.txt")
-        
-        print(f"[4/6] ✓ Adaptive scene validated")
+        print(f"[4/6] ✓ Scene spec ready ({len(scenes)} scene(s))")
         
         # STEP 5: Render with Manim
+        progress(stage="render")
         print("\n[5/6] Rendering video with Manim...")
         manim_log = os.path.join(outdir, "manim_render.log")
         
-        returncode = run_manim_with_logging(scene_path, quality, tmpdir, manim_log)
-        
-        if returncode != 0:
-            with open(manim_log, "r", encoding="utf-8") as f:
-                log_content = f.read()
-            
-            error_lines = [line for line in log_content.split("\n")
-                          if "ERROR" in line or "Traceback" in line or "TypeError" in line]
-            error_summary = "\n".join(error_lines[-10:]) if error_lines else "Unknown error"
-            
-            raise HTTPException(
-                status_code=500,
-                detail=f"Manim render failed:\n{error_summary}\n\nFull log: {manim_log}"
-            )
-        
-        # Find rendered video
-        video_path = None
-        media_dir = os.path.join(tmpdir, "media")
-        
-        for root, dirs, files in os.walk(media_dir):
-            for fname in files:
-                if fname.endswith(".mp4"):
-                    video_path = os.path.join(root, fname)
-                    break
-            if video_path:
-                break
+        hls = None
+        if data.get("hls", HLS_OUTPUT):
+            if render_mode == "pipe":
+                # The stream is cut from per-scene clips, which piping never makes
+                print("[5/6] HLS needs per-scene clips, rendering in scenes mode")
+                render_mode = "scenes"
+            hls = HLSPlaylist(os.path.join(outdir, "hls"), narration_pcm,
+                              HLSPlaylist.target_duration(scenes))
+            progress(stream_url=f"/stream/{timestamp}/index.m3u8")
+        
+        video_path = merged = None
+        if render_mode == "pipe":
+            merged = render_piped(scene_path, scenes, render_quality, final_audio, tmpdir, manim_log)
+            print("[5/6] ✓ Video rendered and muxed in one pass")
+        else:
+            video_path = render_scenes(scene_path, scenes, render_quality, tmpdir, manim_log,
+                                       on_scene_ready=hls.add_clip if hls else None)
+        if hls:
+            hls.finish()
         
-        if not video_path or not os.path.exists(video_path):
-            raise HTTPException(
-                status_code=500,
-                detail=f"Rendered video not found in {media_dir}"
-            )
         if video_path:
             video_duration = get_audio_duration(video_path)
             audio_duration = get_audio_duration(final_audio)
@@ -1036,37 +3071,24 @@ async def generate(background_tasks: BackgroundTasks, req: Request):
                 print("⚠️  Check the generated scene.py file.")
             elif video_duration < audio_duration * 0.9:
                 print("⚠️  WARNING: Manim video is shorter than audio")
+            elif video_duration - audio_duration > 3.2 + max(1.0, audio_duration * 0.05):
+                # Beyond the closing hold (2s wait + 1.2s fade) the picture lags the voice
+                print(f"⚠️  WARNING: Manim video runs {video_duration - audio_duration:.1f}s "
+                      f"past the audio; scenes are drifting behind the narration")
             else:
                 print("✓ Video duration looks correct")
             
             print("="*70 + "\n")
-        
-        shutil.copy2(video_path, os.path.join(outdir, "video_only.mp4"))
-        print(f"[5/6] ✓ Video rendered: {os.path.basename(video_path)}")
-
-        
-        shutil.copy2(video_path, os.path.join(outdir, "video_only.mp4"))
-        print(f"[5/6] ✓ Video rendered: {os.path.basename(video_path)}")
+            
+            shutil.copy2(video_path, os.path.join(outdir, "video_only.mp4"))
+            print(f"[5/6] ✓ Video rendered: {os.path.basename(video_path)}")
         
         # STEP 6: Merge audio + video
-        print("\n[6/6] Merging audio and video...")
-        final_out = os.path.join(outdir, "final_output.mp4")
-        
-        merge_cmd = [
-            "ffmpeg", "-y",
-            "-i", video_path,
-            "-i", final_audio,
-            "-c:v", "copy",
-            "-c:a", "aac",
-            "-b:a", "192k",
-            "-map", "0:v:0",  # Use video from first input
-            "-map", "1:a:0",
-            final_out
-        ]
-        
-        merge_res = run_cmd(merge_cmd, timeout=120)
-        if merge_res.returncode != 0:
-            raise HTTPException(status_code=500, detail="Audio/Video merge failed")
+        progress(stage="merge")
+        if not merged:
+            print("\n[6/6] Merging audio and video...")
+            merged = merge_audio_video(video_path, final_audio, os.path.join(tmpdir, "final_output.mp4"))
+        final_out = publish_rendition(outdir, render_quality, merged)
         
         print(f"\n{'='*70}")
         print(f"[SUCCESS] Video generated!")
@@ -1077,17 +3099,30 @@ async def generate(background_tasks: BackgroundTasks, req: Request):
         print(f"[SUCCESS] Output folder: {outdir}")
         print(f"{'='*70}\n")
         
-        background_tasks.add_task(cleanup_temp_dir, tmpdir)
+        index("succeeded")
+        cleanup_temp_dir(tmpdir)
         
-        return FileResponse(
-            final_out,
-            media_type="video/mp4",
-            filename=f"video_{timestamp}.mp4"
-        )
+        if preview:
+            progress(rendition=render_quality, upgrade="queued")
+            UPGRADE_EXECUTOR.submit(upgrade_rendition, timestamp, quality, on_progress, render_mode)
+            print(f"[UPGRADE] {timestamp}: {render_quality} preview ready, {quality} queued")
+        
+        return {
+            "timestamp": timestamp,
+            "final_out": final_out,
+            "output_folder": outdir,
+            "duration": round(total_duration, 2),
+            "segments": len(segments),
+            "complexity": complexity,
+            "rendition": render_quality,
+            "upgrading_to": quality if preview else None,
+        }
     
-    except HTTPException:
+    except HTTPException as e:
+        index("failed", str(e.detail))
         raise
     except Exception as e:
+        index("failed", f"{type(e).__name__}: {e}")
         print(f"\n[CRITICAL ERROR] {type(e).__name__}: {e}")
         print(f"[DEBUG] Temp dir preserved: {tmpdir}")
         print(f"[DEBUG] Output dir: {outdir}")
@@ -1102,8 +3137,544 @@ async def generate(background_tasks: BackgroundTasks, req: Request):
             status_code=500,
             detail=f"{type(e).__name__}: {str(e)}\nCheck {outdir}/error.txt"
         )
+    finally:
+        INFLIGHT_GENERATIONS.dec()
+        RETENTION.release(timestamp)
+
 
+# ---------------------------
+# Job Subsystem
+# ---------------------------
+# Pipeline work runs on this pool so the event loop stays free for
+# /health, /video and friends while renders are in progress.
+JOB_EXECUTOR = ThreadPoolExecutor(max_workers=PIPELINE_WORKERS, thread_name_prefix="pipeline")
 
+class AdmissionController:
+    """Bounded admission in front of JOB_EXECUTOR.
+
+    At most `slots` generations run and at most `max_queued` wait; anything
+    beyond that is rejected up front (503 + Retry-After) instead of piling
+    onto the executor's unbounded queue and slowing every job down.
+    Retry-After is estimated from recent generation times.
+    """
+    def __init__(self, slots: int, max_queued: int):
+        self.slots = slots
+        self.max_queued = max_queued
+        self.running = 0
+        self.queued = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.avg_job_seconds = None
+        self.avg_wait_seconds = 0.0
+        self.last_wait_seconds = None
+        self._cond = threading.Condition()
+
+    def retry_after(self) -> int:
+        """Seconds until a running generation is likely to finish and free a spot"""
+        job_seconds = self.avg_job_seconds or 60.0
+        return max(1, int(math.ceil(job_seconds / self.slots)))
+
+    def submit(self, fn, *args):
+        """Queue fn(*args) on JOB_EXECUTOR, or raise HTTPException(503) when full"""
+        with self._cond:
+            if self.running + self.queued >= self.slots + self.max_queued:
+                self.rejected += 1
+                ADMISSION_REJECTED.inc()
+                raise HTTPException(status_code=503,
+                                    detail="Server is at capacity, retry later",
+                                    headers={"Retry-After": str(self.retry_after())})
+            self.queued += 1
+            self.admitted += 1
+            ADMISSION_QUEUE_DEPTH.set(self.queued)
+        return JOB_EXECUTOR.submit(self._run, time.time(), fn, args)
+
+    def try_submit(self, fn, *args):
+        """Like submit(), but only into an idle slot; returns None instead of queueing.
+
+        Background work (batches) uses this so it never takes the wait queue
+        away from interactive requests.
+        """
+        with self._cond:
+            if self.running + self.queued >= self.slots:
+                return None
+            self.queued += 1
+            self.admitted += 1
+            ADMISSION_QUEUE_DEPTH.set(self.queued)
+        return JOB_EXECUTOR.submit(self._run, time.time(), fn, args)
+
+    def _run(self, admitted_at: float, fn, args):
+        started = time.time()
+        wait = started - admitted_at
+        ADMISSION_WAIT_SECONDS.observe(wait)
+        with self._cond:
+            self.queued -= 1
+            self.running += 1
+            self.last_wait_seconds = wait
+            self.avg_wait_seconds = 0.8 * self.avg_wait_seconds + 0.2 * wait
+            ADMISSION_QUEUE_DEPTH.set(self.queued)
+        try:
+            return fn(*args)
+        finally:
+            elapsed = time.time() - started
+            with self._cond:
+                self.running -= 1
+                self.avg_job_seconds = (elapsed if self.avg_job_seconds is None
+                                        else 0.8 * self.avg_job_seconds + 0.2 * elapsed)
+                self._cond.notify_all()
+
+    def wait_for_slot(self):
+        """Block until a slot is idle, i.e. until try_submit() could succeed"""
+        with self._cond:
+            while self.running + self.queued >= self.slots:
+                self._cond.wait()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "slots": self.slots,
+                "running": self.running,
+                "queued": self.queued,
+                "max_queued": self.max_queued,
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "avg_wait_seconds": round(self.avg_wait_seconds, 3),
+                "last_wait_seconds": round(self.last_wait_seconds, 3) if self.last_wait_seconds is not None else None,
+                "avg_job_seconds": round(self.avg_job_seconds, 1) if self.avg_job_seconds else None,
+            }
+
+ADMISSION = AdmissionController(PIPELINE_WORKERS, MAX_QUEUED_JOBS)
+JOBS = {}
+JOBS_LOCK = threading.Lock()
+
+def _update_job(job_id: str, **fields):
+    with JOBS_LOCK:
+        job = JOBS.get(job_id)
+        if job is not None:
+            job.update(fields)
+
+def _prune_jobs():
+    """Drop the oldest finished jobs beyond JOB_HISTORY_LIMIT (call with JOBS_LOCK held)"""
+    finished = [j for j in JOBS.values() if j["status"] in ("succeeded", "failed")]
+    excess = len(finished) - JOB_HISTORY_LIMIT
+    if excess > 0:
+        finished.sort(key=lambda j: j["finished_at"] or "")
+        for job in finished[:excess]:
+            JOBS.pop(job["id"], None)
+
+def _run_job(job_id: str, data: dict):
+    """Worker entry point: run the pipeline and record the outcome on the job"""
+    _update_job(job_id, status="running", started_at=datetime.now().isoformat())
+    try:
+        result = run_generation_pipeline(
+            data, on_progress=lambda **fields: _update_job(job_id, **fields)
+        )
+        _update_job(
+            job_id,
+            status="succeeded",
+            stage="done",
+            result={
+                "timestamp": result["timestamp"],
+                "video_url": f"/video/{result['timestamp']}",
+                "duration": result["duration"],
+                "segments": result["segments"],
+                "complexity": result["complexity"],
+                "renditions": {
+                    q: f"/video/{result['timestamp']}?rendition={q}"
+                    for q in (result["rendition"], result["upgrading_to"]) if q
+                },
+            },
+        )
+    except HTTPException as e:
+        _update_job(job_id, status="failed", error=e.detail)
+    except Exception as e:
+        traceback.print_exc()
+        _update_job(job_id, status="failed", error=f"{type(e).__name__}: {e}")
+    finally:
+        _update_job(job_id, finished_at=datetime.now().isoformat())
+        with JOBS_LOCK:
+            _prune_jobs()
+
+def _new_job(data: dict, batch_id: str = None) -> dict:
+    """Create and register a queued job record"""
+    job_id = uuid.uuid4().hex
+    job = {
+        "id": job_id,
+        "batch_id": batch_id,
+        "status": "queued",
+        "stage": None,
+        "prompt": (data.get("prompt") or "").strip(),
+        "quality": data.get("quality", "low"),
+        "timestamp": None,
+        "stream_url": None,
+        "rendition": None,
+        "upgrade": None,
+        "created_at": datetime.now().isoformat(),
+        "started_at": None,
+        "finished_at": None,
+        "result": None,
+        "error": None,
+    }
+    with JOBS_LOCK:
+        JOBS[job_id] = job
+    return job
+
+def submit_job(data: dict) -> dict:
+    """Queue a generation on the pipeline pool and return its job record.
+
+    Raises HTTPException(503) when admission control turns it away.
+    """
+    job = _new_job(data)
+    job_id = job["id"]
+    try:
+        ADMISSION.submit(_run_job, job_id, data)
+    except HTTPException:
+        with JOBS_LOCK:
+            JOBS.pop(job_id, None)
+        raise
+    return dict(job)
+
+def job_counts() -> dict:
+    counts = {"queued": 0, "running": 0, "succeeded": 0, "failed": 0}
+    with JOBS_LOCK:
+        for job in JOBS.values():
+            counts[job["status"]] = counts.get(job["status"], 0) + 1
+    return counts
+
+async def _read_generation_request(req: Request) -> dict:
+    data = await req.json()
+    if not (data.get("prompt") or "").strip():
+        raise HTTPException(status_code=400, detail="prompt is required")
+    return data
+
+# ---------------------------
+# Batch Generation
+# ---------------------------
+# A batch is a list of generation requests. Its items are ordinary jobs
+# (visible in /jobs) fed to the pipeline pool one idle slot at a time, so
+# a course of hundreds of topics neither trips admission control nor
+# fills the queue ahead of interactive requests. Identical scripts,
+# narrations and scenes across items are produced once (SingleFlight)
+# and then served from the disk caches.
+BATCHES = {}
+BATCHES_LOCK = threading.Lock()
+
+class BatchScheduler:
+    """One FIFO of batch items across all batches, drained into idle pipeline slots"""
+    def __init__(self):
+        self.pending = deque()
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def add(self, items: list):
+        """Queue (batch_id, index, job_id, data) items"""
+        with self._cond:
+            self.pending.extend(items)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="batch-scheduler", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self.pending:
+                    self._cond.wait()
+                item = self.pending[0]
+            if ADMISSION.try_submit(_run_batch_item, *item) is None:
+                # Woken when a running generation finishes and frees its slot
+                ADMISSION.wait_for_slot()
+                continue
+            with self._cond:
+                self.pending.popleft()
+
+    def stats(self) -> dict:
+        with BATCHES_LOCK:
+            active = sum(1 for b in BATCHES.values() if b["finished_at"] is None)
+        return {"pending_items": len(self.pending), "active_batches": active}
+
+BATCH_SCHEDULER = BatchScheduler()
+
+def _run_batch_item(batch_id: str, index: int, job_id: str, data: dict):
+    _run_job(job_id, data)
+    with JOBS_LOCK:
+        job = dict(JOBS.get(job_id) or {"status": "failed", "error": "job record lost"})
+    # Copied onto the batch so the manifest outlives JOB_HISTORY_LIMIT pruning
+    with BATCHES_LOCK:
+        batch = BATCHES.get(batch_id)
+        if batch is None:
+            return
+        batch["items"][index].update(
+            status=job["status"],
+            timestamp=job.get("timestamp"),
+            result=job.get("result"),
+            error=job.get("error"),
+        )
+        if all(item["status"] in ("succeeded", "failed") for item in batch["items"]):
+            batch["finished_at"] = datetime.now().isoformat()
+            print(f"[BATCH] {batch_id} finished")
+            _prune_batches()
+
+def _prune_batches():
+    """Drop the oldest finished batches beyond BATCH_HISTORY_LIMIT (call with BATCHES_LOCK held)"""
+    finished = sorted((b for b in BATCHES.values() if b["finished_at"]), key=lambda b: b["finished_at"])
+    for batch in finished[:max(0, len(finished) - BATCH_HISTORY_LIMIT)]:
+        BATCHES.pop(batch["id"], None)
+
+def parse_batch_request(data: dict) -> list:
+    """Generation request bodies for a batch: `items` (objects or prompt strings) over shared defaults"""
+    items = data.get("items")
+    if not isinstance(items, list) or not items:
+        raise HTTPException(status_code=400, detail="items must be a non-empty list")
+    if len(items) > MAX_BATCH_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_ITEMS} items per batch")
+    defaults = {k: v for k, v in data.items() if k != "items"}
+    bodies = []
+    for i, item in enumerate(items):
+        item = {"prompt": item} if isinstance(item, str) else item
+        if not isinstance(item, dict) or not (item.get("prompt") or "").strip():
+            raise HTTPException(status_code=400, detail=f"items[{i}]: prompt is required")
+        bodies.append({**defaults, **item})
+    return bodies
+
+def submit_batch(bodies: list) -> dict:
+    batch_id = uuid.uuid4().hex
+    batch = {
+        "id": batch_id,
+        "created_at": datetime.now().isoformat(),
+        "finished_at": None,
+        "items": [],
+    }
+    scheduled = []
+    for index, data in enumerate(bodies):
+        job = _new_job(data, batch_id=batch_id)
+        batch["items"].append({
+            "index": index,
+            "job_id": job["id"],
+            "prompt": job["prompt"],
+            "quality": job["quality"],
+            "status": "queued",
+            "timestamp": None,
+            "result": None,
+            "error": None,
+        })
+        scheduled.append((batch_id, index, job["id"], data))
+    with BATCHES_LOCK:
+        BATCHES[batch_id] = batch
+    BATCH_SCHEDULER.add(scheduled)
+    print(f"[BATCH] {batch_id}: {len(scheduled)} item(s) queued")
+    return batch_manifest(batch_id)
+
+def batch_manifest(batch_id: str) -> dict:
+    """Batch state with per-item status (live from /jobs while running) and download links"""
+    with BATCHES_LOCK:
+        batch = BATCHES.get(batch_id)
+        if batch is None:
+            raise HTTPException(status_code=404, detail="Batch not found")
+        batch = {**batch, "items": [dict(item) for item in batch["items"]]}
+    with JOBS_LOCK:
+        for item in batch["items"]:
+            job = JOBS.get(item["job_id"])
+            if job and item["status"] not in ("succeeded", "failed"):
+                item.update(status=job["status"], stage=job["stage"], timestamp=job["timestamp"])
+    counts = {"queued": 0, "running": 0, "succeeded": 0, "failed": 0}
+    for item in batch["items"]:
+        counts[item["status"]] = counts.get(item["status"], 0) + 1
+        item["video_url"] = f"/video/{item['timestamp']}" if item["status"] == "succeeded" else None
+    batch.update(
+        status="finished" if batch["finished_at"] else ("running" if counts["queued"] < len(batch["items"]) else "queued"),
+        counts=counts,
+        manifest_url=f"/batches/{batch_id}",
+        zip_url=f"/batches/{batch_id}/zip",
+    )
+    return batch
+
+class _ZipSink:
+    """Write-only file object collecting what zipfile writes, so it can be streamed out"""
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+def iter_zip(files: list, entries: dict = None, chunk_size: int = 256 * 1024):
+    """Stream a stored (uncompressed) zip of (arcname, path) files plus in-memory entries.
+
+    Nothing is buffered beyond one chunk, so archives of any size start
+    downloading immediately. mp4 doesn't compress, so nothing is deflated.
+    """
+    sink = _ZipSink()
+    with zipfile.ZipFile(sink, "w", zipfile.ZIP_STORED, allowZip64=True) as zf:
+        for arcname, data in (entries or {}).items():
+            zf.writestr(arcname, data)
+        for arcname, path in files:
+            info = zipfile.ZipInfo.from_file(path, arcname)
+            with open(path, "rb") as src, zf.open(info, "w") as dst:
+                while True:
+                    chunk = src.read(chunk_size)
+                    if not chunk:
+                        break
+                    dst.write(chunk)
+                    yield sink.drain()
+            yield sink.drain()
+    yield sink.drain()
+
+def _batch_zip_name(item: dict) -> str:
+    slug = re.sub(r"[^a-z0-9]+", "-", normalize_topic(item["prompt"])).strip("-")[:50] or "video"
+    return f"{item['index']:03d}_{slug}.mp4"
+
+# ---------------------------
+# File Delivery
+# ---------------------------
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+def file_etag(st: os.stat_result) -> str:
+    return '"' + hashlib.sha1(f"{st.st_ino}-{st.st_mtime_ns}-{st.st_size}".encode()).hexdigest()[:20] + '"'
+
+def _etag_matches(header: str, etag: str) -> bool:
+    tags = [t.strip() for t in header.split(",")]
+    # If-None-Match uses weak comparison
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+def _parse_range(header: str, size: int):
+    """(start, end) inclusive for a single byte range, None to ignore it, or "invalid" for 416"""
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        return None  # Multi-range and unknown units: serve the whole file
+    first, last = match.groups()
+    if not first and not last:
+        return "invalid"
+    if not first:
+        start, end = max(0, size - int(last)), size - 1
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return "invalid"
+    return start, end
+
+def _iter_file(path: str, start: int, length: int, chunk_size: int = 256 * 1024):
+    with open(path, "rb") as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(chunk_size, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+def file_response(req: Request, path: str, media_type: str, filename: str = None,
+                  cache_control: str = VIDEO_CACHE_CONTROL):
+    """Serve a file with ETag/If-None-Match, single-range Range/206 and Cache-Control"""
+    st = os.stat(path)
+    etag = file_etag(st)
+    headers = {"ETag": etag, "Cache-Control": cache_control, "Accept-Ranges": "bytes"}
+    if filename:
+        headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+    
+    if_none_match = req.headers.get("if-none-match")
+    if if_none_match and _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    
+    range_header = req.headers.get("range")
+    if_range = req.headers.get("if-range")
+    if range_header and (not if_range or if_range.strip() == etag):
+        byte_range = _parse_range(range_header, st.st_size)
+        if byte_range == "invalid":
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{st.st_size}"})
+        if byte_range:
+            start, end = byte_range
+            length = end - start + 1
+            headers.update({"Content-Range": f"bytes {start}-{end}/{st.st_size}",
+                            "Content-Length": str(length)})
+            if req.method == "HEAD":
+                return Response(status_code=206, headers=headers, media_type=media_type)
+            return StreamingResponse(_iter_file(path, start, length), status_code=206,
+                                     headers=headers, media_type=media_type)
+    
+    return FileResponse(path, media_type=media_type, headers=headers,
+                        stat_result=st, method=req.method)
+
+# ---------------------------
+# Main Generation Endpoint
+# ---------------------------
+@app.post("/generate")
+async def generate(req: Request):
+    """Generate a video and return it (waits for the render, but off the event loop)"""
+    data = await _read_generation_request(req)
+    result = await asyncio.wrap_future(ADMISSION.submit(run_generation_pipeline, data))
+    return file_response(req, result["final_out"], "video/mp4",
+                         filename=f"video_{result['timestamp']}.mp4")
+
+@app.post("/jobs", status_code=202)
+async def create_job(req: Request):
+    """Queue a generation and return its job id immediately"""
+    data = await _read_generation_request(req)
+    job = submit_job(data)
+    return {
+        "job_id": job["id"],
+        "status": job["status"],
+        "status_url": f"/jobs/{job['id']}",
+    }
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Status, current stage and (once finished) result or error of a job"""
+    with JOBS_LOCK:
+        job = JOBS.get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="Job not found")
+        return dict(job)
+
+@app.get("/jobs")
+async def list_jobs():
+    """All jobs still held in memory, newest first"""
+    with JOBS_LOCK:
+        jobs = sorted((dict(j) for j in JOBS.values()),
+                      key=lambda j: j["created_at"], reverse=True)
+    return {"workers": PIPELINE_WORKERS, "jobs": jobs}
+
+@app.post("/generate/batch", status_code=202)
+async def generate_batch(req: Request):
+    """Queue a list of generations; returns the batch manifest immediately"""
+    return submit_batch(parse_batch_request(await req.json()))
+
+@app.get("/batches/{batch_id}")
+async def get_batch(batch_id: str):
+    """Batch manifest: per-item status, job ids and video URLs"""
+    return batch_manifest(batch_id)
+
+@app.get("/batches/{batch_id}/zip")
+async def download_batch(batch_id: str):
+    """Every finished video of a batch plus manifest.json, as a streamed zip"""
+    manifest = batch_manifest(batch_id)
+    files = []
+    for item in manifest["items"]:
+        path = os.path.join(OUTPUT_DIR, item["timestamp"] or "", "final_output.mp4")
+        if item["status"] == "succeeded" and os.path.isfile(path):
+            files.append((_batch_zip_name(item), path, item["timestamp"]))
+    
+    def stream():
+        # Keep retention from deleting videos halfway through the download
+        for _, _, timestamp in files:
+            RETENTION.hold(timestamp)
+        try:
+            yield from iter_zip([(name, path) for name, path, _ in files],
+                                {"manifest.json": json.dumps(manifest, indent=2, ensure_ascii=False)})
+        finally:
+            for _, _, timestamp in files:
+                RETENTION.release(timestamp)
+    
+    return StreamingResponse(stream(), media_type="application/zip",
+                             headers={"Content-Disposition": f'attachment; filename="batch_{batch_id}.zip"'})
 
 
 # ---------------------------
@@ -1112,19 +3683,15 @@ async def generate(background_tasks: BackgroundTasks, req: Request):
 @app.get("/")
 async def root():
     """API info and recent videos"""
-    videos = []
-    if os.path.exists(OUTPUT_DIR):
-        for folder in sorted(os.listdir(OUTPUT_DIR), reverse=True)[:10]:
-            folder_path = os.path.join(OUTPUT_DIR, folder)
-            if os.path.isdir(folder_path):
-                final_video = os.path.join(folder_path, "final_output.mp4")
-                if os.path.exists(final_video):
-                    size_mb = os.path.getsize(final_video) / (1024 * 1024)
-                    videos.append({
-                        "timestamp": folder,
-                        "size_mb": round(size_mb, 2),
-                        "url": f"/video/{folder}"
-                    })
+    _, rows = INDEX.query(limit=10, status="succeeded")
+    videos = [
+        {
+            "timestamp": row["timestamp"],
+            "size_mb": round((row["final_size"] or 0) / (1024 * 1024), 2),
+            "url": f"/video/{row['timestamp']}"
+        }
+        for row in rows
+    ]
     
     return {
         "service": "Adaptive Educational Video Generator",
@@ -1143,13 +3710,34 @@ async def root():
         "recent_videos": videos
     }
 
-@app.get("/video/{timestamp}")
-async def get_video(timestamp: str):
-    """Download specific video"""
-    video_path = os.path.join(OUTPUT_DIR, timestamp, "final_output.mp4")
+@app.api_route("/video/{timestamp}", methods=["GET", "HEAD"])
+async def get_video(timestamp: str, req: Request, rendition: str = None):
+    """Download specific video (supports Range and conditional requests).
+
+    `rendition=low|medium|high` picks a specific render; by default the best
+    one finished so far (final_output.mp4) is served.
+    """
+    if rendition and rendition not in QUALITY_FLAGS:
+        raise HTTPException(status_code=400, detail=f"rendition must be one of {', '.join(QUALITY_FLAGS)}")
+    fname = f"final_output_{rendition}.mp4" if rendition else "final_output.mp4"
+    video_path = os.path.join(OUTPUT_DIR, timestamp, fname)
     if not os.path.exists(video_path):
         raise HTTPException(status_code=404, detail="Video not found")
-    return FileResponse(video_path, media_type="video/mp4")
+    return file_response(req, video_path, "video/mp4")
+
+@app.api_route("/stream/{timestamp}/{name}", methods=["GET", "HEAD"])
+async def stream_file(timestamp: str, name: str, req: Request):
+    """HLS playlist and chunks, published while the video is still rendering"""
+    if not HLS_NAME_RE.match(name) or timestamp != os.path.basename(timestamp):
+        raise HTTPException(status_code=404, detail="Not found")
+    path = os.path.join(OUTPUT_DIR, timestamp, "hls", name)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Stream not found")
+    if name.endswith(".m3u8"):
+        # The playlist keeps growing until #EXT-X-ENDLIST; chunks never change
+        return file_response(req, path, "application/vnd.apple.mpegurl", cache_control="no-cache")
+    return file_response(req, path, "video/mp2t",
+                         cache_control="public, max-age=31536000, immutable")
 
 @app.get("/debug/{timestamp}")
 async def debug_info(timestamp: str):
@@ -1159,7 +3747,7 @@ async def debug_info(timestamp: str):
         raise HTTPException(status_code=404, detail="Generation not found")
     
     files = {}
-    for fname in ["script.json", "scene.py", "manim_render.log", "error.txt", 
+    for fname in ["script.json", "scene.py", "scene_spec.json", "manim_render.log", "error.txt",
                   "validation_error.txt", "request.json"]:
         fpath = os.path.join(folder_path, fname)
         if os.path.exists(fpath):
@@ -1182,58 +3770,99 @@ async def health():
         "timestamp": datetime.now().isoformat(),
         "python": sys.version,
         "output_dir": OUTPUT_DIR,
-        "features": "adaptive_duration,step_by_step,procedural_detection"
+        "features": "adaptive_duration,step_by_step,procedural_detection",
+        "pipeline_workers": PIPELINE_WORKERS,
+        "admission": ADMISSION.stats(),
+        "jobs": job_counts(),
+        "batches": BATCH_SCHEDULER.stats(),
+        "coalesced": {f.name: f.stats() for f in (SCRIPT_FLIGHTS, TTS_FLIGHTS, RENDER_FLIGHTS)},
+        "script_latency": SCRIPT_LATENCY.stats(),
+        "caches": {name: cache.stats() for name, cache in CACHES.items()},
+        "elevenlabs": dict(ELEVEN_CLIENT.counters),
+        "render_pool": RENDER_POOL.stats() if RENDER_POOL else None,
+        "retention": RETENTION.stats()
+    }
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus exposition"""
+    PIPELINE_UTILIZATION.set(ADMISSION.stats()["running"] / PIPELINE_WORKERS)
+    for status, count in job_counts().items():
+        JOB_STATES.labels(status).set(count)
+    if RENDER_POOL:
+        pool = RENDER_POOL.stats()
+        RENDER_WORKERS.labels("busy").set(pool["busy"])
+        RENDER_WORKERS.labels("idle").set(pool["idle"])
+        RENDER_UTILIZATION.set(pool["busy"] / pool["size"] if pool["size"] else 0)
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+@app.get("/retention")
+async def retention_stats():
+    """Disk usage of OUTPUT_DIR and what the retention sweeper has reclaimed"""
+    return RETENTION.stats()
+
+@app.get("/generations")
+async def list_generations(limit: int = 20, offset: int = 0, status: str = None,
+                           complexity: str = None, q: str = None):
+    """Page through indexed generations, newest first, filtered by status/complexity/prompt text"""
+    limit = max(1, min(limit, 200))
+    total, rows = INDEX.query(limit=limit, offset=max(0, offset), status=status,
+                              complexity=complexity, q=q)
+    return {
+        "total": total,
+        "limit": limit,
+        "offset": offset,
+        "generations": [
+            {
+                "timestamp": row["timestamp"],
+                "prompt": row["prompt"],
+                "status": row["status"],
+                "quality": row["quality"],
+                "upgrade": row["upgrade"],
+                "complexity": row["complexity"],
+                "segments": row["segments"],
+                "duration": row["duration"],
+                "size_mb": round(row["final_size"] / (1024 * 1024), 2) if row["final_size"] else None,
+                "stage_timings": row["stage_timings"],
+                "created_at": datetime.fromtimestamp(row["created_at"]).isoformat() if row["created_at"] else None,
+                "url": f"/video/{row['timestamp']}" if row["status"] == "succeeded" else None,
+            }
+            for row in rows
+        ]
     }
 
 @app.get("/diagnose/{timestamp}")
 async def diagnose_video(timestamp: str):
     """Detailed diagnostics for a video generation"""
+    row = INDEX.get(timestamp)
     folder_path = os.path.join(OUTPUT_DIR, timestamp)
-    if not os.path.isdir(folder_path):
-        raise HTTPException(status_code=404, detail="Generation not found")
+    if row is None:
+        # Not indexed yet (backfill still running): index it now
+        if timestamp.startswith("_") or not os.path.isdir(folder_path):
+            raise HTTPException(status_code=404, detail="Generation not found")
+        row = await asyncio.to_thread(describe_generation, folder_path)
+        INDEX.record(row)
     
     diagnostics = {
         "timestamp": timestamp,
-        "folder": folder_path
+        "folder": folder_path,
+        "status": row["status"],
+        "quality": row["quality"],
+        "upgrade": row["upgrade"],
+        "stage_timings": row["stage_timings"],
     }
-    
-    # Load script
-    script_path = os.path.join(folder_path, "script.json")
-    if os.path.exists(script_path):
-        with open(script_path, "r") as f:
-            script_data = json.load(f)
-            segments = script_data.get("segments", [])
-            
-            diagnostics["num_segments"] = len(segments)
-            diagnostics["planned_duration"] = sum(s.get("duration", 0) for s in segments)
-            diagnostics["complexity"] = script_data.get("complexity", "unknown")
-            
-            diagnostics["segment_breakdown"] = [
-                {
-                    "id": i+1,
-                    "layout": s.get("layout"),
-                    "planned_duration": s.get("duration"),
-                    "actual_duration": s.get("actual_duration"),
-                    "narration_length": len(s.get("narration", ""))
-                }
-                for i, s in enumerate(segments)
-            ]
-    
-    # Check file durations
-    for filename in ["audio.mp3", "video_only.mp4", "final_output.mp4"]:
-        filepath = os.path.join(folder_path, filename)
-        if os.path.exists(filepath):
-            duration = get_audio_duration(filepath)
-            size_mb = os.path.getsize(filepath) / (1024 * 1024)
-            diagnostics[f"{filename}_duration"] = duration
-            diagnostics[f"{filename}_size_mb"] = round(size_mb, 2)
-    
-    # Check scene.py line count
-    scene_path = os.path.join(folder_path, "scene.py")
-    if os.path.exists(scene_path):
-        with open(scene_path, "r") as f:
-            scene_lines = len(f.readlines())
-            diagnostics["scene_file_lines"] = scene_lines
+    if row["segments"] is not None:
+        diagnostics["num_segments"] = row["segments"]
+        diagnostics["planned_duration"] = row["planned_duration"]
+        diagnostics["complexity"] = row["complexity"]
+        diagnostics["segment_breakdown"] = row["segment_breakdown"]
+    for filename, info in (row["media"] or {}).items():
+        diagnostics[f"{filename}_duration"] = info["duration"]
+        diagnostics[f"{filename}_size_mb"] = round(info["size"] / (1024 * 1024), 2)
+    if row["scene_file_lines"] is not None:
+        diagnostics["scene_file_lines"] = row["scene_file_lines"]
+    if row["error"]:
+        diagnostics["error"] = row["error"]
     
     return JSONResponse(diagnostics)
 
@@ -0,0 +1,297 @@
+# render_worker.py - Warm, long-lived Manim render processes
+# Each worker imports manim and loads Pango/fontconfig once, then renders
+# scene jobs sent over a pipe. Workers are recycled after a number of jobs
+# and replaced if they crash or hang, so a bad scene can't take down the API.
+
+import multiprocessing as mp
+import os, sys, time, threading, traceback, queue, uuid
+import importlib.util
+
+QUALITY_PRESETS = {
+    "-ql": "low_quality",
+    "-qm": "medium_quality",
+    "-qh": "high_quality"
+}
+
+# ---------------------------
+# Worker side
+# ---------------------------
+class _redirect_output:
+    """Send fd 1/2 (Python, rich and C-level writes alike) to a log file"""
+    def __init__(self, logfile: str):
+        self.logfile = logfile
+
+    def __enter__(self):
+        sys.stdout.flush()
+        sys.stderr.flush()
+        self.log = open(self.logfile, "a", encoding="utf-8")
+        self.saved = (os.dup(1), os.dup(2))
+        os.dup2(self.log.fileno(), 1)
+        os.dup2(self.log.fileno(), 2)
+        return self.log
+
+    def __exit__(self, *exc):
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.dup2(self.saved[0], 1)
+        os.dup2(self.saved[1], 2)
+        os.close(self.saved[0])
+        os.close(self.saved[1])
+        self.log.close()
+        return False
+
+def _load_scene_module(scene_path: str):
+    name = f"scene_{uuid.uuid4().hex}"
+    spec = importlib.util.spec_from_file_location(name, scene_path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    try:
+        spec.loader.exec_module(module)
+    finally:
+        sys.modules.pop(name, None)
+    return module
+
+def _text_cache_stats() -> dict:
+    scene_runtime = sys.modules.get("scene_runtime")
+    return scene_runtime.TEXT_CACHE.stats() if scene_runtime else {}
+
+def _render_job(job: dict):
+    """Render one scene in this process; returns (movie path, text cache stats for this job)"""
+    from manim import tempconfig
+
+    options = {
+        "quality": QUALITY_PRESETS.get(job["quality_flag"], "low_quality"),
+        "media_dir": job["media_dir"],
+        "output_file": job["output_file"],
+        "disable_caching": True,
+        "format": "mp4",
+        "write_to_movie": True,
+        "input_file": job["scene_path"],
+    }
+    if job.get("animations"):
+        # Time slice: animations before the range are fast-forwarded without frames
+        options["from_animation_number"], options["upto_animation_number"] = job["animations"]
+    with _redirect_output(job["logfile"]) as log:
+        log.write(f"Warm worker {os.getpid()}: {job['scene_name']} from {job['scene_path']}\n")
+        log.write(f"Time: {time.ctime()}\n")
+        log.write("="*70 + "\n\n")
+        log.flush()
+        started = time.time()
+        text_before = _text_cache_stats()
+        with tempconfig(options):
+            if "segments" in job:
+                # Data-driven scene: nothing to import per job
+                from scene_runtime import SegmentsScene
+                scene = SegmentsScene(segments=job["segments"], final=job["final"])
+            else:
+                module = _load_scene_module(job["scene_path"])
+                scene = getattr(module, job["scene_name"])()
+            scene.render()
+            movie = str(scene.renderer.file_writer.movie_file_path)
+        print(f"\nRendered in {time.time() - started:.2f}s: {movie}", flush=True)
+    text_stats = {k: v - text_before.get(k, 0) for k, v in _text_cache_stats().items()}
+    return movie, text_stats
+
+def _plan_job(job: dict) -> list:
+    """Animation timeline of a SegmentsScene (see scene_runtime.plan_timeline)"""
+    from scene_runtime import plan_timeline
+    with _redirect_output(job["logfile"]):
+        return plan_timeline(job["segments"], job["final"])
+
+def _pipe_job(job: dict):
+    """Render all scenes into one muxed mp4 (see scene_runtime.render_piped)"""
+    from scene_runtime import render_piped
+    with _redirect_output(job["logfile"]) as log:
+        log.write(f"Warm worker {os.getpid()}: {len(job['scenes'])} scene(s) piped to {job['output']}\n")
+        log.flush()
+        started = time.time()
+        text_before = _text_cache_stats()
+        out = render_piped([(s["segments"], s["final"]) for s in job["scenes"]], job["output"],
+                           job.get("audio"), QUALITY_PRESETS.get(job["quality_flag"], "low_quality"))
+        print(f"\nRendered in {time.time() - started:.2f}s: {out}", flush=True)
+    text_stats = {k: v - text_before.get(k, 0) for k, v in _text_cache_stats().items()}
+    return out, text_stats
+
+def _warm_up():
+    import scene_runtime  # noqa: F401 - imports manim as well
+    from manim import Text
+    # First Text() pays for Pango, fontconfig and the SVG parser setup
+    Text("warm up")
+
+def worker_main(conn, max_jobs: int):
+    """Process entry point: warm up, then serve up to max_jobs render jobs"""
+    try:
+        _warm_up()
+    except Exception:
+        conn.send(("failed", None, traceback.format_exc()))
+        return
+    conn.send(("ready", os.getpid(), None))
+    for _ in range(max_jobs):
+        try:
+            job = conn.recv()
+        except EOFError:
+            return
+        if job is None:
+            return
+        try:
+            if job.get("plan"):
+                conn.send(("ok", _plan_job(job), None, None))
+                continue
+            movie, text_stats = (_pipe_job if job.get("pipe") else _render_job)(job)
+            conn.send(("ok", movie, None, text_stats))
+        except Exception:
+            conn.send(("error", None, traceback.format_exc(), None))
+
+# ---------------------------
+# Parent side
+# ---------------------------
+class WorkerCrashed(RuntimeError):
+    """The worker died or hung; the job may be retried elsewhere"""
+
+class _Worker:
+    def __init__(self, process, conn):
+        self.process = process
+        self.conn = conn
+        self.jobs = 0
+
+    def stop(self, timeout: float = 5):
+        try:
+            self.conn.send(None)
+        except (OSError, ValueError):
+            pass
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+class RenderWorkerPool:
+    """A fixed number of warm render processes handing out one job at a time each"""
+
+    def __init__(self, size: int, max_jobs_per_worker: int = 25,
+                 job_timeout: float = 1800, start_timeout: float = 180):
+        self.size = size
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self.job_timeout = job_timeout
+        self.start_timeout = start_timeout
+        self.available = False
+        self.busy = 0
+        self.recycled = 0
+        self.crashed = 0
+        self.text_cache = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+        self._ctx = mp.get_context("spawn")
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _spawn(self):
+        parent_conn, child_conn = self._ctx.Pipe()
+        process = self._ctx.Process(target=worker_main,
+                                    args=(child_conn, self.max_jobs_per_worker),
+                                    daemon=True)
+        process.start()
+        child_conn.close()
+        if not parent_conn.poll(self.start_timeout):
+            process.kill()
+            raise RuntimeError("render worker did not start in time")
+        try:
+            status, _, error = parent_conn.recv()
+        except EOFError:
+            process.join()
+            raise RuntimeError(f"render worker exited during start-up (code {process.exitcode})")
+        if status != "ready":
+            process.join()
+            raise RuntimeError(f"render worker failed to start:\n{error}")
+        return _Worker(process, parent_conn)
+
+    def _add_worker(self):
+        try:
+            worker = self._spawn()
+        except Exception as e:
+            print(f"[RENDER POOL] {e}")
+            return False
+        if self._closed:
+            worker.stop()
+            return False
+        self._idle.put(worker)
+        return True
+
+    def _replace_later(self):
+        threading.Thread(target=self._add_worker, daemon=True).start()
+
+    def start(self):
+        """Spawn and warm all workers (blocking); the pool is unavailable if none start"""
+        started = sum(self._add_worker() for _ in range(self.size))
+        self.available = started > 0
+        print(f"[RENDER POOL] {started}/{self.size} warm render workers ready")
+        return self.available
+
+    def render(self, job: dict):
+        """Render a scene job on a warm worker and return the movie path
+        (the timeline for "plan" jobs, the muxed mp4 for "pipe" jobs).
+
+        Raises RuntimeError with the worker traceback if the scene fails,
+        or WorkerCrashed if the worker died or timed out.
+        """
+        try:
+            worker = self._idle.get(timeout=self.start_timeout)
+        except queue.Empty:
+            raise WorkerCrashed("no warm render worker became available")
+        with self._lock:
+            self.busy += 1
+        healthy = False
+        try:
+            worker.conn.send(job)
+            if not worker.conn.poll(self.job_timeout):
+                raise WorkerCrashed(f"render timed out after {self.job_timeout}s")
+            status, movie, error, text_stats = worker.conn.recv()
+            worker.jobs += 1
+            healthy = True
+            with self._lock:
+                for k, v in (text_stats or {}).items():
+                    self.text_cache[k] = self.text_cache.get(k, 0) + v
+            if status != "ok":
+                raise RuntimeError(error)
+            return movie
+        except (EOFError, OSError) as e:
+            raise WorkerCrashed(f"render worker died: {e}")
+        finally:
+            with self._lock:
+                self.busy -= 1
+            if healthy and worker.jobs < self.max_jobs_per_worker and not self._closed:
+                self._idle.put(worker)
+            else:
+                with self._lock:
+                    if healthy:
+                        self.recycled += 1
+                    else:
+                        self.crashed += 1
+                worker.stop(timeout=1 if not healthy else 5)
+                if not self._closed:
+                    self._replace_later()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "available": self.available,
+                "size": self.size,
+                "busy": self.busy,
+                "idle": self._idle.qsize(),
+                "recycled": self.recycled,
+                "crashed": self.crashed,
+                "text_cache": self._text_cache_stats(),
+            }
+
+    def _text_cache_stats(self) -> dict:
+        stats = dict(self.text_cache)
+        lookups = sum(stats.values())
+        stats["hit_rate"] = round((stats["memory_hits"] + stats["disk_hits"]) / lookups, 3) if lookups else None
+        return stats
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().stop()
+            except queue.Empty:
+                break
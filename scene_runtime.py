@@ -0,0 +1,532 @@
+# scene_runtime.py - Data-driven Manim scenes
+# SegmentsScene draws the segment specs built by main.build_scene_spec()
+# directly, with one handler per layout, so no Python is generated, compiled
+# or escaped per video. The generated scene.py only holds thin subclasses
+# pointing at a slice of scene_spec.json.
+#
+#   python -m scene_runtime plan scene_spec.json Scene001
+# prints the run time of every play()/wait() of a scene without rendering.
+#
+#   python -m scene_runtime pipe scene_spec.json final.mp4 --audio voice.m4a
+# renders every scene in one pass straight into a single muxed mp4.
+
+import os, json, hashlib, pickle, threading, subprocess
+from collections import OrderedDict
+import manim
+from manim import *
+from manim.renderer.cairo_renderer import CairoRenderer
+
+BACKGROUND = "#0a0a0a"
+
+
+# ---------------------------
+# Text mobject cache
+# ---------------------------
+class TextCache:
+    """Parsed Text mobjects keyed by (text, font_size, weight, slant, font).
+
+    Building a Text runs Pango layout and SVG path parsing; the cache keeps
+    the resulting glyph outlines in memory (per warm worker, across jobs)
+    and pickled under `root` (across processes and restarts). Entries are
+    built in white and recoloured on the way out, so colour schemes share
+    entries. Callers always get their own copy.
+    """
+    def __init__(self, root: str = None, max_items: int = 2000, max_bytes: int = 256 * 1024 * 1024):
+        self.root = root
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._writes = 0
+        self._lock = threading.Lock()
+
+    def make_key(self, text, font_size, weight, slant, font) -> str:
+        blob = json.dumps([manim.__version__, text, font_size, str(weight), str(slant), font])
+        return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key + ".pkl")
+
+    def _load(self, key: str):
+        if not self.root:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                mob = pickle.load(f)
+            os.utime(path)
+            return mob
+        except Exception:
+            return None
+
+    def _store(self, key: str, mob):
+        if not self.root:
+            return
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as f:
+                pickle.dump(mob, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, path)
+        except Exception as e:
+            print(f"[TEXT CACHE] Could not persist entry: {e}")
+            return
+        self._writes += 1
+        if self._writes % 50 == 1:
+            self.trim()
+
+    def trim(self):
+        """Drop least recently used files until the directory fits max_bytes"""
+        entries = []
+        for root, _, files in os.walk(self.root):
+            for fname in files:
+                if fname.endswith(".pkl"):
+                    path = os.path.join(root, fname)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    entries.append((st.st_mtime, st.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    def get(self, text, font_size=48, weight=NORMAL, slant=NORMAL, font=""):
+        key = self.make_key(text, font_size, weight, slant, font)
+        with self._lock:
+            mob = self._items.get(key)
+            if mob is not None:
+                self._items.move_to_end(key)
+                self.memory_hits += 1
+        if mob is None:
+            mob = self._load(key)
+            if mob is not None:
+                self.disk_hits += 1
+            else:
+                mob = Text(text, font_size=font_size, weight=weight, slant=slant,
+                           font=font, color=WHITE)
+                self.misses += 1
+                self._store(key, mob)
+            with self._lock:
+                self._items[key] = mob
+                while len(self._items) > self.max_items:
+                    self._items.popitem(last=False)
+        return mob.copy()
+
+    def stats(self) -> dict:
+        return {"memory_hits": self.memory_hits, "disk_hits": self.disk_hits, "misses": self.misses}
+
+
+TEXT_CACHE = TextCache(os.getenv("TEXT_CACHE_DIR") or None,
+                       max_items=int(os.getenv("TEXT_CACHE_MAX_ITEMS", "2000")),
+                       max_bytes=int(os.getenv("TEXT_CACHE_MAX_MB", "256")) * 1024 * 1024)
+
+
+def cached_text(text, font_size=48, color=WHITE, weight=NORMAL, slant=NORMAL, font=""):
+    """Drop-in for Text(...) that goes through TEXT_CACHE"""
+    return TEXT_CACHE.get(text, font_size=font_size, weight=weight,
+                          slant=slant, font=font).set_color(color)
+
+
+class SegmentsScene(Scene):
+    """Render a run of segment specs.
+
+    Either pass `segments` (and `final`) to the constructor, as the warm
+    render workers do, or set `spec_path`/`first`/`last`/`final` on a
+    subclass so `python -m manim scene.py <Name>` can load it.
+    """
+    spec_path = None
+    first = 0
+    last = None
+    final = True
+    # Fade that hands a clean screen to the next scene; taken out of the
+    # last segment's own duration so the video keeps pace with the narration
+    handover_fade = 0.5
+
+    def __init__(self, segments=None, final=None, **kwargs):
+        super().__init__(**kwargs)
+        self._segments = segments
+        if final is not None:
+            self.final = final
+        # Set to a list to record the run time of every play()/wait()
+        self.timeline = None
+
+    def play(self, *args, **kwargs):
+        super().play(*args, **kwargs)
+        if self.timeline is not None:
+            self.timeline.append(round(float(self.duration), 4))
+
+    def load_segments(self) -> list:
+        if self._segments is not None:
+            return self._segments
+        with open(self.spec_path, "r", encoding="utf-8") as f:
+            return json.load(f)["segments"][self.first:self.last]
+
+    def construct(self):
+        self.camera.background_color = BACKGROUND
+        self.current_y = 3.0
+        self.line_height = 0.7
+
+        segments = self.load_segments()
+        handover = 0.0
+        if not self.final and segments:
+            handover = min(self.handover_fade, segments[-1]["duration"] / 2)
+            segments = segments[:-1] + [dict(segments[-1], duration=segments[-1]["duration"] - handover)]
+
+        for offset, seg in enumerate(segments):
+            # Clear screen for new title sections (scenes always start on a clean screen)
+            if seg["layout"] == "title" and offset > 0:
+                self.clear_screen(0.5)
+                self.current_y = 3.0
+                self.wait(0.2)
+
+            handler = getattr(self, f"layout_{seg['layout']}", self.layout_text)
+            handler(seg)
+
+            # Auto-fade old content periodically
+            if (seg["index"] + 1) % 7 == 0 and self.current_y < -2.5:
+                old_mobs = self.mobjects[:-2] if len(self.mobjects) > 2 else []
+                if old_mobs:
+                    self.play(*[mob.animate.set_opacity(0.2) for mob in old_mobs], run_time=0.4)
+                self.current_y = 2.5
+
+        stats = TEXT_CACHE.stats()
+        print(f"[TEXT CACHE] {stats['memory_hits']} memory / {stats['disk_hits']} disk hits, "
+              f"{stats['misses']} misses in this process", flush=True)
+
+        if self.final:
+            # Final hold
+            self.wait(2.0)
+            self.clear_screen(1.2)
+        elif handover > 0:
+            # Hand over a clean screen to the next scene (still spending the
+            # time when the screen is already empty)
+            if self.mobjects:
+                self.clear_screen(handover)
+            else:
+                self.wait(handover)
+
+    def clear_screen(self, run_time: float):
+        if self.mobjects:
+            self.play(*[FadeOut(m) for m in self.mobjects], run_time=run_time)
+
+    # ---------------------------
+    # Layout handlers
+    # ---------------------------
+    def layout_calculation(self, seg):
+        steps = seg["steps"]
+        notes = seg["notes"]
+        color = seg["color"]
+
+        # Distribute duration across steps
+        time_per_step = seg["duration"] / max(len(steps), 1)
+        animation_time = time_per_step * 0.7
+        wait_time = time_per_step * 0.3
+
+        step = None
+        for j, step_text in enumerate(steps):
+            step = cached_text(step_text, font_size=32, color=WHITE)
+            step.move_to([0, self.current_y, 0], aligned_edge=LEFT).shift(LEFT*5)
+
+            note_text = notes[j] if j < len(notes) else ""
+            if note_text:
+                note = cached_text(note_text, font_size=22, color=color, slant=ITALIC)
+                note.next_to(step, RIGHT, buff=0.7)
+                self.play(Write(step), FadeIn(note, shift=RIGHT*0.2), run_time=animation_time)
+            else:
+                self.play(Write(step), run_time=animation_time)
+
+            self.wait(wait_time)
+            self.current_y -= self.line_height
+
+        # Highlight answer
+        answer_box = SurroundingRectangle(step, color=color, buff=0.15,
+                                          stroke_width=3, corner_radius=0.1)
+        self.play(Create(answer_box), run_time=0.5)
+        self.wait(0.5)
+
+    def layout_step(self, seg):
+        anim_time = seg["duration"] * 0.6
+        wait_time = seg["duration"] * 0.4
+
+        label = cached_text(f"Step {seg['index'] + 1}", font_size=24, color=seg["color"], weight=BOLD)
+        label.move_to([0, self.current_y, 0], aligned_edge=LEFT).shift(LEFT*5.5)
+
+        content = cached_text(seg["text"], font_size=30, color=WHITE)
+        content.next_to(label, DOWN, buff=0.25, aligned_edge=LEFT)
+
+        self.play(FadeIn(label, shift=DOWN*0.15), run_time=0.3)
+        self.play(Write(content), run_time=anim_time)
+        self.wait(wait_time)
+
+        self.current_y -= self.line_height * 1.8
+
+    def layout_title(self, seg):
+        color = seg["color"]
+        if seg["index"] == 0:
+            anim_time = seg["duration"] * 0.5
+            wait_time = seg["duration"] * 0.3
+
+            title = cached_text(seg["text"], font_size=52, weight=BOLD, color=WHITE)
+            title.move_to(ORIGIN)
+
+            line = Line(LEFT*4.5, RIGHT*4.5, color=color, stroke_width=4)
+            line.next_to(title, DOWN, buff=0.35)
+
+            self.play(Write(title), run_time=anim_time)
+            self.play(Create(line), run_time=0.5)
+            self.wait(wait_time)
+
+            self.play(FadeOut(title, shift=UP*0.5), FadeOut(line, shift=UP*0.5), run_time=0.6)
+            self.current_y = 3.0
+        else:
+            anim_time = seg["duration"] * 0.4
+            wait_time = seg["duration"] * 0.6
+
+            header = cached_text(seg["text"], font_size=34, weight=BOLD, color=color)
+            header.to_edge(UP, buff=0.6)
+
+            line = Line(LEFT*6, RIGHT*6, color=color, stroke_width=2)
+            line.next_to(header, DOWN, buff=0.2)
+
+            self.play(Write(header), Create(line), run_time=anim_time)
+            self.current_y = 2.2
+            self.wait(wait_time)
+
+    def layout_equation(self, seg):
+        color = seg["color"]
+        anim_time = seg["duration"] * 0.7
+        wait_time = seg["duration"] * 0.3
+
+        label = cached_text("Formula:", font_size=22, color=color)
+        label.move_to([0, self.current_y, 0], aligned_edge=LEFT).shift(LEFT*5.5)
+
+        eq = cached_text(seg["text"], font_size=36, color=WHITE)
+        eq.next_to(label, RIGHT, buff=0.6)
+
+        box = SurroundingRectangle(eq, color=color, buff=0.25,
+                                   stroke_width=2, corner_radius=0.12)
+        box.set_fill(color, opacity=0.08)
+
+        self.play(Write(label), run_time=0.3)
+        self.play(Create(box), Write(eq), run_time=anim_time)
+        self.wait(wait_time)
+
+        self.current_y -= 1.0
+
+    def layout_diagram(self, seg):
+        color = seg["color"]
+        anim_time = seg["duration"] * 0.6
+        wait_time = seg["duration"] * 0.4
+
+        label = cached_text(seg["text"][:50], font_size=26, color=WHITE)
+        label.move_to([3.5, self.current_y, 0])
+
+        shape = Circle(radius=0.8, color=color, stroke_width=2, fill_opacity=0.1)
+        shape.move_to([3.5, self.current_y-1.2, 0])
+
+        self.play(Write(label), run_time=anim_time*0.4)
+        self.play(Create(shape), run_time=anim_time*0.6)
+        self.wait(wait_time)
+
+    def layout_split(self, seg):
+        color = seg["color"]
+        anim_time = seg["duration"] * 0.7
+        wait_time = seg["duration"] * 0.3
+
+        text = cached_text(seg["text"][:60], font_size=26, color=WHITE)
+        text.move_to([0, self.current_y, 0], aligned_edge=LEFT).shift(LEFT*5)
+        text.scale_to_fit_width(5)
+
+        circles = VGroup(*[
+            Circle(radius=0.2+i*0.08, color=color, stroke_width=2, fill_opacity=0.05)
+            for i in range(3)
+        ])
+        circles.move_to([4, self.current_y, 0])
+
+        self.play(FadeIn(text, shift=RIGHT*0.2), Create(circles), run_time=anim_time)
+        self.wait(wait_time)
+        self.current_y -= 1.2
+
+    def layout_example(self, seg):
+        color = seg["color"]
+        anim_time = seg["duration"] * 0.6
+        wait_time = seg["duration"] * 0.4
+
+        ex_label = cached_text("Example:", font_size=26, color=color, weight=BOLD)
+        ex_label.move_to([0, self.current_y, 0], aligned_edge=LEFT).shift(LEFT*5.5)
+
+        ex_text = cached_text(seg["text"][:70], font_size=24, color=WHITE)
+        ex_text.next_to(ex_label, DOWN, buff=0.3, aligned_edge=LEFT)
+        ex_text.scale_to_fit_width(10)
+
+        self.play(Write(ex_label), run_time=anim_time*0.3)
+        self.play(FadeIn(ex_text, shift=DOWN*0.2), run_time=anim_time*0.7)
+        self.wait(wait_time)
+
+        self.current_y -= 1.4
+
+    def layout_text(self, seg):
+        """Generic fallback for unknown layouts"""
+        anim_time = seg["duration"] * 0.7
+        wait_time = seg["duration"] * 0.3
+
+        text = cached_text(seg["text"], font_size=30, color=WHITE)
+        text.move_to([0, self.current_y, 0], aligned_edge=LEFT).shift(LEFT*5)
+        text.scale_to_fit_width(11)
+
+        self.play(Write(text), run_time=anim_time)
+        self.wait(wait_time)
+        self.current_y -= 0.9
+
+
+# ---------------------------
+# Timeline planning
+# ---------------------------
+def plan_timeline(segments: list, final: bool = True) -> list:
+    """Run time of every animation (play or wait) of a scene, in order.
+
+    The scene is run with animations skipped and nothing written, so this
+    costs the mobject construction only. Animation i here is animation i of
+    a real render, which is what from/upto_animation_number count.
+    """
+    with tempconfig({"dry_run": True, "skip_animations": True, "disable_caching": True}):
+        scene = SegmentsScene(segments=segments, final=final)
+        scene.timeline = []
+        scene.render()
+    return scene.timeline
+
+
+def scenes_from_spec(spec_path: str) -> list:
+    """[(name, segments, final)] for every scene of a scene_spec.json, in order"""
+    with open(spec_path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    spec = data["segments"]
+    scenes = data.get("scenes") or [{"name": "GeneratedScene", "first": 0, "last": len(spec), "final": True}]
+    return [(s["name"], spec[s["first"]:s["last"]], s["final"]) for s in scenes]
+
+
+def scene_from_spec(spec_path: str, name: str) -> tuple:
+    """(segments, final) of scene `name` in a scene_spec.json"""
+    for scene_name, segments, final in scenes_from_spec(spec_path):
+        if scene_name == name:
+            return segments, final
+    raise KeyError(f"No scene {name} in {spec_path}")
+
+
+# ---------------------------
+# Single-pass piped output
+# ---------------------------
+class FramePipe:
+    """One ffmpeg process encoding raw RGBA frames (and the narration) into an mp4"""
+    def __init__(self, out_path: str, width: int, height: int, fps: float, audio_path: str = None):
+        cmd = [
+            "ffmpeg", "-y", "-loglevel", "error",
+            "-f", "rawvideo", "-pix_fmt", "rgba",
+            "-s", f"{width}x{height}", "-r", str(fps),
+            "-i", "-",
+        ]
+        if audio_path:
+            # Narration is already AAC; copy it in rather than muxing afterwards
+            cmd += ["-i", audio_path, "-map", "0:v:0", "-map", "1:a:0", "-c:a", "copy"]
+        cmd += [
+            "-c:v", "libx264", "-pix_fmt", "yuv420p",
+            "-movflags", "+faststart",
+            "-f", "mp4", out_path,
+        ]
+        self.out_path = out_path
+        self.frames = 0
+        self.process = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+
+    def write(self, frame, num_frames: int = 1):
+        data = frame.tobytes()
+        try:
+            for _ in range(num_frames):
+                self.process.stdin.write(data)
+        except (BrokenPipeError, OSError):
+            raise RuntimeError(f"ffmpeg exited while encoding (code {self.process.wait()})")
+        self.frames += num_frames
+
+    def close(self):
+        self.process.stdin.close()
+        if self.process.wait() != 0:
+            raise RuntimeError(f"ffmpeg failed with code {self.process.returncode}")
+        return self.out_path
+
+    def abort(self):
+        self.process.kill()
+        self.process.wait()
+
+
+class PipeRenderer(CairoRenderer):
+    """CairoRenderer that hands frames to a FramePipe instead of a SceneFileWriter.
+
+    Run with write_to_movie off, so the file writer makes no partial movies
+    and no per-scene mp4; several scenes can share one pipe back to back.
+    """
+    def __init__(self, pipe: FramePipe, **kwargs):
+        super().__init__(**kwargs)
+        self.pipe = pipe
+
+    def add_frame(self, frame, num_frames=1):
+        if self.skip_animations:
+            return
+        self.time += num_frames / self.camera.frame_rate
+        self.pipe.write(frame, num_frames)
+
+
+def render_piped(scenes: list, out_path: str, audio_path: str = None,
+                 quality: str = "low_quality") -> str:
+    """Render (segments, final) scenes in order into one mp4 with the narration"""
+    options = {"quality": quality, "write_to_movie": False,
+               "save_last_frame": False, "disable_caching": True}
+    with tempconfig(options):
+        pipe = FramePipe(out_path, config.pixel_width, config.pixel_height,
+                         config.frame_rate, audio_path)
+        try:
+            for segments, final in scenes:
+                SegmentsScene(segments=segments, final=final,
+                              renderer=PipeRenderer(pipe)).render()
+        except BaseException:
+            pipe.abort()
+            raise
+        pipe.close()
+    print(f"Piped {pipe.frames} frames into {out_path}", flush=True)
+    return out_path
+
+
+def main(argv: list = None):
+    import argparse
+    parser = argparse.ArgumentParser(prog="python -m scene_runtime")
+    commands = parser.add_subparsers(dest="command", required=True)
+    plan = commands.add_parser("plan", help="print the animation timeline of a scene as JSON")
+    plan.add_argument("spec")
+    plan.add_argument("scene")
+    pipe = commands.add_parser("pipe", help="render all scenes of a spec into one mp4")
+    pipe.add_argument("spec")
+    pipe.add_argument("output")
+    pipe.add_argument("--audio", help="narration to mux in (stream copied)")
+    pipe.add_argument("--quality", default="low_quality")
+    args = parser.parse_args(argv)
+
+    if args.command == "plan":
+        segments, final = scene_from_spec(args.spec, args.scene)
+        timeline = plan_timeline(segments, final)
+        # Manim logs to the same stream; the caller looks for this prefix
+        print("TIMELINE " + json.dumps(timeline), flush=True)
+    elif args.command == "pipe":
+        scenes = [(segments, final) for _, segments, final in scenes_from_spec(args.spec)]
+        render_piped(scenes, args.output, args.audio, args.quality)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,18 @@
+import os
+import shutil
+import sys
+import tempfile
+
+# main does its setup at import time (output folder, SQLite index, caches),
+# so point all of it at a scratch directory before any test imports it.
+SCRATCH = tempfile.mkdtemp(prefix="vidgen_tests_")
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("WARM_RENDER_WORKERS", "0")
+os.environ["OUTPUT_DIR"] = os.path.join(SCRATCH, "generated_videos")
+os.environ["INDEX_DB"] = os.path.join(SCRATCH, "generated_videos", "_index.sqlite3")
+os.environ["CACHE_DIR"] = os.path.join(SCRATCH, "cache")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(SCRATCH, ignore_errors=True)
@@ -0,0 +1,42 @@
+import json
+
+from main import SegmentStreamParser
+
+SEGMENTS = [
+    {"narration": "First {brace} in a string", "layout": "title"},
+    {"narration": "Second \"quoted\" text", "layout": "step", "step_data": {"calculation_steps": ["x = 1"]}},
+    {"narration": "Third", "layout": "text"},
+]
+DOCUMENT = json.dumps({"title": "T", "segments": SEGMENTS, "complexity": "simple"})
+
+
+def feed_all(parser, chunks):
+    found = []
+    for chunk in chunks:
+        found.extend(parser.feed(chunk))
+    return found
+
+
+def test_several_segments_in_one_chunk_get_their_own_index():
+    found = feed_all(SegmentStreamParser(), [DOCUMENT])
+    assert found == list(enumerate(SEGMENTS))
+
+
+def test_segments_split_across_chunks():
+    for size in (1, 3, 7, 40):
+        chunks = [DOCUMENT[i:i + size] for i in range(0, len(DOCUMENT), size)]
+        assert feed_all(SegmentStreamParser(), chunks) == list(enumerate(SEGMENTS))
+
+
+def test_unparseable_segment_does_not_shift_later_indexes():
+    text = '{"segments": [{"a": 1}, {"b": nope}, {"c": 3}]}'
+    parser = SegmentStreamParser()
+    assert feed_all(parser, [text[:20], text[20:]]) == [(0, {"a": 1}), (2, {"c": 3})]
+    assert parser.count == 3
+
+
+def test_nothing_after_the_array_closes():
+    parser = SegmentStreamParser()
+    found = feed_all(parser, [DOCUMENT, '{"segments": [{"late": true}]}'])
+    assert [idx for idx, _ in found] == [0, 1, 2]
+    assert parser.done
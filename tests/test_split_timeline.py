@@ -0,0 +1,40 @@
+from main import split_timeline
+
+
+def lengths(durations, ranges):
+    return [sum(durations[first:last + 1]) for first, last in ranges]
+
+
+def covers_in_order(durations, ranges):
+    flat = [i for first, last in ranges for i in range(first, last + 1)]
+    return flat == list(range(len(durations)))
+
+
+def test_dominant_last_animation_still_gets_cut_before():
+    durations = [1, 1, 1, 10]
+    ranges = split_timeline(durations, 3)
+    assert covers_in_order(durations, ranges)
+    assert len(ranges) == 3
+    assert ranges[-1] == (3, 3)
+
+
+def test_dominant_first_animation_gets_its_own_slice():
+    durations = [10, 1, 1, 1]
+    ranges = split_timeline(durations, 3)
+    assert covers_in_order(durations, ranges)
+    assert len(ranges) == 3
+    assert ranges[0] == (0, 0)
+
+
+def test_more_parts_than_animations():
+    assert split_timeline([2, 3], 5) == [(0, 0), (1, 1)]
+    assert split_timeline([4], 3) == [(0, 0)]
+    assert split_timeline([], 3) == []
+
+
+def test_balances_the_longest_slice():
+    durations = [3, 1, 1, 1, 3, 1]
+    ranges = split_timeline(durations, 2)
+    assert covers_in_order(durations, ranges)
+    assert max(lengths(durations, ranges)) == 5
+    assert split_timeline([1] * 8, 4) == [(0, 1), (2, 3), (4, 5), (6, 7)]